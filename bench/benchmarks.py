@@ -0,0 +1,248 @@
+# The workloads bench/run.py times, each calling the real plug-in functions with the fake
+# gimpfu from bench/fakegimp. A benchmark's setup runs once and returns (prepare, run):
+# prepare() (or None) builds fresh input for every repetition outside the timing, and
+# run(input) is what gets timed.
+import os
+import random
+import tempfile
+
+try:
+	import imp
+except ImportError:
+	imp = None
+	import importlib.util
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+try:
+	xrange
+except NameError:
+	xrange = range
+
+class Benchmark:
+	def __init__(self, name, setup):
+		self.name = name
+		self.setup = setup
+
+	def __repr__(self):
+		return self.__str__()
+
+	def __str__(self):
+		return "Benchmark: name '%s'" % self.name
+
+BENCHMARKS = []
+
+def benchmark(name):
+	def add(setup):
+		BENCHMARKS.append(Benchmark(name, setup))
+		return setup
+	return add
+
+SCRIPTS = {}
+
+def load_script(relative_path):
+	# the plug-ins are hyphenated files, not importable modules
+	if relative_path not in SCRIPTS:
+		path = os.path.join(REPO_DIR, relative_path)
+		name = 'bench_' + os.path.splitext(os.path.basename(path))[0].replace('-', '_')
+		if imp is not None:
+			SCRIPTS[relative_path] = imp.load_source(name, path)
+		else:
+			spec = importlib.util.spec_from_file_location(name, path)
+			module = importlib.util.module_from_spec(spec)
+			spec.loader.exec_module(module)
+			SCRIPTS[relative_path] = module
+	return SCRIPTS[relative_path]
+
+def text_split():
+	return load_script(os.path.join('typesetting', 'gimp-typesetting-text-split.py'))
+
+def sample_markup(glyph_count, seed=1):
+	# GIMP style markup: runs of plain, bold, italic, nested, coloured and font changed text
+	rng = random.Random(seed)
+	words = [u'the', u'quick', u'brown', u'fox', u'jumps', u'over', u'lazy', u'dog', u'BAM!', u'...']
+	parts = [u'<markup>']
+	count = 0
+	while count < glyph_count:
+		text = u' '.join(rng.choice(words) for i in range(rng.randint(2, 8)))
+		count += len(text)
+		style = rng.randint(0, 5)
+		if style == 0:
+			parts.append(text)
+		elif style == 1:
+			parts.append(u'<b>%s</b>' % text)
+		elif style == 2:
+			parts.append(u'<i><u>%s</u></i>' % text)
+		elif style == 3:
+			parts.append(u'<span foreground="#%06x">%s</span>' % (rng.randint(0, 0xffffff), text))
+		elif style == 4:
+			parts.append(u'<span font="Sans Bold"><s>%s</s></span>' % text)
+		else:
+			parts.append(u'<b><span foreground="#ff0000" font="Serif">%s</span></b>' % text)
+	parts.append(u'</markup>')
+	return u''.join(parts)
+
+@benchmark('markup_5k_glyphs')
+def markup_5k_glyphs():
+	split = text_split()
+	markup = sample_markup(5000)
+	defaults = split.glyph_font_attributes('Sans', 30)
+	def run(unused):
+		split.gimp_markup_parser.from_markup_text(markup).get_glyph_packets(defaults)
+	return None, run
+
+@benchmark('markup_5k_glyphs_spans')
+def markup_5k_glyphs_spans():
+	split = text_split()
+	markup = sample_markup(5000)
+	defaults = split.glyph_font_attributes('Sans', 30)
+	def run(unused):
+		split.gimp_markup_parser.from_markup_text(markup).get_glyph_spans(defaults)
+	return None, run
+
+@benchmark('font_size_curves_10k_steps')
+def font_size_curves_10k_steps():
+	split = text_split()
+	curves = split.sizecurves
+	params = split.font_size_interpolation_params(20, 40, 10, 60, curves.parse_control_points('0:20, 0.3:55, 1:40'))
+	steps = 10000
+	def run(unused):
+		for name in curves.names():
+			curves.sizes(name, params, steps)
+	return None, run
+
+def sample_file_names(count, extensions):
+	return ['ch%03d/p%04d%s' % (index // 200, index % 200, extensions[index % len(extensions)]) for index in xrange(count)]
+
+@benchmark('export_filename_map_100k')
+def export_filename_map_100k():
+	export = load_script(os.path.join('workflow', 'gimp-batch-image-export-jpg.py'))
+	names = sample_file_names(100000, ['.xcf', '.xcf', '.XCF', '.jpg', '.xcf.part'])
+	def run(unused):
+		export.generate_new_filename_map(names)
+	return None, run
+
+@benchmark('prep_filename_map_100k')
+def prep_filename_map_100k():
+	prep = load_script(os.path.join('workflow', 'gimp-batch-image-prep-xcf.py'))
+	names = sample_file_names(100000, ['.jpg', '.jpeg', '.PNG', '.xcf', '.txt'])
+	def run(unused):
+		prep.generate_new_filename_map(names)
+	return None, run
+
+def outline_image(outline, child_count):
+	# a group of text and plain layers, every tenth a sub group of ten more
+	gimp = outline.gimp
+	image = gimp.Image()
+	group = gimp.GroupLayer(image, 'Text Group')
+	gimp.insert_layer(image, group, None, 0)
+	index = 0
+	while index < child_count:
+		if index % 10 == 9:
+			sub_group = gimp.GroupLayer(image, 'Sub Group %d' % index)
+			gimp.insert_layer(image, sub_group, group, len(group.children))
+			for sub_index in range(10):
+				gimp.insert_layer(image, gimp.TextLayer(image, 'bubble %d' % sub_index), sub_group, len(sub_group.children))
+			index += 10
+		elif index % 3 == 0:
+			gimp.insert_layer(image, gimp.Layer(image, 'SFX %d' % index, 200, 100), group, len(group.children))
+			index += 1
+		else:
+			gimp.insert_layer(image, gimp.TextLayer(image, 'line %d' % index), group, len(group.children))
+			index += 1
+	return image, group
+
+def outline_benchmark(merge_layers):
+	outline = load_script(os.path.join('typesetting', 'gimp-typesetting-outline.py'))
+	color = outline.gimpcolor.RGB(1.0, 1.0, 1.0, 1.0)
+	def prepare():
+		return outline_image(outline, 300)
+	def run(image_group):
+		image, group = image_group
+		outline.solid_outline_layer_group_layer(image, group, color, 4, merge_layers)
+	return prepare, run
+
+@benchmark('outline_group_300_children')
+def outline_group_300_children():
+	return outline_benchmark(False)
+
+@benchmark('outline_group_300_children_merged')
+def outline_group_300_children_merged():
+	return outline_benchmark(True)
+
+def split_image(split, text):
+	gimp = split.gimp
+	image = gimp.Image()
+	layer = gimp.TextLayer(image, text, 'Sans Bold', 40)
+	gimp.insert_layer(image, layer, None, 0)
+	image.active_layer = layer
+	return image, layer
+
+@benchmark('split_sfx_300_glyphs')
+def split_sfx_300_glyphs():
+	split = text_split()
+	text = u''.join(u'KRA-KOOOM! ' for i in range(28))[:300]
+	packets = split.gimp_markup_parser.glyph_packets_from_text(text, split.glyph_font_attributes('Sans Bold', 40))
+	def prepare():
+		image, layer = split_image(split, text)
+		return image, layer, split.create_split_text_layer_group(image, layer)
+	def run(image_layer_group):
+		image, layer, text_group = image_layer_group
+		split.get_displayable_glyph_positions_add_to_group(image, layer, False, text_group, packets)
+	return prepare, run
+
+@benchmark('split_font_steps_300_glyphs_cached')
+def split_font_steps_300_glyphs_cached():
+	# the whole split with a font size curve, against a glyph cache the first repetition fills
+	split = text_split()
+	text = u''.join(u'KRA-KOOOM! ' for i in range(28))[:300]
+	split.glyphcache.CACHE_PATH = os.path.join(tempfile.mkdtemp(), 'glyph-cache.json')
+	params = split.font_size_interpolation_params(20, 60, 10, 80)
+	def prepare():
+		return split_image(split, text)
+	def run(image_layer):
+		image, layer = image_layer
+		split.layer_text_by_letter_with_font_step(image, layer, 40, False, params, split.font_size_functions.LINEAR)
+	return prepare, run
+
+def wavy_strokes(stroke_count, anchor_count):
+	# strokes of s curves across the page, as GIMP's (in handle, anchor, out handle) triples
+	strokes = []
+	for stroke in range(stroke_count):
+		points = []
+		for anchor in range(anchor_count):
+			x = 100.0 + anchor * 80.0
+			y = 200.0 + stroke * 300.0 + (40.0 if anchor % 2 else -40.0)
+			points.extend([x - 30.0, y, x, y, x + 30.0, y])
+		strokes.append(points)
+	return strokes
+
+@benchmark('path_positions_3_strokes_300_glyphs')
+def path_positions_3_strokes_300_glyphs():
+	split = text_split()
+	gimp = split.gimp
+	vectors = gimp.Vectors(gimp.Image(), 'Path', strokes=wavy_strokes(3, 12))
+	def run(unused):
+		positions = split.center_points.vector_interpolate_even(vectors, 300)
+		for index in range(300):
+			positions.get_next_center_point()
+	return None, run
+
+@benchmark('split_group_30_sfx_layers')
+def split_group_30_sfx_layers():
+	# a page's SFX group, every layer split in one go
+	split = text_split()
+	gimp = split.gimp
+	split.glyphcache.CACHE_PATH = os.path.join(tempfile.mkdtemp(), 'glyph-cache.json')
+	words = [u'BAM!', u'KRA-KOOOM!', u'WHOOSH', u'THUD', u'ZZZAP!']
+	def prepare():
+		image = gimp.Image()
+		group = gimp.GroupLayer(image, 'SFX Text Group')
+		gimp.insert_layer(image, group, None, 0)
+		for index in range(30):
+			gimp.insert_layer(image, gimp.TextLayer(image, words[index % len(words)], 'Sans Bold', 40), group, len(group.children))
+		image.active_layer = group
+		return image
+	def run(image):
+		split.layer_text_by_letter_in_group(image, 40, False)
+	return prepare, run
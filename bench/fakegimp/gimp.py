@@ -0,0 +1,226 @@
+# Stand-in for GIMP 2.8's gimp module, see gimpfu.py here. Images, layers and vectors
+# keep just enough state (names, parents, stacking order, sizes) for the plug-ins' logic
+# to run, pixels are never touched.
+import gimpcolor
+
+RGB = 0
+GRAY = 1
+
+class Item:
+	def __init__(self, image, name):
+		self.image = image
+		self.name = name
+		self.parent = None
+		self.visible = True
+
+	def __repr__(self):
+		return self.__str__()
+
+	def __str__(self):
+		return "%s: name '%s'" % (self.__class__.__name__, self.name)
+
+class Layer(Item):
+	def __init__(self, image, name, width=1, height=1, type=0, opacity=100, mode=0):
+		Item.__init__(self, image, name)
+		self.width = width
+		self.height = height
+		self.type = type
+		self.opacity = opacity
+		self.mode = mode
+		self.offsets = (0, 0)
+		self.is_group = False
+		self.bpp = 4
+
+class TextLayer(Layer):
+	def __init__(self, image, text, font='Sans', size=30):
+		# roughly a glyph's box, so centering and outlines have something to work with
+		Layer.__init__(self, image, text, max(1, int(size * 0.6 * len(text))), max(1, int(size * 1.2)))
+		self.text = text
+		self.font = font
+		self.size = size
+		self.color = gimpcolor.RGB()
+
+class GroupLayer(Layer):
+	def __init__(self, image, name='Layer Group'):
+		Layer.__init__(self, image, name)
+		self.children = []
+		self.is_group = True
+
+	@property
+	def layers(self):
+		# a fresh list like GIMP's, so callers may add layers while iterating
+		return list(self.children)
+
+class Vectors(Item):
+	def __init__(self, image, name='Path', length=1000.0, strokes=None):
+		Item.__init__(self, image, name)
+		self.length = length
+		# bezier control points of each stroke, by default one straight stroke of length
+		if strokes is None:
+			strokes = [[0.0, 0.0, 0.0, 0.0, 0.0, 0.0, length, 0.0, length, 0.0, length, 0.0]]
+		self.strokes = strokes
+
+class Image:
+	def __init__(self, width=1000, height=1500, base_type=RGB):
+		self.width = width
+		self.height = height
+		self.base_type = base_type
+		self.children = []
+		self.active_layer = None
+		self.active_vectors = None
+		self.vectors = []
+
+	def __repr__(self):
+		return self.__str__()
+
+	def __str__(self):
+		return "Image: '%dx%d', layers '%d'" % (self.width, self.height, len(self.children))
+
+	@property
+	def layers(self):
+		return list(self.children)
+
+	@property
+	def active_drawable(self):
+		return self.active_layer
+
+def siblings(image, item):
+	if item.parent is not None:
+		return item.parent.children
+	return image.children
+
+def insert_layer(image, layer, parent, position):
+	layer.image = image
+	layer.parent = parent
+	stack = parent.children if parent is not None else image.children
+	stack.insert(min(max(0, position), len(stack)), layer)
+
+def merge_down(image, layer, merge_type):
+	stack = siblings(image, layer)
+	index = stack.index(layer)
+	below = stack[index + 1]
+	merged = Layer(image, below.name, max(layer.width, below.width), max(layer.height, below.height))
+	merged.parent = layer.parent
+	stack[index:index + 2] = [merged]
+	return merged
+
+def copy_layer(layer, add_alpha):
+	if isinstance(layer, TextLayer):
+		copy = TextLayer(layer.image, layer.text, layer.font, layer.size)
+		copy.color = layer.color
+	else:
+		copy = Layer(layer.image, layer.name, layer.width, layer.height, layer.type, layer.opacity, layer.mode)
+	copy.name = layer.name + ' copy'
+	return copy
+
+def remove_item(image, item):
+	siblings(image, item).remove(item)
+	item.parent = None
+
+def set_text(layer, text):
+	layer.text = layer.name = text # auto rename, like GIMP's text layers
+	layer.width = max(1, int(layer.size * 0.6 * len(text)))
+
+# pdb procedure: what it returns, from its arguments
+HANDLERS = {
+	'gimp_item_is_group': lambda item: isinstance(item, GroupLayer),
+	'gimp_item_is_layer': lambda item: isinstance(item, Layer),
+	'gimp_item_is_text_layer': lambda item: isinstance(item, TextLayer),
+	'gimp_item_get_parent': lambda item: item.parent,
+	'gimp_item_get_visible': lambda item: item.visible,
+	'gimp_item_set_visible': lambda item, visible: setattr(item, 'visible', visible),
+	'gimp_image_get_item_position': lambda image, item: siblings(image, item).index(item),
+	'gimp_image_insert_layer': insert_layer,
+	'gimp_image_remove_layer': remove_item,
+	'gimp_layer_copy': copy_layer,
+	'gimp_image_merge_down': merge_down,
+	'gimp_image_get_active_layer': lambda image: image.active_layer,
+	'gimp_image_get_active_vectors': lambda image: image.active_vectors,
+	'gimp_image_list': lambda: (0, []),
+	'gimp_layer_group_new': lambda image: GroupLayer(image),
+	'gimp_layer_set_offsets': lambda layer, x, y: setattr(layer, 'offsets', (int(x), int(y))),
+	'gimp_vectors_new_from_text_layer': lambda image, layer: Vectors(image, layer.name),
+	'gimp_vectors_get_strokes': lambda vectors: (len(vectors.strokes), list(range(1, len(vectors.strokes) + 1))),
+	'gimp_vectors_stroke_get_points': lambda vectors, stroke: (0, len(vectors.strokes[stroke - 1]), vectors.strokes[stroke - 1], False),
+	'gimp_vectors_stroke_get_length': lambda vectors, stroke, precision: vectors.length,
+	'gimp_vectors_stroke_get_point_at_dist': lambda vectors, stroke, distance, precision: (distance, 0.0, 0.0, True),
+	'gimp_vectors_get_visible': lambda vectors: vectors.visible,
+	'gimp_palette_get_foreground': lambda: gimpcolor.RGB(),
+	'gimp_message_get_handler': lambda: 0,
+	'gimp_text_layer_new': lambda image, text, font, size, unit: TextLayer(image, text, font, size),
+	'gimp_text_layer_get_text': lambda layer: layer.text,
+	'gimp_text_layer_get_markup': lambda layer: None,
+	'gimp_text_layer_get_font': lambda layer: layer.font,
+	'gimp_text_layer_get_font_size': lambda layer: (layer.size, 0),
+	'gimp_text_layer_get_color': lambda layer: layer.color,
+	'gimp_text_layer_get_base_direction': lambda layer: 0,
+	'gimp_text_layer_get_antialias': lambda layer: True,
+	'gimp_text_layer_get_hint_style': lambda layer: 0,
+	'gimp_text_layer_get_hinting': lambda layer: (True, False),
+	'gimp_text_layer_get_indent': lambda layer: 0.0,
+	'gimp_text_layer_get_justification': lambda layer: 0,
+	'gimp_text_layer_get_kerning': lambda layer: False,
+	'gimp_text_layer_get_language': lambda layer: '',
+	'gimp_text_layer_get_letter_spacing': lambda layer: 0.0,
+	'gimp_text_layer_get_line_spacing': lambda layer: 0.0,
+	'gimp_text_layer_set_text': set_text,
+	'gimp_text_layer_set_font': lambda layer, font: setattr(layer, 'font', font),
+	'gimp_text_layer_set_font_size': lambda layer, size, unit: setattr(layer, 'size', size),
+	'gimp_text_layer_set_color': lambda layer, color: setattr(layer, 'color', color),
+}
+
+# Rough seconds per call of GIMP 2.8 on an artist's machine, only meant to weigh call counts
+# against each other. Recalibrate from GIMP_WORKFLOW_PROFILE reports of real runs.
+DEFAULT_COST = 0.0001
+COSTS = {
+	'gimp_text_layer_new': 0.004,
+	'gimp_text_layer_set_text': 0.003,
+	'gimp_text_layer_set_font': 0.002,
+	'gimp_text_layer_set_font_size': 0.002,
+	'gimp_image_insert_layer': 0.0005,
+	'gimp_layer_copy': 0.001,
+	'gimp_image_merge_down': 0.005,
+	'gimp_edit_bucket_fill': 0.003,
+	'gimp_selection_grow': 0.002,
+	'gimp_vectors_to_selection': 0.002,
+	'gimp_image_select_item': 0.001,
+	'plug_in_autocrop_layer': 0.003,
+	'gimp_vectors_stroke_get_length': 0.001,
+	'gimp_vectors_stroke_get_point_at_dist': 0.001,
+}
+
+class FakePdb:
+	# Records every call by procedure name and adds up its simulated cost.
+	def __init__(self):
+		self.reset()
+
+	def __repr__(self):
+		return self.__str__()
+
+	def __str__(self):
+		return "FakePdb: calls '%d', simulated '%.3f's" % (sum(self.calls.values()), self.simulated_seconds)
+
+	def reset(self):
+		self.calls = {}
+		self.simulated_seconds = 0.0
+
+	def __getattr__(self, name):
+		if name.startswith('__'):
+			raise AttributeError(name)
+		handler = HANDLERS.get(name)
+		cost = COSTS.get(name, DEFAULT_COST)
+		def procedure(*args):
+			self.calls[name] = self.calls.get(name, 0) + 1
+			self.simulated_seconds += cost
+			if handler is not None:
+				return handler(*args)
+			return None
+		return procedure
+
+	def __getitem__(self, name):
+		return self.__getattr__(name.replace('-', '_'))
+
+pdb = FakePdb()
+
+def image_list():
+	return []
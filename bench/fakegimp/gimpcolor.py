@@ -0,0 +1,26 @@
+# Stand-in for GIMP 2.8's gimpcolor, see gimpfu.py here.
+
+class RGB:
+	def __init__(self, r=0.0, g=0.0, b=0.0, a=1.0):
+		self.r = r
+		self.g = g
+		self.b = b
+		self.a = a
+
+	def __repr__(self):
+		return self.__str__()
+
+	def __str__(self):
+		return "RGB: r '%s', g '%s', b '%s', a '%s'" % (self.r, self.g, self.b, self.a)
+
+	def __eq__(self, other):
+		return isinstance(other, RGB) and (self.r, self.g, self.b, self.a) == (other.r, other.g, other.b, other.a)
+
+	def __ne__(self, other):
+		return not self.__eq__(other)
+
+def rgb_parse_hex(hex_color):
+	hex_color = hex_color.lstrip('#')
+	if len(hex_color) == 3:
+		hex_color = ''.join(digit * 2 for digit in hex_color)
+	return RGB(int(hex_color[0:2], 16) / 255.0, int(hex_color[2:4], 16) / 255.0, int(hex_color[4:6], 16) / 255.0)
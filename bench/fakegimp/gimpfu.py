@@ -0,0 +1,44 @@
+# Stand-in for GIMP 2.8's gimpfu, so the plug-in scripts import and run outside GIMP for
+# benchmarking. Put this directory first on sys.path (bench/run.py does). pdb is a
+# gimp.FakePdb that counts calls and adds up simulated costs instead of doing any work.
+import gimp
+import gimpcolor
+
+pdb = gimp.pdb
+
+# gimpenums used by the scripts
+RGB = gimp.RGB
+GRAY = gimp.GRAY
+RGB_IMAGE = 0
+RGBA_IMAGE = 1
+GRAY_IMAGE = 2
+GRAYA_IMAGE = 3
+NORMAL_MODE = 0
+
+PF_INT = 'int'
+PF_FLOAT = 'float'
+PF_STRING = 'string'
+PF_TEXT = 'text'
+PF_BOOL = 'bool'
+PF_TOGGLE = 'toggle'
+PF_SLIDER = 'slider'
+PF_SPINNER = 'spinner'
+PF_OPTION = 'option'
+PF_RADIO = 'radio'
+PF_COLOR = 'color'
+PF_FILE = 'file'
+PF_DIRNAME = 'dirname'
+PF_IMAGE = 'image'
+PF_DRAWABLE = 'drawable'
+
+# procedure name: the function it runs, for benchmarks that go through registration
+REGISTERED = {}
+
+def N_(message):
+	return message
+
+def register(proc_name, blurb, help, author, copyright, date, label, imagetypes, params, results, function, menu=None, domain=None, on_query=None, on_run=None):
+	REGISTERED[proc_name] = function
+
+def main():
+	pass
@@ -0,0 +1,124 @@
+# Times the plug-ins' pure python work without GIMP, against bench/fakegimp's stand-in
+# pdb, and compares with earlier runs so slowdowns show up before a release:
+#   python bench/run.py                 run everything, compare with the last saved run
+#   python bench/run.py --save          also append this run to bench/results.jsonl
+#   python bench/run.py --only markup   just the benchmarks whose name contains 'markup'
+# Run it with the python GIMP uses (2.7 for GIMP 2.8), runs are only compared with runs
+# of the same python on the same host. Exits with 1 when a benchmark got slower than
+# --threshold times its last saved best.
+import argparse
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, os.path.join(BENCH_DIR, 'fakegimp'))
+sys.path.insert(0, BENCH_DIR)
+
+import gimp
+import benchmarks
+
+RESULTS_FILE = os.path.join(BENCH_DIR, 'results.jsonl')
+
+if hasattr(time, 'perf_counter'):
+	timer = time.perf_counter
+elif os.name == 'nt':
+	timer = time.clock
+else:
+	timer = time.time
+
+def python_version():
+	return '%d.%d' % sys.version_info[:2]
+
+def git_commit():
+	try:
+		return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR).decode('ascii').strip()
+	except (OSError, subprocess.CalledProcessError):
+		return ''
+
+def run_benchmark(bench, repeat):
+	prepare, run = bench.setup()
+	timings = []
+	for index in range(repeat):
+		data = prepare() if prepare is not None else None
+		gimp.pdb.reset()
+		start = timer()
+		run(data)
+		timings.append(timer() - start)
+	return {
+		'best': min(timings),
+		'mean': sum(timings) / len(timings),
+		'pdb_calls': sum(gimp.pdb.calls.values()),
+		'simulated_pdb_seconds': gimp.pdb.simulated_seconds,
+	}
+
+def load_runs():
+	runs = []
+	if not os.path.exists(RESULTS_FILE):
+		return runs
+	with open(RESULTS_FILE, 'r') as f:
+		for line in f:
+			if line.strip():
+				runs.append(json.loads(line))
+	return runs
+
+def last_comparable_run(runs):
+	host = socket.gethostname()
+	for run in reversed(runs):
+		if run.get('python') == python_version() and run.get('host') == host:
+			return run
+	return None
+
+def save_run(results):
+	run = {
+		'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+		'commit': git_commit(),
+		'python': python_version(),
+		'host': socket.gethostname(),
+		'platform': platform.platform(),
+		'results': results,
+	}
+	with open(RESULTS_FILE, 'a') as f:
+		f.write(json.dumps(run, sort_keys=True) + '\n')
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description="Benchmarks the plug-in scripts against a fake gimpfu.")
+	parser.add_argument('--repeat', type=int, default=5, help="runs per benchmark, the best counts")
+	parser.add_argument('--only', default='', help="only benchmarks whose name contains this")
+	parser.add_argument('--save', action='store_true', help="append the results to %s" % RESULTS_FILE)
+	parser.add_argument('--threshold', type=float, default=1.25, help="slowdown against the last saved run that fails")
+	args = parser.parse_args(argv)
+
+	baseline = last_comparable_run(load_runs())
+	results = {}
+	slower = []
+	sys.stdout.write("%-36s %10s %10s %10s %12s %8s\n" % ('benchmark', 'best ms', 'mean ms', 'pdb calls', 'simulated s', 'vs last'))
+	for bench in benchmarks.BENCHMARKS:
+		if args.only not in bench.name:
+			continue
+		result = run_benchmark(bench, max(1, args.repeat))
+		results[bench.name] = result
+		ratio = ''
+		if baseline is not None and bench.name in baseline['results']:
+			change = result['best'] / max(baseline['results'][bench.name]['best'], 1e-9)
+			ratio = '%.2fx' % change
+			if change > args.threshold:
+				slower.append(bench.name)
+		sys.stdout.write("%-36s %10.2f %10.2f %10d %12.3f %8s\n" % (bench.name, result['best'] * 1000, result['mean'] * 1000, result['pdb_calls'], result['simulated_pdb_seconds'], ratio))
+	if baseline is not None:
+		sys.stdout.write("compared with %s (%s)\n" % (baseline['time'], baseline['commit'] or 'no commit'))
+	if args.save:
+		save_run(results)
+	if slower:
+		sys.stdout.write("slower than %.2fx the last run: %s\n" % (args.threshold, ', '.join(slower)))
+		return 1
+	return 0
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,3 @@
+# Shared helpers for the workflow and typesetting plug-ins.
+# GIMP only looks for plug-ins at the top of the plug-ins directory, so this
+# package can be copied next to the scripts without being registered itself.
@@ -0,0 +1,97 @@
+# Streams exported pages straight into a .cbz/.zip instead of .jpg files, so a chapter
+# isn't written, read back and zipped a second time. Pages are stored, not deflated
+# (jpeg doesn't compress any further), in natural page order (p2 before p10), and the
+# archive only appears under its name once it's complete.
+import os
+import re
+import threading
+import time
+import zipfile
+
+from gimp_workflow import journal
+
+ARCHIVE_EXTENSIONS = ('.cbz', '.zip')
+
+def natural_key(name):
+	# 'p10.jpg' after 'p2.jpg': digit runs compare as numbers
+	parts = re.split(r'(\d+)', name.replace(os.sep, '/').lower())
+	return [int(part) if index % 2 else part for index, part in enumerate(parts)]
+
+def natural_sorted(names):
+	return sorted(names, key=natural_key)
+
+def member_name(name):
+	# zip members always use forward slashes
+	return name.replace(os.sep, '/')
+
+class PageArchive:
+	# names are every page expected, in the order they go into the archive. Pages may be
+	# added in any order and from any thread, each is written as soon as every page
+	# before it was added (or skipped), so only pages that finished early wait in memory.
+	def __init__(self, path, names):
+		self.path = path
+		self.order = natural_sorted(names)
+		self.next_index = 0
+		self.waiting = {} # name: jpeg bytes, None for a skipped page
+		self.written = 0
+		self.lock = threading.Lock()
+		self.tmp_path = journal.partial_path(path)
+		self.file = open(self.tmp_path, 'wb')
+		self.zip = zipfile.ZipFile(self.file, 'w', zipfile.ZIP_STORED, True)
+
+	def __repr__(self):
+		return self.__str__()
+
+	def __str__(self):
+		return "PageArchive: path '%s', pages '%d', written '%d', waiting '%d'" % (self.path, len(self.order), self.written, len(self.waiting))
+
+	def write(self, name, data):
+		info = zipfile.ZipInfo(member_name(name), time.localtime()[:6])
+		info.compress_type = zipfile.ZIP_STORED
+		info.external_attr = 0o644 << 16
+		self.zip.writestr(info, data)
+		self.written += 1
+
+	def flush(self):
+		while self.next_index < len(self.order) and self.order[self.next_index] in self.waiting:
+			name = self.order[self.next_index]
+			data = self.waiting.pop(name)
+			if data is not None:
+				self.write(name, data)
+			self.next_index += 1
+
+	def add(self, name, data):
+		with self.lock:
+			self.waiting[name] = data
+			self.flush()
+
+	def add_file(self, name, path):
+		with open(path, 'rb') as f:
+			self.add(name, f.read())
+
+	def skip(self, name):
+		# a failed page, the pages after it don't wait for it
+		self.add(name, None)
+
+	def close(self):
+		with self.lock:
+			# pages added out of order behind one that never came
+			for name in self.order[self.next_index:]:
+				data = self.waiting.pop(name, None)
+				if data is not None:
+					self.write(name, data)
+			self.next_index = len(self.order)
+			self.zip.close()
+			self.file.flush()
+			os.fsync(self.file.fileno())
+			self.file.close()
+			journal.replace_file(self.tmp_path, self.path)
+
+	def abort(self):
+		with self.lock:
+			try:
+				self.zip.close()
+				self.file.close()
+			finally:
+				if os.path.exists(self.tmp_path):
+					os.remove(self.tmp_path)
@@ -0,0 +1,228 @@
+# Command line entry points for the batch procedures, for servers with no display:
+#   python -m gimp_workflow.cli prep /scans/ch1 --compact
+#   python -m gimp_workflow.cli export /scans/ch1 /out/ch1 --quality 90 --cleaned
+# Pages run through the worker procedures in headless GIMP processes of their own (or the
+# batch daemon), so nothing depends on which images some other GIMP has open. Prints one
+# json report on stdout and exits with one of the EXIT_ codes below.
+import argparse
+import json
+import os
+import sys
+
+from gimp_workflow import compositor
+from gimp_workflow import daemon
+from gimp_workflow import journal
+from gimp_workflow import quality
+from gimp_workflow import scanner
+from gimp_workflow import workers
+from gimp_workflow import workqueue
+from gimp_workflow.manifest import ExportManifest
+from gimp_workflow.xcf import XcfUnsupported
+
+EXIT_OK = 0
+EXIT_FAILED = 1 # some files failed, see the report
+EXIT_USAGE = 2 # bad arguments (argparse's own code) or settings, e.g. a queue started with others
+EXIT_UNAVAILABLE = 3 # GIMP couldn't be started or the daemon wasn't reachable
+
+SUBSAMPLING = {'4:2:0': 0, '4:2:2h': 1, '4:4:4': 2, '4:2:2v': 3}
+DCT_METHODS = {'integer': 0, 'fixed': 1, 'float': 2}
+BACKENDS = {'gimp': 0, 'compositor': 1}
+
+def add_common_arguments(parser):
+	parser.add_argument('--files', nargs='+', default=None, help="only these files, relative to the source directory")
+	parser.add_argument('--recursive', action='store_true', help="include sub directories")
+	parser.add_argument('--include', default='', help="; separated globs to include")
+	parser.add_argument('--exclude', default='', help="; separated globs to exclude")
+	parser.add_argument('--workers', type=int, default=0, help="headless GIMP processes (0 = one per CPU)")
+	parser.add_argument('--gimp', default=None, help="GIMP executable (default %s)" % workers.GIMP_EXECUTABLE)
+	parser.add_argument('--daemon', action='store_true', help="send the job to the running batch daemon instead")
+	parser.add_argument('--socket', default=None, help="batch daemon socket (default %s)" % daemon.SOCKET_PATH)
+
+def build_parser():
+	parser = argparse.ArgumentParser(description="Runs the batch prep and export procedures headless.")
+	commands = parser.add_subparsers(dest='operation')
+
+	prep_parser = commands.add_parser('prep', help="insert the prep layers into every jpg/jpeg/png and save .xcf")
+	prep_parser.add_argument('srcPath')
+	prep_parser.add_argument('--compact', action='store_true', help="1x1 placeholder layers")
+	prep_parser.add_argument('--template', default='', help="layer template (.json, .yaml or reference .xcf)")
+	add_common_arguments(prep_parser)
+
+	export_parser = commands.add_parser('export', help="export every .xcf to .jpg")
+	export_parser.add_argument('srcPath')
+	export_parser.add_argument('dstPath')
+	export_parser.add_argument('--cleaned', action='store_true', help="hide 'Text Group' layer groups")
+	export_parser.add_argument('--text', action='store_true', help="hide everything but 'Text Group' layer groups")
+	export_parser.add_argument('--quality', type=int, default=95, help="0-100")
+	export_parser.add_argument('--smoothing', type=int, default=0, help="0-100")
+	export_parser.add_argument('--no-optimize', dest='optimize', action='store_false')
+	export_parser.add_argument('--no-progressive', dest='progressive', action='store_false')
+	export_parser.add_argument('--comment', default='Created with GIMP.')
+	export_parser.add_argument('--subsampling', choices=sorted(SUBSAMPLING), default='4:4:4')
+	export_parser.add_argument('--baseline', action='store_true', help="force baseline jpeg")
+	export_parser.add_argument('--restart-markers', type=int, default=0, help="restart marker interval in MCU rows")
+	export_parser.add_argument('--dct-method', choices=sorted(DCT_METHODS), default='integer')
+	export_parser.add_argument('--target-size-kb', type=int, default=0, help="search each page's quality (up to --quality) for this size")
+	export_parser.add_argument('--min-similarity', type=float, default=0.0, help="search the lowest quality keeping this SSIM, e.g. 0.98")
+	export_parser.add_argument('--backend', choices=sorted(BACKENDS), default='gimp')
+	export_parser.add_argument('--passthrough', action='store_true', help="copy the source jpg of untouched pages")
+	export_parser.add_argument('--pipeline-depth', type=int, default=0)
+	export_parser.add_argument('--memory-cap-mb', type=int, default=1024)
+	export_parser.add_argument('--incremental', action='store_true', help="skip pages whose jpg is up to date")
+	export_parser.add_argument('--archive', default='', help="stream the pages into this .cbz/.zip inside dstPath instead of .jpg files")
+	export_parser.add_argument('--shared-queue', action='store_true', help="split the pages with every other process exporting this directory, on any host")
+	add_common_arguments(export_parser)
+	return parser
+
+def export_options(args):
+	# JpegExportOptions' fields, as the export worker takes them
+	return {
+		'quality': args.quality / 100.0,
+		'smoothing': args.smoothing / 100.0,
+		'optimize': int(args.optimize),
+		'progressive': int(args.progressive),
+		'comment': args.comment,
+		'subsampling': SUBSAMPLING[args.subsampling],
+		'baseline': int(args.baseline),
+		'restart_markers': args.restart_markers,
+		'dct_method': DCT_METHODS[args.dct_method],
+		'target_size_kb': args.target_size_kb,
+		'min_similarity': args.min_similarity,
+	}
+
+def build_request(args):
+	request = {
+		'operation': args.operation,
+		'srcPath': args.srcPath,
+		'dstPath': getattr(args, 'dstPath', args.srcPath),
+		'files': args.files,
+		'recursive': args.recursive,
+		'include': args.include,
+		'exclude': args.exclude,
+	}
+	if args.operation == 'prep':
+		request['options'] = {'compact': args.compact, 'templateFile': args.template}
+	else:
+		request['options'] = {
+			'exportCleaned': args.cleaned,
+			'exportText': args.text,
+			'export_opts': export_options(args),
+			# workers run one page at a time each, the pipeline may still overlap their reads
+			'batch_opts': {'backend': BACKENDS[args.backend], 'passthrough': args.passthrough, 'pipeline_depth': args.pipeline_depth, 'memory_cap_mb': args.memory_cap_mb, 'archive_name': args.archive},
+		}
+	return request
+
+def run_request(args, request, items, shard=True):
+	if args.daemon:
+		request = dict(request)
+		request['files'] = [oldFile for oldFile, newFile in items]
+		return [result for result in daemon.submit(request, args.socket) if not result.get('done')]
+	procedure = workers.OPERATIONS[request['operation']][0]
+	pool = workers.WorkerPool(procedure, args.workers, args.gimp)
+	return pool.run(workers.worker_job(request, items, None), items, shard)
+
+def queue_params(args, request):
+	# the same settings export_xcf_in_directory_to_jpg checks, so menu and command line runs can share a queue
+	options = request['options']
+	params = dict(options['export_opts'], exportCleaned=args.cleaned, exportText=args.text)
+	params.update({'backend': options['batch_opts']['backend'], 'passthrough': args.passthrough, 'scan': vars(scanner.ScanFilter(args.recursive, args.include, args.exclude))})
+	return params
+
+def run_shared_queue(args, request, items):
+	# Every worker sees every page and claims them one by one in the queue next to the outputs.
+	queue = workqueue.WorkQueue(os.path.join(request['dstPath'], workqueue.QUEUE_DIR_NAME), queue_params(args, request))
+	request['options']['queue'] = queue.queue_dir
+	request['options']['batch_opts']['shared_queue'] = True
+	if items:
+		run_request(args, request, items, shard=False)
+	return queue.results(items)
+
+def record_manifest(manifest, srcPath, items, results):
+	if manifest is None:
+		return
+	newFiles = dict(items)
+	for result in results:
+		if result['ok']:
+			manifest.record(result['item'], os.path.join(srcPath, result['item']), newFiles[result['item']])
+	manifest.save()
+
+def check_pil_settings(args, request):
+	# Quality search and archives encode every page with PIL, refuse settings it can't
+	# write before starting GIMP rather than fail every page with the same error.
+	export_opts = argparse.Namespace(**request['options']['export_opts'])
+	if not quality.search_enabled(export_opts) and not args.archive:
+		return
+	try:
+		compositor.pil_save_options(export_opts)
+	except XcfUnsupported as e:
+		raise ValueError("Pages for --target-size-kb, --min-similarity and --archive are encoded with PIL: %s" % e)
+
+def run(args):
+	archive_name = getattr(args, 'archive', '')
+	if archive_name and (args.incremental or args.shared_queue):
+		raise ValueError("An archive is always written whole, --archive can't be combined with --incremental or --shared-queue.")
+	request = build_request(args)
+	if args.operation == 'export':
+		check_pil_settings(args, request)
+	srcPath = request['srcPath']
+	dstPath = request['dstPath']
+	report = {'operation': args.operation, 'srcPath': srcPath, 'dstPath': dstPath, 'skipped': 0}
+	if not os.path.isdir(dstPath):
+		os.makedirs(dstPath)
+	items = workers.job_items(request)
+	manifest = None
+	if args.operation == 'export' and args.incremental:
+		signature = dict(request['options']['export_opts'], exportCleaned=args.cleaned, exportText=args.text)
+		manifest = ExportManifest.load(dstPath, signature)
+		fresh = [item for item in items if not manifest.is_up_to_date(item[0], os.path.join(srcPath, item[0]), os.path.join(dstPath, item[1]))]
+		report['skipped'] += len(items) - len(fresh)
+		items = fresh
+	results = []
+	try:
+		if args.operation == 'export' and args.shared_queue:
+			# the queue's done markers already make the run resumable
+			results = run_shared_queue(args, request, items)
+		elif archive_name:
+			# one GIMP streams every page into the archive, which only appears once complete
+			args.workers = 1
+			results = run_request(args, request, items)
+		else:
+			# Picks up after a crashed or killed run of the same command
+			journal_name = journal.PREP_JOURNAL_NAME if args.operation == 'prep' else journal.EXPORT_JOURNAL_NAME
+			batch_journal = journal.BatchJournal.load(dstPath, journal_name, request)
+			pending = batch_journal.pending(items, srcPath)
+			report['skipped'] += len(items) - len(pending)
+			request['options']['journal'] = batch_journal.path
+			if pending:
+				results = run_request(args, request, pending)
+			if all(result['ok'] for result in results):
+				batch_journal.finish()
+	finally:
+		record_manifest(manifest, srcPath, items, results)
+	failed = [result for result in results if not result['ok']]
+	if archive_name:
+		# only a complete chapter is finalized, see export_archive
+		report['archive'] = None if failed else os.path.join(dstPath, archive_name)
+	report['succeeded'] = len(results) - len(failed)
+	report['failed'] = len(failed)
+	report['results'] = results
+	return report
+
+def main(argv=None):
+	args = build_parser().parse_args(argv)
+	try:
+		report = run(args)
+	except (OSError, IOError) as e:
+		# gimp executable missing, daemon not running, unreadable directory
+		sys.stdout.write(json.dumps({'operation': args.operation, 'error': str(e)}) + '\n')
+		return EXIT_UNAVAILABLE
+	except ValueError as e:
+		sys.stdout.write(json.dumps({'operation': args.operation, 'error': str(e)}) + '\n')
+		return EXIT_USAGE
+	sys.stdout.write(json.dumps(report, indent=1, sort_keys=True) + '\n')
+	if report['failed']:
+		return EXIT_FAILED
+	return EXIT_OK
+
+if __name__ == '__main__':
+	sys.exit(main())
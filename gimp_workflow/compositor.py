@@ -0,0 +1,206 @@
+# GIMP free export for the common page: normal mode RGB(A) layers and layer groups.
+# Needs numpy and PIL, anything they or the xcf reader can't handle raises XcfUnsupported.
+import re
+
+from gimp_workflow import pipeline
+from gimp_workflow import quality
+from gimp_workflow.xcf import XcfImage, XcfUnsupported, NORMAL_MODE, RGB_LAYER, RGBA_LAYER
+
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+try:
+	from PIL import Image
+except ImportError:
+	Image = None
+
+BAND_HEIGHT = 256
+
+# GIMP's jpeg subsampling option index to PIL's subsampling value, 4:2:2 vertical has no PIL equivalent.
+PIL_SUBSAMPLING = { 0: 2, 1: 1, 2: 0 }
+
+def available():
+	return numpy is not None and Image is not None
+
+def disable_text_groups(image):
+	txt_group = re.compile('Text Group', re.IGNORECASE)
+	for layer in image.layers:
+		if layer.is_group and txt_group.search(layer.name) is not None:
+			layer.visible = False
+
+	return image
+
+def disable_non_text_groups(image):
+	txt_group = re.compile('Text Group', re.IGNORECASE)
+	for layer in image.layers:
+		if txt_group.search(layer.name) is None:
+			layer.visible = False
+
+	return image
+
+# Same names as the plug-in's EXPORT_VARIANTS.
+VARIANT_VISIBILITY = {
+	'full': None,
+	'cleaned': disable_text_groups,
+	'text': disable_non_text_groups,
+}
+
+def visibility_snapshot(layers):
+	snapshot = []
+	for layer in layers:
+		snapshot.append((layer, layer.visible))
+		snapshot.extend(visibility_snapshot(layer.children))
+	return snapshot
+
+def restore_visibility(snapshot):
+	for layer, visible in snapshot:
+		layer.visible = visible
+
+def check_supported(layers):
+	for layer in layers:
+		if not layer.visible:
+			continue
+		if layer.floating:
+			raise XcfUnsupported("floating selection '%s'" % layer.name)
+		if layer.mode != NORMAL_MODE:
+			raise XcfUnsupported("layer mode %d on '%s'" % (layer.mode, layer.name))
+		if layer.is_group:
+			check_supported(layer.children)
+		elif layer.layer_type not in (RGB_LAYER, RGBA_LAYER):
+			raise XcfUnsupported("layer type %d on '%s'" % (layer.layer_type, layer.name))
+
+class Compositor:
+	def __init__(self, image):
+		self.image = image
+		self.pixel_cache = {}
+
+	def layer_pixels(self, layer):
+		# Decoded once per load and shared by every band and variant.
+		key = id(layer)
+		if key not in self.pixel_cache:
+			pixels = self.image.read_pixels(layer)
+			if pixels.shape[2] == 3:
+				opaque = numpy.empty(pixels.shape[:2] + (1,), numpy.uint8)
+				opaque.fill(255)
+				pixels = numpy.concatenate((pixels, opaque), axis=2)
+			if layer.mask is not None and layer.apply_mask:
+				mask = self.image.read_pixels(layer.mask)
+				pixels = pixels.copy()
+				pixels[:, :, 3] = (pixels[:, :, 3].astype(numpy.uint16) * mask[:, :, 0] + 127) // 255
+			self.pixel_cache[key] = pixels
+		return self.pixel_cache[key]
+
+	def composite(self):
+		# Returns the visible projection as a height x width x 4 uint8 array, built a band at a time
+		# so the float working buffer stays small on large scans.
+		check_supported(self.image.layers)
+		width = self.image.width
+		height = self.image.height
+		result = numpy.zeros((height, width, 4), numpy.uint8)
+		for band_y in range(0, height, BAND_HEIGHT):
+			band_h = min(BAND_HEIGHT, height - band_y)
+			band = self.composite_band(self.image.layers, band_y, band_h)
+			result[band_y:band_y + band_h] = numpy.clip(band * 255.0 + 0.5, 0, 255).astype(numpy.uint8)
+		return result
+
+	def composite_band(self, layers, band_y, band_h):
+		band = numpy.zeros((band_h, self.image.width, 4), numpy.float32)
+		# image.layers is top first, paint bottom up
+		for layer in reversed(layers):
+			if not layer.visible or layer.opacity <= 0.0:
+				continue
+			if layer.is_group:
+				source = self.composite_band(layer.children, band_y, band_h)
+				blend_over(band, source, 0, 0, layer.opacity)
+			else:
+				self.blend_layer(band, layer, band_y, band_h)
+		return band
+
+	def blend_layer(self, band, layer, band_y, band_h):
+		x0 = max(layer.offsets[0], 0)
+		x1 = min(layer.offsets[0] + layer.width, self.image.width)
+		y0 = max(layer.offsets[1], band_y)
+		y1 = min(layer.offsets[1] + layer.height, band_y + band_h)
+		if x0 >= x1 or y0 >= y1:
+			return
+		pixels = self.layer_pixels(layer)
+		source = pixels[y0 - layer.offsets[1]:y1 - layer.offsets[1], x0 - layer.offsets[0]:x1 - layer.offsets[0]]
+		source = source.astype(numpy.float32) / 255.0
+		blend_over(band, source, x0, y0 - band_y, layer.opacity)
+
+def blend_over(band, source, x, y, opacity):
+	# GIMP normal mode: straight (non premultiplied) alpha over.
+	h, w = source.shape[:2]
+	dest = band[y:y + h, x:x + w]
+	src_a = source[:, :, 3:4] * opacity
+	dst_a = dest[:, :, 3:4]
+	out_a = src_a + dst_a * (1.0 - src_a)
+	safe_a = numpy.where(out_a > 0.0, out_a, 1.0)
+	dest[:, :, :3] = (source[:, :, :3] * src_a + dest[:, :, :3] * dst_a * (1.0 - src_a)) / safe_a
+	dest[:, :, 3:4] = out_a
+
+def pil_save_options(export_opts):
+	if export_opts.subsampling not in PIL_SUBSAMPLING:
+		raise XcfUnsupported("subsampling option %d" % export_opts.subsampling)
+	if export_opts.smoothing > 0 or export_opts.restart_markers > 0 or export_opts.dct_method != 0:
+		raise XcfUnsupported("smoothing, restart markers and non integer dct need GIMP's encoder")
+	return {
+		'quality': int(round(export_opts.quality * 100)),
+		'optimize': bool(export_opts.optimize),
+		'progressive': bool(export_opts.progressive),
+		'subsampling': PIL_SUBSAMPLING[export_opts.subsampling],
+		'comment': export_opts.comment, # written by pipeline.pil_jpeg_bytes, not PIL
+	}
+
+def save_to_jpeg(projection, fullNewFile, export_opts):
+	# jpeg has no alpha, like GIMP's exporter the colour is written as is.
+	page = Image.fromarray(projection[:, :, :3], 'RGB')
+	save_options = pil_save_options(export_opts)
+	if quality.search_enabled(export_opts):
+		quality.save_searched_jpeg(page, fullNewFile, save_options, export_opts)
+		return
+	pipeline.save_jpeg(page, fullNewFile, save_options)
+
+def composite_xcf(fullOldFile, exportCleaned, exportText, data=None):
+	# data is the file's bytes when the caller already read them
+	if numpy is None:
+		raise XcfUnsupported("numpy is required")
+	if data is None:
+		image = XcfImage.load(fullOldFile)
+	else:
+		image = XcfImage.from_bytes(data)
+	if exportCleaned:
+		disable_text_groups(image)
+	if exportText:
+		disable_non_text_groups(image)
+	return Compositor(image).composite()
+
+def export_xcf_file(fullOldFile, fullNewFile, exportCleaned, exportText, export_opts):
+	if not available():
+		raise XcfUnsupported("numpy and PIL are required")
+	pil_save_options(export_opts) # fail on unsupported settings before decoding anything
+	save_to_jpeg(composite_xcf(fullOldFile, exportCleaned, exportText), fullNewFile, export_opts)
+
+def export_xcf_file_variants(fullOldFile, outputs, export_opts):
+	# outputs is a list of (variant name, jpg path), layers are decoded once for all of them.
+	if not available():
+		raise XcfUnsupported("numpy and PIL are required")
+	pil_save_options(export_opts)
+	image = XcfImage.load(fullOldFile)
+	snapshot = visibility_snapshot(image.layers)
+	# check every variant before writing any, so a GIMP fallback redoes the whole page
+	for variant, fullNewFile in outputs:
+		restore_visibility(snapshot)
+		set_visibility = VARIANT_VISIBILITY[variant]
+		if set_visibility is not None:
+			set_visibility(image)
+		check_supported(image.layers)
+	page = Compositor(image)
+	for variant, fullNewFile in outputs:
+		restore_visibility(snapshot)
+		set_visibility = VARIANT_VISIBILITY[variant]
+		if set_visibility is not None:
+			set_visibility(image)
+		save_to_jpeg(page.composite(), fullNewFile, export_opts)
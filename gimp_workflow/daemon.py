@@ -0,0 +1,276 @@
+# A long lived headless GIMP that takes batch jobs over a local unix socket, so small
+# jobs (e.g. from a file watcher) don't pay for GIMP and its plug-ins starting up.
+#
+# The daemon runs the same worker procedures as parallel batches, one job at a time,
+# and streams each result line back while the worker writes it. Run the supervisor with
+#   python -m gimp_workflow.daemon serve
+# from the plug-ins directory, it restarts GIMP after every RecycleAfter images.
+import argparse
+import errno
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from gimp_workflow import workers
+
+SOCKET_PATH = os.environ.get('GIMP_WORKFLOW_SOCKET', os.path.join(tempfile.gettempdir(), 'gimp-workflow.sock'))
+RECYCLE_AFTER = 500
+DAEMON_PROCEDURE = 'batch_daemon'
+POLL_SECONDS = 0.1
+
+class DaemonRunning(Exception):
+	pass
+
+def stop_file(socket_path):
+	# left by a 'stop' job so the supervisor doesn't start GIMP again
+	return socket_path + '.stop'
+
+def check_unix_sockets():
+	if not hasattr(socket, 'AF_UNIX'):
+		raise OSError("The batch daemon needs unix sockets, which this platform's python lacks.")
+
+def claim_socket_path(socket_path):
+	# A socket file nobody answers on was left by a killed daemon and can go, one that
+	# answers belongs to a running daemon and must be left alone.
+	if not os.path.exists(socket_path):
+		return
+	probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	try:
+		probe.connect(socket_path)
+	except socket.error as e:
+		if e.errno not in (errno.ECONNREFUSED, errno.ENOENT):
+			raise
+		if os.path.exists(socket_path):
+			os.remove(socket_path)
+		return
+	finally:
+		probe.close()
+	raise DaemonRunning("A batch daemon is already running on '%s'." % socket_path)
+
+def send_line(conn, data):
+	conn.sendall((json.dumps(data) + '\n').encode('utf-8'))
+
+def read_lines(conn):
+	pending = b''
+	while 1:
+		chunk = conn.recv(65536)
+		if not chunk:
+			break
+		pending += chunk
+		while b'\n' in pending:
+			line, pending = pending.split(b'\n', 1)
+			if line.strip():
+				yield json.loads(line.decode('utf-8'))
+
+class ResultTail:
+	# Follows a worker's results file, handing out each line once it's complete.
+	def __init__(self, results_file):
+		self.results_file = results_file
+		self.offset = 0
+		self.pending = b''
+
+	def poll(self):
+		results = []
+		if not os.path.exists(self.results_file):
+			return results
+		with open(self.results_file, 'rb') as f:
+			f.seek(self.offset)
+			data = f.read()
+		self.offset += len(data)
+		self.pending += data
+		while b'\n' in self.pending:
+			line, self.pending = self.pending.split(b'\n', 1)
+			if line.strip():
+				results.append(json.loads(line.decode('utf-8')))
+		return results
+
+class BatchDaemon:
+	# run_procedure(worker procedure, job file) runs a registered worker inside this GIMP.
+	def __init__(self, run_procedure, socket_path=None, recycle_after=RECYCLE_AFTER):
+		self.run_procedure = run_procedure
+		if not socket_path:
+			socket_path = SOCKET_PATH
+		self.socket_path = socket_path
+		self.recycle_after = recycle_after
+		self.processed = 0
+		self.stopping = False
+
+	def __repr__(self):
+		return self.__str__()
+
+	def __str__(self):
+		return "BatchDaemon: socket '%s', processed '%d', recycle after '%d'" % (self.socket_path, self.processed, self.recycle_after)
+
+	def serve(self):
+		# Returns once recycle_after images went through (checked between jobs) or on a stop job.
+		check_unix_sockets()
+		claim_socket_path(self.socket_path)
+		server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		try:
+			server.bind(self.socket_path)
+			server.listen(8)
+			while not self.stopping and (self.recycle_after <= 0 or self.processed < self.recycle_after):
+				conn, address = server.accept()
+				try:
+					self.handle(conn)
+				except Exception as e:
+					try:
+						send_line(conn, {'done': True, 'error': str(e)})
+					except socket.error:
+						pass # client went away
+				finally:
+					conn.close()
+		finally:
+			server.close()
+			if os.path.exists(self.socket_path):
+				os.remove(self.socket_path)
+
+	def handle(self, conn):
+		for request in read_lines(conn):
+			break
+		else:
+			return
+		if request.get('operation') == 'stop':
+			self.stopping = True
+			open(stop_file(self.socket_path), 'w').close()
+			send_line(conn, {'done': True, 'stopped': True})
+			return
+		if request.get('operation') not in workers.OPERATIONS:
+			raise ValueError("Unknown operation '%s', expected one of %s" % (request.get('operation'), sorted(workers.OPERATIONS)))
+		items = workers.job_items(request)
+		work_dir = tempfile.mkdtemp(prefix='gimp-workflow-daemon-')
+		try:
+			results_file = os.path.join(work_dir, 'results.jsonl')
+			job_file = os.path.join(work_dir, 'job.json')
+			with open(job_file, 'w') as f:
+				json.dump(workers.worker_job(request, items, results_file), f)
+			results = self.run_job(conn, workers.OPERATIONS[request['operation']][0], job_file, results_file, items)
+		finally:
+			shutil.rmtree(work_dir, ignore_errors=True)
+		self.processed += len(items)
+		failed = len([result for result in results if not result['ok']])
+		send_line(conn, {'done': True, 'succeeded': len(results) - failed, 'failed': failed})
+
+	def run_job(self, conn, procedure, job_file, results_file, items):
+		tail = ResultTail(results_file)
+		results = []
+		finished = threading.Event()
+		def stream():
+			# GIMP is busy in the worker on the main thread, results go out from here
+			while not finished.is_set():
+				for result in tail.poll():
+					results.append(result)
+					send_line(conn, result)
+				finished.wait(POLL_SECONDS)
+		streamer = threading.Thread(target=stream)
+		streamer.daemon = True
+		streamer.start()
+		error = "worker stopped before finishing"
+		try:
+			self.run_procedure(procedure, job_file)
+		except Exception as e:
+			error = str(e)
+		finally:
+			finished.set()
+			streamer.join()
+		for result in tail.poll():
+			results.append(result)
+			send_line(conn, result)
+		done = set(result['item'] for result in results)
+		for oldFile, newFile in items:
+			if oldFile not in done:
+				result = workers.item_result(oldFile, False, error)
+				results.append(result)
+				send_line(conn, result)
+		return results
+
+def connect(socket_path=None, timeout=30.0):
+	# Retries for a while, the daemon is briefly gone while the supervisor recycles GIMP.
+	check_unix_sockets()
+	if not socket_path:
+		socket_path = SOCKET_PATH
+	deadline = time.time() + timeout
+	while 1:
+		conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		try:
+			conn.connect(socket_path)
+			return conn
+		except socket.error:
+			conn.close()
+			if time.time() >= deadline:
+				raise
+			time.sleep(0.5)
+
+def submit(request, socket_path=None, timeout=30.0):
+	# Yields every per file result as the daemon sends it, the last one has 'done' set.
+	conn = connect(socket_path, timeout)
+	try:
+		send_line(conn, request)
+		for result in read_lines(conn):
+			yield result
+			if result.get('done'):
+				break
+	finally:
+		conn.close()
+
+def daemon_command(socket_path, recycle_after, gimp_executable=None):
+	if gimp_executable is None:
+		gimp_executable = workers.GIMP_EXECUTABLE
+	batch = '(%s RUN-NONINTERACTIVE %s %d)' % (workers.pdb_procedure_name(DAEMON_PROCEDURE), workers.scheme_string(socket_path), recycle_after)
+	return [gimp_executable, '-i', '-b', batch, '-b', '(gimp-quit 0)']
+
+def supervise(socket_path=None, recycle_after=RECYCLE_AFTER, gimp_executable=None):
+	if not socket_path:
+		socket_path = SOCKET_PATH
+	check_unix_sockets()
+	claim_socket_path(socket_path) # before touching the stop file of a daemon that's running
+	if os.path.exists(stop_file(socket_path)):
+		os.remove(stop_file(socket_path))
+	command = daemon_command(socket_path, recycle_after, gimp_executable)
+	while 1:
+		return_code = subprocess.call(command)
+		if os.path.exists(stop_file(socket_path)):
+			os.remove(stop_file(socket_path))
+			return return_code
+		if return_code != 0:
+			time.sleep(1.0) # don't spin on a GIMP that can't start
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description="Runs or talks to the headless GIMP batch daemon.")
+	parser.add_argument('--socket', default=SOCKET_PATH, help="unix socket path (default %(default)s)")
+	commands = parser.add_subparsers(dest='command')
+	serve_parser = commands.add_parser('serve', help="start GIMP as a daemon, restarting it as it recycles")
+	serve_parser.add_argument('--recycle-after', type=int, default=RECYCLE_AFTER, help="images per GIMP process, 0 for no limit")
+	serve_parser.add_argument('--gimp', default=None, help="GIMP executable (default %s)" % workers.GIMP_EXECUTABLE)
+	commands.add_parser('stop', help="stop the daemon and its supervisor")
+	submit_parser = commands.add_parser('submit', help="send a json job file and print the results as json lines")
+	submit_parser.add_argument('job_file')
+	args = parser.parse_args(argv)
+	if args.command == 'serve':
+		try:
+			return supervise(args.socket, args.recycle_after, args.gimp)
+		except DaemonRunning as e:
+			sys.stderr.write("%s\n" % e)
+			return 1
+	if args.command == 'stop':
+		request = {'operation': 'stop'}
+	else:
+		with open(args.job_file, 'r') as f:
+			request = json.load(f)
+	failed = 0
+	for result in submit(request, args.socket):
+		sys.stdout.write(json.dumps(result) + '\n')
+		sys.stdout.flush()
+		failed += result.get('failed', 0)
+		if result.get('error') and result.get('done'):
+			failed += 1
+	return 1 if failed else 0
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,132 @@
+# Remembers what the text split learned about glyphs across runs: the size of a glyph's
+# text layer for a font, size and rendering settings, and which glyphs a font can't make
+# a text layer of at all. Splitting the same SFX words again across a volume then reads
+# sizes from here instead of from every new layer, and skips unprintable glyphs before
+# any layer is made. Kept as json in GIMP_WORKFLOW_GLYPH_CACHE, by default
+# ~/.gimp-workflow/glyph-cache.json, set it to an empty string or 'off' to keep nothing
+# between runs.
+#
+# Fonts are keyed by name plus the file fontconfig picks for the name, so an updated,
+# installed or removed font misses instead of reusing old sizes. Where fc-match isn't
+# available only the check in verify() catches that: the first cached size of each font
+# in a run is compared with its real layer, and a mismatch empties the cache.
+import json
+import os
+import subprocess
+
+from gimp_workflow import journal
+
+CACHE_PATH = os.environ.get('GIMP_WORKFLOW_GLYPH_CACHE', os.path.join(os.path.expanduser('~'), '.gimp-workflow', 'glyph-cache.json'))
+CACHE_VERSION = 2
+# past this many sizes the cache starts over rather than growing without bound
+MAX_EXTENTS = 200000
+
+FONT_IDENTITIES = {} # font name: font_identity(), once per process
+
+def persistent(path):
+	return path.strip().lower() not in ('', 'off')
+
+def font_identity(font):
+	# The font file fontconfig matches for font, with its size and modification time,
+	# '' when fc-match can't be run.
+	identity = FONT_IDENTITIES.get(font)
+	if identity is None:
+		identity = ''
+		try:
+			path = subprocess.check_output(['fc-match', '--format=%{file}', font]).decode('utf-8', 'replace')
+			stat = os.stat(path)
+			identity = '%s:%d:%d' % (path, stat.st_size, int(stat.st_mtime))
+		except (OSError, ValueError, subprocess.CalledProcessError):
+			pass
+		FONT_IDENTITIES[font] = identity
+	return identity
+
+def font_key(font):
+	return json.dumps([font, font_identity(font)])
+
+def extents_key(glyph, font, size, bold, italic, underline, strikethrough, hinting):
+	# hinting is whatever rendering settings the text layers get, e.g. (antialias, hint style)
+	return json.dumps([glyph, font, font_identity(font), round(float(size), 2), bool(bold), bool(italic), bool(underline), bool(strikethrough), list(hinting)])
+
+class GlyphCache:
+	def __init__(self, path=None):
+		if path is None:
+			path = CACHE_PATH
+		self.path = path
+		self.extents = {} # extents_key(): [width, height]
+		self.unprintable = {} # font_key(): set of glyphs
+		self.verified = set() # fonts whose cached sizes were checked this run
+		self.dirty = False
+
+	def __repr__(self):
+		return self.__str__()
+
+	def __str__(self):
+		return "GlyphCache: path '%s', extents '%d', unprintable '%d'" % (self.path, len(self.extents), sum(len(glyphs) for glyphs in self.unprintable.values()))
+
+	@staticmethod
+	def load(path=None):
+		cache = GlyphCache(path)
+		if not persistent(cache.path):
+			return cache
+		try:
+			with open(cache.path, 'r') as f:
+				data = json.load(f)
+		except (IOError, OSError, ValueError):
+			return cache # none yet, or unreadable, start empty
+		if not isinstance(data, dict) or data.get('version') != CACHE_VERSION:
+			return cache
+		cache.extents = data.get('extents', {})
+		cache.unprintable = dict((font, set(glyphs)) for font, glyphs in data.get('unprintable', {}).items())
+		return cache
+
+	def is_unprintable(self, glyph, font):
+		glyphs = self.unprintable.get(font_key(font))
+		return glyphs is not None and glyph in glyphs
+
+	def mark_unprintable(self, glyph, font):
+		self.unprintable.setdefault(font_key(font), set()).add(glyph)
+		self.dirty = True
+
+	def needs_verify(self, font):
+		return font not in self.verified
+
+	def verify(self, font, cached_size, actual_size):
+		# True when a cached size of font matches its real layer. A font that changed
+		# without fontconfig noticing makes every entry suspect, so they all go.
+		self.verified.add(font)
+		if tuple(cached_size) == tuple(actual_size):
+			return True
+		self.extents = {}
+		self.unprintable = {}
+		self.dirty = True
+		return False
+
+	def get_extents(self, key):
+		size = self.extents.get(key)
+		if size is None:
+			return None
+		return (size[0], size[1])
+
+	def put_extents(self, key, size):
+		if len(self.extents) >= MAX_EXTENTS:
+			self.extents = {}
+		self.extents[key] = [size[0], size[1]]
+		self.dirty = True
+
+	def save(self):
+		if not self.dirty or not persistent(self.path):
+			return
+		directory = os.path.dirname(self.path)
+		if directory and not os.path.isdir(directory):
+			os.makedirs(directory)
+		data = {
+			'version': CACHE_VERSION,
+			'extents': self.extents,
+			'unprintable': dict((font, sorted(glyphs)) for font, glyphs in self.unprintable.items()),
+		}
+		def write(path):
+			with open(path, 'w') as f:
+				json.dump(data, f)
+		journal.write_atomically(self.path, write)
+		self.dirty = False
@@ -0,0 +1,103 @@
+# Crash safety for long batches: outputs only appear once fully written, and an
+# append-only journal of finished items lets a killed batch resume where it stopped.
+import binascii
+import json
+import os
+import socket
+
+from gimp_workflow import workers
+
+PREP_JOURNAL_NAME = '.prep-journal.jsonl'
+EXPORT_JOURNAL_NAME = '.export-journal.jsonl'
+
+def replace_file(tmp_path, path):
+	if os.name == 'nt' and os.path.exists(path):
+		os.remove(path) # rename doesn't replace on windows
+	os.rename(tmp_path, path)
+
+def partial_path(path):
+	# Same directory so the rename stays on one file system, host, pid and a random suffix
+	# keep parallel workers apart (containers and hosts sharing a directory over NFS can
+	# have the same pid), and the .part extension keeps directory scans from picking it up.
+	suffix = binascii.hexlify(os.urandom(4)).decode('ascii')
+	return '%s.%s.%d.%s.part' % (path, socket.gethostname(), os.getpid(), suffix)
+
+def write_atomically(path, write):
+	# write(tmp_path) writes the whole output, path is only replaced once it succeeded
+	tmp_path = partial_path(path)
+	try:
+		write(tmp_path)
+		replace_file(tmp_path, path)
+	except:
+		if os.path.exists(tmp_path):
+			os.remove(tmp_path)
+		raise
+
+def source_stamp(source_file):
+	# size and modification time of the item's source, an entry only counts while they match
+	try:
+		st = os.stat(source_file)
+	except OSError:
+		return {}
+	return {'mtime': st.st_mtime, 'size': st.st_size}
+
+def append_entry(journal_file, item, source_file):
+	# Safe from several worker processes, each line is a single small append.
+	entry = {'item': item}
+	entry.update(source_stamp(source_file))
+	with open(journal_file, 'a') as f:
+		f.write(json.dumps(entry) + '\n')
+		f.flush()
+		os.fsync(f.fileno())
+
+def normalized(params):
+	# compare the way they come back from the file (lists, unicode)
+	return json.loads(json.dumps(params))
+
+class BatchJournal:
+	# First line holds the batch parameters, every following line one finished item
+	# with the size and modification time its source had when it was done.
+	def __init__(self, journal_dir, name, params):
+		self.path = os.path.join(journal_dir, name)
+		self.params = normalized(params)
+		self.done = {}
+
+	def __repr__(self):
+		return self.__str__()
+
+	def __str__(self):
+		return "BatchJournal: path '%s', done '%d'" % (self.path, len(self.done))
+
+	@staticmethod
+	def load(journal_dir, name, params):
+		journal = BatchJournal(journal_dir, name, params)
+		entries = workers.read_results(journal.path)
+		if entries and entries[0].get('params') == journal.params:
+			journal.done = dict((entry.pop('item'), entry) for entry in entries[1:] if 'item' in entry)
+		else:
+			# New batch, or the same directory with other settings, so start over.
+			with open(journal.path, 'w') as f:
+				f.write(json.dumps({'params': journal.params}) + '\n')
+		return journal
+
+	def pending(self, items, source_dir):
+		# a source edited since it was done (e.g. fixed after a failed batch) is done again
+		return [(oldFile, newFile) for oldFile, newFile in items
+			if self.done.get(oldFile) != normalized(source_stamp(os.path.join(source_dir, oldFile)))]
+
+	def record(self, item, source_file):
+		append_entry(self.path, item, source_file)
+		self.done[item] = normalized(source_stamp(source_file))
+
+	def finish(self):
+		# Only a batch that got through every item forgets it, a rerun is then a new batch.
+		if os.path.exists(self.path):
+			os.remove(self.path)
+
+def recording(on_result, journal_file, source_dir):
+	# Wraps a batch on_result callback so finished items also land in the journal.
+	def record(result):
+		if result['ok'] and journal_file:
+			append_entry(journal_file, result['item'], os.path.join(source_dir, result['item']))
+		on_result(result)
+	return record
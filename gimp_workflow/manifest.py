@@ -0,0 +1,87 @@
+import hashlib
+import json
+import os
+
+from gimp_workflow import journal
+
+MANIFEST_NAME = '.export-manifest.json'
+MANIFEST_VERSION = 1
+
+def file_hash(path, block_size=1 << 20):
+	sha = hashlib.sha1()
+	with open(path, 'rb') as f:
+		while 1:
+			block = f.read(block_size)
+			if not block:
+				break
+			sha.update(block)
+	return sha.hexdigest()
+
+def atomic_write_json(path, data):
+	tmp_path = path + '.tmp'
+	with open(tmp_path, 'w') as f:
+		json.dump(data, f, indent=1, sort_keys=True)
+	journal.replace_file(tmp_path, path)
+
+class ExportManifest:
+	# Remembers what each output was built from, keyed by source file name.
+	def __init__(self, manifest_dir, options):
+		self.path = os.path.join(manifest_dir, MANIFEST_NAME)
+		# Any change in settings (quality, subsampling, cleaned/text...) invalidates every entry.
+		self.options = options
+		self.entries = {}
+		self.dirty = False
+
+	def __repr__(self):
+		return self.__str__()
+
+	def __str__(self):
+		return "ExportManifest: path '%s', entries '%d'" % (self.path, len(self.entries))
+
+	@staticmethod
+	def load(manifest_dir, options):
+		manifest = ExportManifest(manifest_dir, options)
+		if os.path.exists(manifest.path):
+			try:
+				with open(manifest.path, 'r') as f:
+					data = json.load(f)
+				if data.get('version') == MANIFEST_VERSION:
+					manifest.entries = data.get('entries', {})
+			except ValueError:
+				pass # unreadable manifest just means a full rebuild
+		return manifest
+
+	def is_up_to_date(self, name, fullOldFile, fullNewFile):
+		entry = self.entries.get(name)
+		if entry is None or entry['options'] != self.options:
+			return False
+		if not os.path.exists(fullNewFile):
+			return False
+		stat = os.stat(fullOldFile)
+		if stat.st_size != entry['size']:
+			return False
+		if stat.st_mtime == entry['mtime']:
+			return True
+		# Touched but maybe not changed (copied, checked out again), fall back to content.
+		if file_hash(fullOldFile) != entry['hash']:
+			return False
+		entry['mtime'] = stat.st_mtime
+		self.dirty = True
+		return True
+
+	def record(self, name, fullOldFile, output):
+		stat = os.stat(fullOldFile)
+		self.entries[name] = {
+			'mtime': stat.st_mtime,
+			'size': stat.st_size,
+			'hash': file_hash(fullOldFile),
+			'options': self.options,
+			'output': output,
+		}
+		self.dirty = True
+
+	def save(self):
+		if not self.dirty:
+			return
+		atomic_write_json(self.path, {'version': MANIFEST_VERSION, 'entries': self.entries})
+		self.dirty = False
@@ -0,0 +1,115 @@
+# Finds pages that were prepped but never edited, so export can copy the original
+# jpg instead of decoding, flattening and re-encoding it (and losing a generation).
+# Prep records a fingerprint of the source file and the base layer's pixels in the .xcf,
+# a page only counts as untouched while both still match.
+import hashlib
+import json
+import os
+import shutil
+
+from gimp_workflow import compositor
+from gimp_workflow import journal
+from gimp_workflow.xcf import XcfImage, XcfUnsupported, NORMAL_MODE, TILE_SIZE
+
+SOURCE_EXTENSIONS = ('.jpg', '.jpeg')
+
+PARASITE_NAME = 'gimp-workflow-prep-source'
+PARASITE_PERSISTENT = 1 # GIMP's PARASITE_PERSISTENT, saved with the .xcf
+READ_CHUNK = 1024 * 1024
+
+def find_source(fullOldFile):
+	# prep_images_to_xcf saves page.xcf next to page.jpg
+	# (checked by name, listing the folder for every page goes quadratic on big chapters)
+	base, ext = os.path.splitext(fullOldFile)
+	for ext in SOURCE_EXTENSIONS:
+		for candidate in (base + ext, base + ext.upper()):
+			if os.path.isfile(candidate):
+				return candidate
+	return None
+
+def file_sha1(path):
+	digest = hashlib.sha1()
+	with open(path, 'rb') as f:
+		while 1:
+			chunk = f.read(READ_CHUNK)
+			if not chunk:
+				return digest.hexdigest()
+			digest.update(chunk)
+
+def layer_digest(layer):
+	# The GIMP side of XcfImage.tile_digest, same tiles in the same order.
+	digest = hashlib.sha1()
+	region = layer.get_pixel_rgn(0, 0, layer.width, layer.height, False, False)
+	for y in range(0, layer.height, TILE_SIZE):
+		for x in range(0, layer.width, TILE_SIZE):
+			digest.update(region[x:min(x + TILE_SIZE, layer.width), y:min(y + TILE_SIZE, layer.height)])
+	return digest.hexdigest()
+
+def prep_fingerprint(source, base_layer):
+	# Parasite data prep attaches to the image before saving the .xcf
+	stat = os.stat(source)
+	return json.dumps({
+		'source': { 'size': stat.st_size, 'mtime': stat.st_mtime, 'sha1': file_sha1(source) },
+		'base': layer_digest(base_layer),
+	})
+
+def matches_fingerprint(image, source):
+	# The source is unchanged since prep and nobody painted on the base layer.
+	data = image.parasites.get(PARASITE_NAME)
+	if data is None:
+		return False # prepped before fingerprints were kept, can't tell
+	try:
+		recorded = json.loads(data.decode('utf-8'))
+	except ValueError:
+		return False
+	stat = os.stat(source)
+	source_print = recorded.get('source', {})
+	if source_print.get('size') != stat.st_size or source_print.get('mtime') != stat.st_mtime:
+		return False
+	if source_print.get('sha1') != file_sha1(source):
+		return False
+	return recorded.get('base') == image.tile_digest(image.layers[-1])
+
+def layers_transparent(image, layers):
+	for layer in layers:
+		if not layer.visible:
+			continue
+		if layer.is_group:
+			if not layers_transparent(image, layer.children):
+				return False
+		elif not image.is_transparent(layer):
+			return False
+	return True
+
+def is_plain_base(image, layer):
+	return layer.visible and not layer.is_group and layer.opacity >= 1.0 and layer.mode == NORMAL_MODE \
+		and layer.offsets == (0, 0) and layer.width == image.width and layer.height == image.height \
+		and (layer.mask is None or not layer.apply_mask)
+
+def passthrough_source(fullOldFile, variant, data=None):
+	# Returns the original jpg when the page would export to exactly that image, else None.
+	# data is the xcf's bytes when the caller already read them.
+	if variant == 'text':
+		return None # the text only page never shows the source
+	source = find_source(fullOldFile)
+	if source is None:
+		return None
+	try:
+		if data is None:
+			image = XcfImage.load(fullOldFile)
+		else:
+			image = XcfImage.from_bytes(data)
+	except (XcfUnsupported, ValueError):
+		return None
+	if not image.layers or not is_plain_base(image, image.layers[-1]):
+		return None
+	if variant == 'cleaned':
+		compositor.disable_text_groups(image)
+	if not layers_transparent(image, image.layers[:-1]):
+		return None
+	if not matches_fingerprint(image, source):
+		return None
+	return source
+
+def copy_source(source, fullNewFile):
+	journal.write_atomically(fullNewFile, lambda path: shutil.copyfile(source, path))
@@ -0,0 +1,169 @@
+# Positions along a GIMP path without a PDB call per position. The strokes' bezier control
+# points are fetched once (gimp_vectors_stroke_get_points), flattened here into a polyline
+# with a cumulative arc length table, and every distance is answered by a search in that
+# table. Strokes of a path are one continuous run, the jump from one stroke's end to the
+# next one's start doesn't count as length. Uses numpy when it's there.
+import bisect
+import math
+
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+# longest chord of the flattened curve in pixels, well under a glyph's placement precision
+FLATTEN_STEP = 0.5
+MIN_SEGMENT_STEPS = 8
+MAX_SEGMENT_STEPS = 4096
+
+def bezier_segments(control_points, closed):
+	# GIMP's bezier strokes are (in handle, anchor, out handle) triples of x, y pairs,
+	# a segment runs from an anchor over its out handle and the next in handle to the next anchor.
+	points = [(control_points[index], control_points[index + 1]) for index in range(0, len(control_points) - 1, 2)]
+	anchor_count = len(points) // 3
+	segments = []
+	for index in range(anchor_count - 1):
+		segments.append((points[3 * index + 1], points[3 * index + 2], points[3 * index + 3], points[3 * index + 4]))
+	if closed and anchor_count > 1:
+		last = 3 * (anchor_count - 1)
+		segments.append((points[last + 1], points[last + 2], points[0], points[1]))
+	return segments, (points[1] if anchor_count > 0 else None)
+
+def segment_steps(segment):
+	# the control polygon is never shorter than the curve
+	polygon_length = sum(math.hypot(segment[index + 1][0] - segment[index][0], segment[index + 1][1] - segment[index][1]) for index in range(3))
+	return int(min(MAX_SEGMENT_STEPS, max(MIN_SEGMENT_STEPS, math.ceil(polygon_length / FLATTEN_STEP))))
+
+def flatten_segment(segment, steps):
+	p0, p1, p2, p3 = segment
+	xs = []
+	ys = []
+	for step in range(1, steps + 1):
+		t = float(step) / steps
+		u = 1.0 - t
+		a = u * u * u
+		b = 3.0 * u * u * t
+		c = 3.0 * u * t * t
+		d = t * t * t
+		xs.append(a * p0[0] + b * p1[0] + c * p2[0] + d * p3[0])
+		ys.append(a * p0[1] + b * p1[1] + c * p2[1] + d * p3[1])
+	return xs, ys
+
+def flatten_segment_numpy(segment, steps):
+	p0, p1, p2, p3 = [numpy.array(point, numpy.float64) for point in segment]
+	t = numpy.linspace(0.0, 1.0, steps + 1)[1:, None]
+	u = 1.0 - t
+	curve = u * u * u * p0 + 3.0 * u * u * t * p1 + 3.0 * u * t * t * p2 + t * t * t * p3
+	return curve[:, 0], curve[:, 1]
+
+class PathSampler:
+	# strokes: (control points, closed) of each stroke, as gimp_vectors_stroke_get_points gives them
+	def __init__(self, strokes):
+		self.use_numpy = numpy is not None
+		xs = []
+		ys = []
+		lengths = []
+		for control_points, closed in strokes:
+			segments, start = bezier_segments(list(control_points), closed)
+			if start is None:
+				continue
+			stroke_xs = [[start[0]]]
+			stroke_ys = [[start[1]]]
+			for segment in segments:
+				if self.use_numpy:
+					segment_xs, segment_ys = flatten_segment_numpy(segment, segment_steps(segment))
+				else:
+					segment_xs, segment_ys = flatten_segment(segment, segment_steps(segment))
+				stroke_xs.append(segment_xs)
+				stroke_ys.append(segment_ys)
+			if self.use_numpy:
+				stroke_x = numpy.concatenate(stroke_xs)
+				stroke_y = numpy.concatenate(stroke_ys)
+				stroke_length = numpy.concatenate(([0.0], numpy.cumsum(numpy.hypot(numpy.diff(stroke_x), numpy.diff(stroke_y)))))
+			else:
+				stroke_x = [x for part in stroke_xs for x in part]
+				stroke_y = [y for part in stroke_ys for y in part]
+				stroke_length = [0.0]
+				for index in range(1, len(stroke_x)):
+					stroke_length.append(stroke_length[-1] + math.hypot(stroke_x[index] - stroke_x[index - 1], stroke_y[index] - stroke_y[index - 1]))
+			# carry on from where the previous stroke ended
+			offset = lengths[-1][-1] if lengths else 0.0
+			xs.append(stroke_x)
+			ys.append(stroke_y)
+			if self.use_numpy:
+				lengths.append(stroke_length + offset)
+			else:
+				lengths.append([offset + length for length in stroke_length])
+		if not xs:
+			raise ValueError("path has no points.")
+		if self.use_numpy:
+			self.xs = numpy.concatenate(xs)
+			self.ys = numpy.concatenate(ys)
+			self.lengths = numpy.concatenate(lengths)
+		else:
+			self.xs = [x for part in xs for x in part]
+			self.ys = [y for part in ys for y in part]
+			self.lengths = [length for part in lengths for length in part]
+		self.length = float(self.lengths[-1])
+
+	def __repr__(self):
+		return self.__str__()
+
+	def __str__(self):
+		return "PathSampler: length '%.2f', table '%d'" % (self.length, len(self.xs))
+
+	def even_distances(self, count):
+		# count points from the start to the very end of the path, one point sits at the end
+		if count < 1:
+			return []
+		spacing = 0.0
+		if count > 1:
+			spacing = self.length / (count - 1)
+		return [index * spacing for index in range(count - 1)] + [self.length]
+
+	def sample(self, distances):
+		# [(x, y)] and the path's direction there as angles in radians, for each distance along the path
+		if not distances:
+			return [], []
+		if len(self.xs) < 2:
+			return [(float(self.xs[0]), float(self.ys[0]))] * len(distances), [0.0] * len(distances)
+		if self.use_numpy:
+			return self.sample_numpy(distances)
+		points = []
+		angles = []
+		last = len(self.lengths) - 2
+		for distance in distances:
+			distance = min(max(distance, 0.0), self.length)
+			index = min(max(bisect.bisect_right(self.lengths, distance) - 1, 0), last)
+			dx = self.xs[index + 1] - self.xs[index]
+			dy = self.ys[index + 1] - self.ys[index]
+			span = self.lengths[index + 1] - self.lengths[index]
+			t = (distance - self.lengths[index]) / span if span > 0.0 else 0.0
+			points.append((self.xs[index] + t * dx, self.ys[index] + t * dy))
+			angles.append(math.atan2(dy, dx))
+		return points, angles
+
+	def sample_numpy(self, distances):
+		distances = numpy.clip(numpy.asarray(distances, numpy.float64), 0.0, self.length)
+		index = numpy.clip(numpy.searchsorted(self.lengths, distances, side='right') - 1, 0, len(self.lengths) - 2)
+		dx = self.xs[index + 1] - self.xs[index]
+		dy = self.ys[index + 1] - self.ys[index]
+		span = self.lengths[index + 1] - self.lengths[index]
+		t = numpy.where(span > 0.0, (distances - self.lengths[index]) / numpy.where(span > 0.0, span, 1.0), 0.0)
+		x = self.xs[index] + t * dx
+		y = self.ys[index] + t * dy
+		return list(zip(x.tolist(), y.tolist())), numpy.arctan2(dy, dx).tolist()
+
+	def sample_even(self, count):
+		return self.sample(self.even_distances(count))
+
+def stroke_points(pdb, vectors):
+	# every stroke's control points with one PDB call per stroke
+	count, strokes = pdb.gimp_vectors_get_strokes(vectors)
+	if count == 0:
+		raise ValueError("vector has no strokes.")
+	stroke_list = []
+	for stroke_id in strokes:
+		stroke_type, point_count, control_points, closed = pdb.gimp_vectors_stroke_get_points(vectors, stroke_id)
+		stroke_list.append((control_points, closed))
+	return stroke_list
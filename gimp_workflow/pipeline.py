@@ -0,0 +1,174 @@
+# Overlaps disk reads, GIMP compositing and jpeg encoding for batch export.
+# Only the main thread may talk to GIMP, the threads here just move bytes and run PIL.
+import io
+import struct
+import threading
+
+try:
+	import Queue as queue
+except ImportError:
+	import queue
+
+try:
+	from PIL import Image
+except ImportError:
+	Image = None
+
+from gimp_workflow import journal
+
+def available():
+	return Image is not None
+
+class MemoryBudget:
+	# Bounds the bytes of decoded pages waiting for or in encoding. One oversized page may
+	# always go through on its own, otherwise a page bigger than the cap would deadlock.
+	def __init__(self, cap_bytes):
+		self.cap_bytes = cap_bytes
+		self.used = 0
+		self.condition = threading.Condition()
+
+	def acquire(self, size):
+		with self.condition:
+			while self.used > 0 and self.used + size > self.cap_bytes:
+				self.condition.wait()
+			self.used += size
+
+	def release(self, size):
+		with self.condition:
+			self.used -= size
+			self.condition.notify_all()
+
+READ_CHUNK = 1024 * 1024
+
+class Prefetcher:
+	# Reads the next files on a background thread, depth files ahead of the consumer.
+	# With keep_data False the bytes are dropped as they're read, which only warms the OS
+	# page cache for a consumer that opens the file itself (GIMP's loader does).
+	def __init__(self, paths, depth, keep_data=True):
+		self.paths = list(paths)
+		self.keep_data = keep_data
+		self.loaded = queue.Queue(max(1, depth))
+		self.thread = threading.Thread(target=self.read_all)
+		self.thread.daemon = True
+		self.thread.start()
+
+	def read_file(self, path):
+		with open(path, 'rb') as f:
+			if self.keep_data:
+				return f.read()
+			while f.read(READ_CHUNK):
+				pass
+		return None
+
+	def read_all(self):
+		for path in self.paths:
+			data = None
+			error = None
+			try:
+				data = self.read_file(path)
+			except (IOError, OSError) as e:
+				error = e
+			self.loaded.put((path, data, error))
+
+	def __iter__(self):
+		# yields (path, file bytes or None, read error or None) in the original order,
+		# the bytes are always None without keep_data
+		for i in range(len(self.paths)):
+			yield self.loaded.get()
+
+class EncodePool:
+	# Encodes flattened pixel buffers to jpeg on worker threads while GIMP moves on to the next page.
+	# With a page archive, pages are added to it under their names instead of written to files.
+	def __init__(self, thread_count, depth, budget, save_options, page_archive=None):
+		self.budget = budget
+		self.save_options = save_options
+		self.page_archive = page_archive
+		self.pending = queue.Queue(max(1, depth))
+		self.results = []
+		self.results_lock = threading.Lock()
+		self.threads = []
+		for i in range(max(1, thread_count)):
+			thread = threading.Thread(target=self.encode_loop)
+			thread.daemon = True
+			thread.start()
+			self.threads.append(thread)
+
+	def submit(self, item, pixels, mode, size, fullNewFile, on_result):
+		# pixels is a byte string (or buffer) of the page in PIL mode 'RGB' or 'RGBA'
+		self.budget.acquire(len(pixels))
+		self.pending.put((item, pixels, mode, size, fullNewFile, on_result))
+
+	def encode_loop(self):
+		while 1:
+			job = self.pending.get()
+			if job is None:
+				return
+			item, pixels, mode, size, fullNewFile, on_result = job
+			try:
+				if self.page_archive is not None:
+					self.page_archive.add(fullNewFile, jpeg_bytes(pixels, mode, size, self.save_options))
+				else:
+					encode_jpeg(pixels, mode, size, fullNewFile, self.save_options)
+				result = (item, True, '')
+			except Exception as e:
+				result = (item, False, str(e))
+			finally:
+				self.budget.release(len(pixels))
+			self.report(on_result, *result)
+
+	def report(self, on_result, *args):
+		# Results from the caller's thread go through here too, so on_result (journal
+		# appends, manifest hashing) never runs on two threads at once.
+		with self.results_lock:
+			on_result(*args)
+
+	def close(self):
+		for thread in self.threads:
+			self.pending.put(None)
+		for thread in self.threads:
+			thread.join()
+
+def page_image(pixels, mode, size):
+	return Image.frombuffer(mode, size, pixels, 'raw', mode, 0, 1)
+
+def rgb_page(pixels, mode, size):
+	page = page_image(pixels, mode, size)
+	if mode != 'RGB':
+		page = page.convert('RGB') # jpeg has no alpha
+	return page
+
+def with_comment(data, comment):
+	# Pillow before 9.4 silently drops the 'comment' save option, so the COM segment GIMP's
+	# encoder writes is put in here, after the APPn segments where libjpeg puts it.
+	if not comment:
+		return data
+	if not isinstance(comment, bytes):
+		comment = comment.encode('utf-8')
+	comment = comment[:65533]
+	offset = 2 # after SOI
+	while data[offset:offset + 1] == b'\xff' and 0xe0 <= ord(data[offset + 1:offset + 2]) <= 0xef:
+		offset += 2 + struct.unpack('>H', data[offset + 2:offset + 4])[0]
+	return data[:offset] + b'\xff\xfe' + struct.pack('>H', len(comment) + 2) + comment + data[offset:]
+
+def pil_jpeg_bytes(page, save_options):
+	# save_options from compositor.pil_save_options, comment included
+	options = dict(save_options)
+	comment = options.pop('comment', '')
+	buffer = io.BytesIO()
+	page.save(buffer, 'JPEG', **options)
+	return with_comment(buffer.getvalue(), comment)
+
+def write_bytes(fullNewFile, data):
+	def write(path):
+		with open(path, 'wb') as f:
+			f.write(data)
+	journal.write_atomically(fullNewFile, write)
+
+def save_jpeg(page, fullNewFile, save_options):
+	write_bytes(fullNewFile, pil_jpeg_bytes(page, save_options))
+
+def jpeg_bytes(pixels, mode, size, save_options):
+	return pil_jpeg_bytes(rgb_page(pixels, mode, size), save_options)
+
+def encode_jpeg(pixels, mode, size, fullNewFile, save_options):
+	save_jpeg(rgb_page(pixels, mode, size), fullNewFile, save_options)
@@ -0,0 +1,190 @@
+# Opt-in timing of where a plug-in run spends its time: every PDB call (count, total and
+# max seconds per procedure) and named phases such as load, flatten and save.
+#
+# Set GIMP_WORKFLOW_PROFILE to a directory before starting GIMP, and every profiled
+# procedure run writes <procedure>-<pid>-<time>.json there (worker processes included).
+# GIMP_WORKFLOW_PROFILE_CPROFILE=1 also dumps a .pstats file of the same run for
+#   python -m pstats <file>
+# Unset, instrument() hands back pdb itself, profiled() the function itself and phase()
+# one shared do-nothing context, so the scripts run exactly as without it.
+import cProfile
+import functools
+import json
+import os
+import threading
+import time
+
+from gimp_workflow import journal
+
+PROFILE_DIR = os.environ.get('GIMP_WORKFLOW_PROFILE', '')
+CPROFILE = os.environ.get('GIMP_WORKFLOW_PROFILE_CPROFILE', '') not in ('', '0')
+
+if hasattr(time, 'perf_counter'):
+	timer = time.perf_counter
+elif os.name == 'nt':
+	timer = time.clock # wall clock with sub millisecond resolution on windows
+else:
+	timer = time.time
+
+def enabled():
+	return bool(PROFILE_DIR)
+
+class TimingStats:
+	def __init__(self):
+		self.count = 0
+		self.total = 0.0
+		self.max = 0.0
+
+	def __repr__(self):
+		return self.__str__()
+
+	def __str__(self):
+		return "TimingStats: count '%d', total '%.6f's, max '%.6f's" % (self.count, self.total, self.max)
+
+	def add(self, seconds):
+		self.count += 1
+		self.total += seconds
+		if seconds > self.max:
+			self.max = seconds
+
+	def as_dict(self):
+		return {'count': self.count, 'total': self.total, 'max': self.max, 'mean': self.total / self.count if self.count else 0.0}
+
+class Recorder:
+	def __init__(self):
+		self.procedures = {} # pdb procedure name: TimingStats
+		self.phases = {} # phase name: TimingStats
+		self.lock = threading.Lock()
+
+	def __repr__(self):
+		return self.__str__()
+
+	def __str__(self):
+		return "Recorder: procedures '%d', phases '%d'" % (len(self.procedures), len(self.phases))
+
+	def record(self, table, name, seconds):
+		with self.lock:
+			stats = table.get(name)
+			if stats is None:
+				stats = table[name] = TimingStats()
+			stats.add(seconds)
+
+	def reset(self):
+		with self.lock:
+			self.procedures = {}
+			self.phases = {}
+
+	def report(self, procedure, seconds):
+		with self.lock:
+			calls = list(self.procedures.values())
+			return {
+				'procedure': procedure,
+				'pid': os.getpid(),
+				'seconds': seconds,
+				'pdb_calls': sum(stats.count for stats in calls),
+				'pdb_seconds': sum(stats.total for stats in calls),
+				'pdb': dict((name, stats.as_dict()) for name, stats in self.procedures.items()),
+				'phases': dict((name, stats.as_dict()) for name, stats in self.phases.items()),
+			}
+
+RECORDER = Recorder() if enabled() else None
+
+class ProfiledPdb:
+	# Stands in for gimpfu's pdb, timing every procedure called through it.
+	def __init__(self, pdb, recorder):
+		self._pdb = pdb
+		self._recorder = recorder
+
+	def __repr__(self):
+		return self.__str__()
+
+	def __str__(self):
+		return "ProfiledPdb: '%s'" % self._recorder
+
+	def __getattr__(self, name):
+		procedure = getattr(self._pdb, name)
+		if not callable(procedure):
+			return procedure
+		recorder = self._recorder
+		def timed(*args, **kwargs):
+			start = timer()
+			try:
+				return procedure(*args, **kwargs)
+			finally:
+				recorder.record(recorder.procedures, name, timer() - start)
+		self.__dict__[name] = timed # found directly from now on, without __getattr__
+		return timed
+
+	def __getitem__(self, name):
+		return self.__getattr__(name.replace('-', '_'))
+
+def instrument(pdb):
+	# pdb = profiler.instrument(pdb) right after the gimpfu import
+	if RECORDER is None:
+		return pdb
+	return ProfiledPdb(pdb, RECORDER)
+
+class Phase:
+	def __init__(self, recorder, name):
+		self.recorder = recorder
+		self.name = name
+		self.start = None
+
+	def __enter__(self):
+		self.start = timer()
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.recorder.record(self.recorder.phases, self.name, timer() - self.start)
+		return False
+
+class NullPhase:
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		return False
+
+NULL_PHASE = NullPhase()
+
+def phase(name):
+	# with profiler.phase('load'): ... adds the time spent to the named phase
+	if RECORDER is None:
+		return NULL_PHASE
+	return Phase(RECORDER, name)
+
+def report_path(procedure, extension):
+	return os.path.join(PROFILE_DIR, '%s-%d-%d%s' % (procedure, os.getpid(), int(time.time() * 1000), extension))
+
+def write_report(procedure, seconds, profile=None):
+	if not os.path.isdir(PROFILE_DIR):
+		os.makedirs(PROFILE_DIR)
+	report = RECORDER.report(procedure, seconds)
+	def write(path):
+		with open(path, 'w') as f:
+			json.dump(report, f, indent=1, sort_keys=True)
+	path = report_path(procedure, '.json')
+	journal.write_atomically(path, write)
+	if profile is not None:
+		profile.dump_stats(os.path.splitext(path)[0] + '.pstats')
+	return path
+
+def profiled(function):
+	# Decorates a registered procedure, each run writes its own report.
+	if RECORDER is None:
+		return function
+	@functools.wraps(function)
+	def run(*args, **kwargs):
+		RECORDER.reset()
+		profile = cProfile.Profile() if CPROFILE else None
+		start = timer()
+		try:
+			if profile is not None:
+				return profile.runcall(function, *args, **kwargs)
+			return function(*args, **kwargs)
+		finally:
+			try:
+				write_report(function.__name__, timer() - start, profile)
+			except (IOError, OSError):
+				pass # a report that can't be written mustn't fail the run
+	return run
@@ -0,0 +1,117 @@
+# Named output profiles: one flattened page written as several files of different format
+# and size, e.g. a png master, a webp preview and jpg thumbnails, read from .json or .yaml.
+import json
+import os
+
+try:
+	import yaml
+except ImportError:
+	yaml = None
+
+try:
+	from PIL import Image
+except ImportError:
+	Image = None
+
+from gimp_workflow import journal
+
+# format: (PIL format, file extension)
+FORMATS = {
+	'jpeg': ('JPEG', '.jpg'),
+	'jpg': ('JPEG', '.jpg'),
+	'png': ('PNG', '.png'),
+	'webp': ('WEBP', '.webp'),
+}
+RESAMPLING = ('nearest', 'bilinear', 'bicubic', 'lanczos')
+
+DEFAULT_PROFILES = [
+	{ 'name': 'master', 'format': 'png' },
+	{ 'name': 'preview', 'format': 'webp', 'options': { 'quality': 80 }, 'max_size': 1200 },
+	{ 'name': 'thumbnail', 'format': 'jpeg', 'options': { 'quality': 85 }, 'max_size': 400 },
+]
+
+def available():
+	return Image is not None
+
+class OutputProfile:
+	def __init__(self, name, format='jpeg', options=None, max_size=0, resample='lanczos'):
+		if format not in FORMATS:
+			raise ValueError("Profile '%s': unknown format '%s', expected one of %s" % (name, format, sorted(FORMATS)))
+		if resample not in RESAMPLING:
+			raise ValueError("Profile '%s': unknown resampling '%s', expected one of %s" % (name, resample, list(RESAMPLING)))
+		self.name = name
+		self.format = format
+		self.options = options or {} # passed to PIL's save as is
+		self.max_size = max_size # longest edge in pixels, 0 for full size
+		self.resample = resample
+
+	def __repr__(self):
+		return self.__str__()
+
+	def __str__(self):
+		return "OutputProfile: name '%s', format '%s', options '%s', max size '%s', resample '%s'" % (self.name, self.format, self.options, self.max_size, self.resample)
+
+	@property
+	def pil_format(self):
+		return FORMATS[self.format][0]
+
+	@property
+	def extension(self):
+		return FORMATS[self.format][1]
+
+	def target_size(self, size):
+		width, height = size
+		if self.max_size <= 0 or max(width, height) <= self.max_size:
+			return size
+		scale = self.max_size / float(max(width, height))
+		return (max(1, int(round(width * scale))), max(1, int(round(height * scale))))
+
+def compile_profiles(entries):
+	profiles = []
+	for entry in entries:
+		if 'name' not in entry:
+			raise ValueError("Output profile needs a name: %s" % entry)
+		profiles.append(OutputProfile(entry['name'],
+							format = str(entry.get('format', 'jpeg')).lower(),
+							options = entry.get('options'),
+							max_size = int(entry.get('max_size', 0)),
+							resample = str(entry.get('resample', 'lanczos')).lower()))
+	names = [profile.name for profile in profiles]
+	if len(set(names)) != len(names):
+		raise ValueError("Output profile names must be unique, they name the output directories: %s" % names)
+	return profiles
+
+def load_profiles(path):
+	if not path:
+		return compile_profiles(DEFAULT_PROFILES)
+	ext = os.path.splitext(path)[1].lower()
+	if ext in ('.yaml', '.yml'):
+		if yaml is None:
+			raise ValueError("PyYAML is needed for .yaml profiles, use .json instead.")
+		with open(path, 'r') as f:
+			entries = yaml.safe_load(f)
+	else:
+		with open(path, 'r') as f:
+			entries = json.load(f)
+	if isinstance(entries, dict):
+		entries = entries.get('profiles', [])
+	return compile_profiles(entries)
+
+def resample_filter(name):
+	return getattr(Image, name.upper())
+
+def save_profile(image, profile, path):
+	if profile.pil_format == 'JPEG' and image.mode != 'RGB':
+		image = image.convert('RGB') # jpeg has no alpha
+	journal.write_atomically(path, lambda tmp_path: image.save(tmp_path, profile.pil_format, **profile.options))
+
+def render_profiles(page, profiles, outputs):
+	# outputs maps profile name to path. Largest first, every downscale is made from the
+	# previous (already smaller) one, a pyramid rather than each size from the full page.
+	ordered = sorted(profiles, key=lambda profile: profile.target_size(page.size), reverse=True)
+	current = page
+	for profile in ordered:
+		size = profile.target_size(page.size)
+		if size != current.size:
+			current = current.resize(size, resample_filter(profile.resample))
+		save_profile(current, profile, outputs[profile.name])
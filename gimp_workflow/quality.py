@@ -0,0 +1,171 @@
+# Per page jpeg quality search: instead of one fixed quality for every page, find the
+# quality that fits a byte budget and/or keeps a minimum similarity (mean SSIM) to the
+# lossless page. Candidates are encoded to memory on a few threads at once (PIL lets go
+# of the GIL while encoding), and only the chosen one is written.
+import io
+import threading
+
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+try:
+	from PIL import Image
+except ImportError:
+	Image = None
+
+from gimp_workflow import pipeline
+from gimp_workflow import workers
+
+MIN_QUALITY = 10
+MAX_SEARCH_THREADS = 8
+# SSIM is compared on pages shrunk to about this many pixels, enough to see jpeg damage
+SSIM_PIXELS = 4000000
+SSIM_WINDOW = 8
+
+def similarity_available():
+	return numpy is not None
+
+def search_enabled(export_opts):
+	return getattr(export_opts, 'target_size_kb', 0) > 0 or getattr(export_opts, 'min_similarity', 0.0) > 0.0
+
+def parallel_map(function, values, thread_count):
+	# Like map(), with up to thread_count threads, results in the order of values.
+	results = [None] * len(values)
+	errors = []
+	next_index = [0]
+	lock = threading.Lock()
+	def run():
+		while 1:
+			with lock:
+				index = next_index[0]
+				next_index[0] += 1
+			if index >= len(values) or errors:
+				return
+			try:
+				results[index] = function(values[index])
+			except Exception as e:
+				errors.append(e)
+	threads = [threading.Thread(target=run) for i in range(max(1, min(thread_count, len(values))))]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+	if errors:
+		raise errors[0]
+	return results
+
+def box_means(values, window):
+	# mean of every window x window block (valid positions), from an integral image
+	integral = numpy.zeros((values.shape[0] + 1, values.shape[1] + 1), numpy.float64)
+	integral[1:, 1:] = values.cumsum(0).cumsum(1)
+	sums = integral[window:, window:] - integral[:-window, window:] - integral[window:, :-window] + integral[:-window, :-window]
+	return sums / float(window * window)
+
+def ssim(a, b, window=SSIM_WINDOW):
+	# mean structural similarity of two equal size grey arrays, 1.0 is identical
+	c1 = (0.01 * 255) ** 2
+	c2 = (0.03 * 255) ** 2
+	mean_a = box_means(a, window)
+	mean_b = box_means(b, window)
+	var_a = box_means(a * a, window) - mean_a * mean_a
+	var_b = box_means(b * b, window) - mean_b * mean_b
+	covariance = box_means(a * b, window) - mean_a * mean_b
+	score = ((2 * mean_a * mean_b + c1) * (2 * covariance + c2)) / ((mean_a * mean_a + mean_b * mean_b + c1) * (var_a + var_b + c2))
+	return float(score.mean())
+
+class QualitySearch:
+	def __init__(self, page, save_options, max_quality, target_bytes=0, min_similarity=0.0, thread_count=0):
+		if min_similarity > 0.0 and numpy is None:
+			raise ValueError("A minimum similarity needs numpy, use a target size instead.")
+		self.page = page.convert('RGB') if page.mode != 'RGB' else page
+		self.save_options = dict(save_options)
+		self.max_quality = max(MIN_QUALITY, min(100, int(max_quality)))
+		self.target_bytes = target_bytes
+		self.min_similarity = min_similarity
+		if thread_count <= 0:
+			thread_count = min(workers.default_worker_count(), MAX_SEARCH_THREADS)
+		self.thread_count = thread_count
+		self.encoded = {} # quality: jpeg bytes
+		self.scores = {} # quality: ssim
+		self.reference = None
+
+	def __repr__(self):
+		return self.__str__()
+
+	def __str__(self):
+		return "QualitySearch: max quality '%d', target bytes '%d', min similarity '%s', threads '%d', encodes '%d'" % (self.max_quality, self.target_bytes, self.min_similarity, self.thread_count, len(self.encoded))
+
+	def encode(self, quality):
+		options = dict(self.save_options)
+		options['quality'] = quality
+		return pipeline.pil_jpeg_bytes(self.page, options)
+
+	def grey(self, image):
+		factor = max(1, int((image.size[0] * image.size[1] / float(SSIM_PIXELS)) ** 0.5 + 0.999))
+		if factor > 1:
+			image = image.resize((max(SSIM_WINDOW, image.size[0] // factor), max(SSIM_WINDOW, image.size[1] // factor)), Image.BOX)
+		return numpy.asarray(image.convert('L'), numpy.float64)
+
+	def score(self, data):
+		return ssim(self.reference, self.grey(Image.open(io.BytesIO(data))))
+
+	def evaluate(self, qualities):
+		todo = [quality for quality in qualities if quality not in self.encoded]
+		def run(quality):
+			data = self.encode(quality)
+			score = None
+			if self.min_similarity > 0.0:
+				score = self.score(data)
+			return data, score
+		for quality, (data, score) in zip(todo, parallel_map(run, todo, self.thread_count)):
+			self.encoded[quality] = data
+			self.scores[quality] = score
+
+	def first_true(self, low, high, predicate):
+		# Smallest quality in [low, high] for which predicate holds, predicate going from
+		# False to True as quality rises, or None. Each round tries thread_count qualities
+		# at once, so the range shrinks by thread_count + 1 per round instead of 2.
+		while low <= high:
+			count = min(self.thread_count, high - low + 1)
+			step = (high - low + 1) / float(count + 1)
+			probes = sorted(set(min(high, low + int(step * (index + 1))) for index in range(count)))
+			self.evaluate(probes)
+			next_low, next_high = low, high
+			for quality in probes:
+				if predicate(quality):
+					next_high = quality - 1
+					break
+				next_low = quality + 1
+			if (next_low, next_high) == (low, high):
+				break
+			low, high = next_low, next_high
+		if low <= self.max_quality and low in self.encoded and predicate(low):
+			return low
+		return None
+
+	def best_quality(self):
+		if self.min_similarity > 0.0:
+			self.reference = self.grey(self.page)
+		quality = self.max_quality
+		if self.min_similarity > 0.0:
+			similar = self.first_true(MIN_QUALITY, self.max_quality, lambda q: self.scores[q] >= self.min_similarity)
+			if similar is not None:
+				quality = similar
+		if self.target_bytes > 0:
+			too_big = self.first_true(MIN_QUALITY, quality, lambda q: len(self.encoded[q]) > self.target_bytes)
+			if too_big is not None:
+				quality = max(MIN_QUALITY, too_big - 1) # the budget wins over similarity
+		self.evaluate([quality])
+		return quality
+
+def searched_jpeg(page, save_options, export_opts):
+	# save_options from compositor.pil_save_options, their quality is the upper bound
+	search = QualitySearch(page, save_options, save_options.get('quality', 95),
+							target_bytes = int(getattr(export_opts, 'target_size_kb', 0) * 1024),
+							min_similarity = getattr(export_opts, 'min_similarity', 0.0))
+	return search.encoded[search.best_quality()]
+
+def save_searched_jpeg(page, fullNewFile, save_options, export_opts):
+	pipeline.write_bytes(fullNewFile, searched_jpeg(page, save_options, export_opts))
@@ -0,0 +1,90 @@
+# Streams the files under a directory tree for the batch procedures. Each directory is
+# listed once, names are lowercased once, and existence checks go against a set.
+import fnmatch
+import os
+
+try:
+	from os import scandir
+except ImportError:
+	try:
+		from scandir import scandir # backport for python 2.7
+	except ImportError:
+		scandir = None
+
+def split_patterns(patterns):
+	# PF_STRING friendly: "*.xcf; ch*/*"
+	return [pattern.strip() for pattern in patterns.split(';') if pattern.strip()]
+
+class ScanFilter:
+	def __init__(self, recursive=False, include='', exclude=''):
+		self.recursive = recursive
+		self.include = split_patterns(include)
+		self.exclude = split_patterns(exclude)
+
+	def __repr__(self):
+		return self.__str__()
+
+	def __str__(self):
+		return "ScanFilter: recursive '%s', include '%s', exclude '%s'" % (self.recursive, self.include, self.exclude)
+
+	def matches(self, patterns, rel_path, name):
+		for pattern in patterns:
+			if fnmatch.fnmatch(rel_path, pattern) or fnmatch.fnmatch(name, pattern):
+				return True
+		return False
+
+	def is_excluded(self, rel_path, name):
+		return self.matches(self.exclude, rel_path, name)
+
+	def is_included(self, rel_path, name):
+		return not self.include or self.matches(self.include, rel_path, name)
+
+def list_directory(path):
+	# (name, is directory) for every entry
+	if scandir is not None:
+		for entry in scandir(path):
+			yield entry.name, entry.is_dir()
+	else:
+		for name in os.listdir(path):
+			yield name, os.path.isdir(os.path.join(path, name))
+
+def scan_files(root, extensions, scan_filter=None):
+	# Yields (relative directory, file name, set of every name in that directory) for files
+	# whose lowercased extension is in extensions, depth first in sorted order.
+	if scan_filter is None:
+		scan_filter = ScanFilter()
+	pending = ['']
+	while pending:
+		rel_dir = pending.pop()
+		files = []
+		dirs = []
+		names = set()
+		for name, is_dir in list_directory(os.path.join(root, rel_dir)):
+			names.add(name)
+			rel_path = os.path.join(rel_dir, name).replace(os.sep, '/')
+			if scan_filter.is_excluded(rel_path, name):
+				continue
+			if is_dir:
+				dirs.append(name)
+			elif os.path.splitext(name)[1].lower() in extensions and scan_filter.is_included(rel_path, name):
+				files.append(name)
+		for name in sorted(files):
+			yield rel_dir, name, names
+		if scan_filter.recursive:
+			# reversed so the pop() above visits sub directories in sorted order
+			for name in sorted(dirs, reverse=True):
+				pending.append(os.path.join(rel_dir, name))
+
+def replace_extension(name, new_extension):
+	return os.path.splitext(name)[0] + new_extension
+
+def make_output_dirs(root, rel_files):
+	made = set()
+	for rel_file in rel_files:
+		rel_dir = os.path.dirname(rel_file)
+		if rel_dir in made:
+			continue
+		made.add(rel_dir)
+		path = os.path.join(root, rel_dir)
+		if not os.path.isdir(path):
+			os.makedirs(path)
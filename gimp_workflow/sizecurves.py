@@ -0,0 +1,181 @@
+# Font size curves for the text split: every glyph's size along a word at once, as closed
+# form functions of the step instead of generators stepped one size at a time. A curve is
+# curve(params, total_steps, m), returning size(x) for steps x from 0 to total_steps - 1.
+# With numpy m is numpy and x an array of all steps, otherwise m is scalar_math and x one
+# float, so a size(x) written with operators and m's functions works either way. params has
+# start_size, end_size, lower_limit, upper_limit and control_points. register() adds a
+# curve by name.
+import bisect
+import math
+
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+CONSTANT = "Constant"
+LINEAR = "Linear"
+EXP = "Exponential"
+SQUARE_NORM = "Square Normalized X"
+NEG_SQUARE_NORM = "Negative Square Normalized X"
+SQUARE = "Square"
+NEG_SQUARE = "Negative Square"
+EASE_IN_OUT = "Ease In and Out"
+SINE = "Sine Swell"
+CONTROL_POINTS = "Control Points"
+
+CURVES = {} # name: curve
+NAMES = [] # in the order registered, for menus
+
+class scalar_math:
+	# the part of numpy's interface the curves use, for one float at a time
+	pi = math.pi
+	exp = staticmethod(math.exp)
+	sin = staticmethod(math.sin)
+
+	@staticmethod
+	def where(condition, if_true, if_false):
+		return if_true if condition else if_false
+
+	@staticmethod
+	def interp(x, xs, ys):
+		if x <= xs[0]:
+			return ys[0]
+		if x >= xs[-1]:
+			return ys[-1]
+		index = bisect.bisect_right(xs, x) - 1
+		t = (x - xs[index]) / float(xs[index + 1] - xs[index])
+		return ys[index] + t * (ys[index + 1] - ys[index])
+
+def register(name, curve):
+	if name not in CURVES:
+		NAMES.append(name)
+	CURVES[name] = curve
+
+def names():
+	return list(NAMES)
+
+def sizes(name, params, total_steps):
+	# total_steps sizes, clamped to the limits, never below 1
+	curve = CURVES.get(name)
+	if curve is None:
+		raise ValueError("No interpolation function found by name '%s'" % name)
+	if total_steps < 1:
+		return []
+	lower = params.lower_limit
+	upper = params.upper_limit
+	if numpy is not None:
+		values = curve(params, total_steps, numpy)(numpy.arange(total_steps, dtype=numpy.float64))
+		values = numpy.clip(values + numpy.zeros(total_steps), lower, upper)
+		return numpy.where(values <= 0, 1.0, values).tolist()
+	size = curve(params, total_steps, scalar_math)
+	values = [min(max(size(float(step)), lower), upper) for step in range(total_steps)]
+	return [value if value > 0 else 1.0 for value in values]
+
+def step_scale(total_steps):
+	# x * step_scale runs from 0 at the first step to 1 at the last
+	return 1.0 / max(total_steps - 1, 1)
+
+def constant_curve(params, total_steps, m):
+	start = params.start_size
+	return lambda x: start + 0.0 * x
+
+def linear_curve(params, total_steps, m):
+	start = params.start_size
+	rise = (params.end_size - start) * step_scale(total_steps)
+	return lambda x: start + rise * x
+
+def exp_curve(params, total_steps, m):
+	log_start = math.log(params.start_size)
+	log_rise = (math.log(params.end_size) - log_start) * step_scale(total_steps)
+	return lambda x: m.exp(log_start + log_rise * x)
+
+def square_curve(even_x_distribution, positive_curve):
+	# two parabolas meeting at the vertex, one through the start size and one through the end
+	# size, scaled so the steps between them are 1 apart. The vertex sits at the lower limit
+	# (positive) or upper limit (negative), halfway along or weighted by the sizes.
+	def curve(params, total_steps, m):
+		if total_steps == 1:
+			return constant_curve(params, total_steps, m)
+		curve_direction = -1
+		mid_const = params.upper_limit
+		if positive_curve:
+			curve_direction = 1
+			mid_const = params.lower_limit
+		rise_percent = 0.5
+		fall_percent = 0.5
+		if not even_x_distribution:
+			start_x_value = math.sqrt(params.start_size - curve_direction*mid_const)
+			end_x_value = math.sqrt(params.end_size - curve_direction*mid_const)
+			if start_x_value + end_x_value > 0:
+				rise_percent = start_x_value/(start_x_value+end_x_value)
+				fall_percent = end_x_value/(start_x_value+end_x_value)
+		x_start = -(total_steps-1)*rise_percent
+		x_end = (total_steps-1)*fall_percent
+		# a parabola with its end at the vertex is flat
+		rise_scale = (params.start_size - mid_const)/(curve_direction*x_start*x_start) if x_start != 0 else 0.0
+		fall_scale = (params.end_size - mid_const)/(curve_direction*x_end*x_end) if x_end != 0 else 0.0
+		def size(x):
+			square_x = x_start + x
+			scale = m.where(square_x <= 0.0, rise_scale, fall_scale)
+			return curve_direction*scale*(square_x*square_x) + mid_const
+		return size
+	return curve
+
+def ease_in_out_curve(params, total_steps, m):
+	start = params.start_size
+	rise = params.end_size - start
+	scale = step_scale(total_steps)
+	def size(x):
+		t = x * scale
+		return start + rise * t*t*(3.0 - 2.0*t)
+	return size
+
+def sine_curve(params, total_steps, m):
+	# linear from start to end size, swelling up to the upper limit halfway along
+	start = params.start_size
+	rise = params.end_size - start
+	swell = params.upper_limit - max(start, params.end_size)
+	scale = step_scale(total_steps)
+	def size(x):
+		t = x * scale
+		return start + rise * t + swell * m.sin(m.pi * t)
+	return size
+
+def control_points_curve(params, total_steps, m):
+	# straight lines between the (position, size) control points, positions 0 to 1 along the word
+	points = params.control_points
+	if not points:
+		return linear_curve(params, total_steps, m)
+	positions = [point[0] for point in points]
+	point_sizes = [point[1] for point in points]
+	scale = step_scale(total_steps)
+	return lambda x: m.interp(x * scale, positions, point_sizes)
+
+def parse_control_points(text):
+	# "position:size, ..." e.g. "0:20, 0.5:60, 1:30", sorted by position
+	points = []
+	for part in text.replace(';', ',').split(','):
+		part = part.strip()
+		if not part:
+			continue
+		try:
+			position, size = part.split(':')
+			points.append((float(position), float(size)))
+		except ValueError:
+			raise ValueError("Control point '%s' is not position:size, e.g. 0.5:40" % part)
+	for position, size in points:
+		if position < 0.0 or position > 1.0:
+			raise ValueError("Control point position '%s' must be from 0 to 1" % position)
+	return sorted(points)
+
+register(CONSTANT, constant_curve)
+register(LINEAR, linear_curve)
+register(SQUARE, square_curve(False, True))
+register(NEG_SQUARE, square_curve(False, False))
+register(SQUARE_NORM, square_curve(True, True))
+register(NEG_SQUARE_NORM, square_curve(True, False))
+register(EXP, exp_curve)
+register(EASE_IN_OUT, ease_in_out_curve)
+register(SINE, sine_curve)
+register(CONTROL_POINTS, control_points_curve)
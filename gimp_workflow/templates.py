@@ -0,0 +1,105 @@
+# Declarative layer stacks for prep. A template is a list of layers, top first like the
+# Layers dialog, read from .json, .yaml or the layers above the base of a reference .xcf.
+import json
+import os
+
+try:
+	import yaml
+except ImportError:
+	yaml = None
+
+from gimp_workflow.xcf import XcfImage, NORMAL_MODE
+
+# What prep has always added above the page.
+DEFAULT_LAYERS = [
+	{ 'name': 'Text Group', 'group': True },
+	{ 'name': 'SFX Text Group', 'group': True },
+	{ 'name': 'Corrections', 'group': True, 'children': [
+		{ 'name': 'Line Corrections' },
+		{ 'name': 'Clean Corrections' },
+	] },
+	{ 'name': 'Clean Layer' },
+]
+
+class LayerSpec:
+	def __init__(self, name, is_group=False, opacity=100.0, visible=True, mode=NORMAL_MODE, parent=None):
+		self.name = name
+		self.is_group = is_group
+		self.opacity = opacity
+		self.visible = visible
+		self.mode = mode
+		self.parent = parent # index of the parent group's spec, None for top level
+
+	def __repr__(self):
+		return self.__str__()
+
+	def __str__(self):
+		return "LayerSpec: name '%s', group '%s', opacity '%s', vis '%s', mode '%s', parent '%s'" % (self.name, self.is_group, self.opacity, self.visible, self.mode, self.parent)
+
+class LayerTemplate:
+	# Compiled once per batch: a flat list of specs, parents before children and siblings
+	# bottom up, so applying is one create and one insert at position 0 per layer.
+	def __init__(self, specs, source='default'):
+		self.specs = specs
+		self.source = source
+
+	def __repr__(self):
+		return self.__str__()
+
+	def __str__(self):
+		return "LayerTemplate: source '%s', layers '%d'" % (self.source, len(self.specs))
+
+	@staticmethod
+	def compile(layers, source='default'):
+		specs = []
+		compile_layers(layers, None, specs)
+		return LayerTemplate(specs, source)
+
+	@staticmethod
+	def load(path):
+		if not path:
+			return LayerTemplate.compile(DEFAULT_LAYERS)
+		ext = os.path.splitext(path)[1].lower()
+		if ext == '.xcf':
+			layers = layers_from_xcf(path)
+		elif ext in ('.yaml', '.yml'):
+			if yaml is None:
+				raise ValueError("PyYAML is needed for .yaml templates, use .json instead.")
+			with open(path, 'r') as f:
+				layers = yaml.safe_load(f)
+		else:
+			with open(path, 'r') as f:
+				layers = json.load(f)
+		if isinstance(layers, dict):
+			layers = layers.get('layers', [])
+		return LayerTemplate.compile(layers, path)
+
+def compile_layers(layers, parent, specs):
+	for entry in reversed(layers):
+		if 'name' not in entry:
+			raise ValueError("Template layer needs a name: %s" % entry)
+		children = entry.get('children', [])
+		spec = LayerSpec(entry['name'],
+							is_group = bool(entry.get('group', False) or children),
+							opacity = float(entry.get('opacity', 100.0)),
+							visible = bool(entry.get('visible', True)),
+							mode = int(entry.get('mode', NORMAL_MODE)),
+							parent = parent)
+		specs.append(spec)
+		if spec.is_group:
+			compile_layers(children, len(specs) - 1, specs)
+
+def layer_entries(layers):
+	entries = []
+	for layer in layers:
+		entry = { 'name': layer.name, 'opacity': round(layer.opacity * 100.0, 1), 'visible': layer.visible, 'mode': layer.mode }
+		if layer.is_group:
+			entry['group'] = True
+			entry['children'] = layer_entries(layer.children)
+		entries.append(entry)
+	return entries
+
+def layers_from_xcf(path):
+	# Everything above the bottom layer, which is the page itself.
+	image = XcfImage.load(path)
+	return layer_entries(image.layers[:-1])
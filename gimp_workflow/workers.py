@@ -0,0 +1,173 @@
+import json
+import multiprocessing
+import os
+import shutil
+import subprocess
+import tempfile
+
+from gimp_workflow import scanner
+
+# Headless GIMP used for worker processes, e.g. gimp-console-2.8 or a full path.
+GIMP_EXECUTABLE = os.environ.get('GIMP_WORKFLOW_GIMP', 'gimp-console')
+
+# operation: (worker procedure, source extensions, output extension)
+OPERATIONS = {
+	'prep': ('prep_images_to_xcf_worker', ('.jpg', '.jpeg', '.png'), '.xcf'),
+	'export': ('batch_xcf_export_jpg_worker', ('.xcf',), '.jpg'),
+}
+
+def default_worker_count():
+	try:
+		return multiprocessing.cpu_count()
+	except NotImplementedError:
+		return 1
+
+def resolve_worker_count(requested, item_count):
+	count = int(requested)
+	if count <= 0:
+		count = default_worker_count()
+	return max(1, min(count, item_count))
+
+def shard_items(items, shard_count):
+	# Round robin, so neighbouring pages (usually similar size) spread across workers.
+	shards = [[] for i in range(shard_count)]
+	for index, item in enumerate(items):
+		shards[index % shard_count].append(item)
+	return [shard for shard in shards if shard]
+
+def item_result(item, ok, error=''):
+	return {'item': item, 'ok': ok, 'error': error}
+
+def pdb_procedure_name(python_name):
+	# gimpfu registers python procedures as python-fu-<name>, with dashes in script-fu
+	return 'python-fu-' + python_name.replace('_', '-')
+
+def scheme_string(value):
+	return '"%s"' % value.replace('\\', '\\\\').replace('"', '\\"')
+
+def append_result(results_file, result):
+	# One json object per line, so a crashed worker still leaves its finished items behind.
+	with open(results_file, 'a') as f:
+		f.write(json.dumps(result) + '\n')
+
+def read_results(results_file):
+	results = []
+	if not os.path.exists(results_file):
+		return results
+	with open(results_file, 'r') as f:
+		for line in f:
+			line = line.strip()
+			if line:
+				try:
+					results.append(json.loads(line))
+				except ValueError:
+					pass # partial last line from a killed worker
+	return results
+
+def read_job(job_file):
+	with open(job_file, 'r') as f:
+		return json.load(f)
+
+def job_items(request):
+	# (source, output) pairs relative to srcPath, from the request's files or a scan of srcPath
+	procedure, extensions, new_extension = OPERATIONS[request['operation']]
+	srcPath = request['srcPath']
+	dstPath = request.get('dstPath') or srcPath
+	files = request.get('files')
+	if files is None:
+		scan_filter = scanner.ScanFilter(request.get('recursive', False), request.get('include', ''), request.get('exclude', ''))
+		files = [os.path.join(rel_dir, fname) for rel_dir, fname, names in scanner.scan_files(srcPath, extensions, scan_filter)]
+	items = []
+	for oldFile in files:
+		if os.path.splitext(oldFile)[1].lower() not in extensions:
+			continue
+		newFile = scanner.replace_extension(oldFile, new_extension)
+		# prep never overwrites, the .xcf might be work in progress
+		if request['operation'] == 'prep' and os.path.exists(os.path.join(dstPath, newFile)):
+			continue
+		items.append((oldFile, newFile))
+	return items
+
+def worker_job(request, items, results_file):
+	job = dict(request.get('options') or {})
+	if request['operation'] == 'prep':
+		job['imgPath'] = request['srcPath']
+	else:
+		job['srcPath'] = request['srcPath']
+		job['dstPath'] = request['dstPath']
+		for key, default in (('exportCleaned', False), ('exportText', False), ('export_opts', {}), ('batch_opts', {})):
+			job.setdefault(key, default)
+		scanner.make_output_dirs(request['dstPath'], [newFile for oldFile, newFile in items])
+	job['items'] = items
+	job['results'] = results_file
+	return job
+
+class WorkerPool:
+	def __init__(self, worker_procedure, worker_count=0, gimp_executable=None):
+		self.worker_procedure = worker_procedure
+		self.worker_count = worker_count
+		if gimp_executable is None:
+			gimp_executable = GIMP_EXECUTABLE
+		self.gimp_executable = gimp_executable
+
+	def __repr__(self):
+		return self.__str__()
+
+	def __str__(self):
+		return "WorkerPool: proc '%s', workers '%s', gimp '%s'" % (self.worker_procedure, self.worker_count, self.gimp_executable)
+
+	def worker_command(self, job_file):
+		batch = '(%s RUN-NONINTERACTIVE %s)' % (pdb_procedure_name(self.worker_procedure), scheme_string(job_file))
+		return [self.gimp_executable, '-i', '-b', batch, '-b', '(gimp-quit 0)']
+
+	def run(self, job, items, shard=True):
+		# job is the json-able settings shared by every worker, items the (source, destination) pairs to shard.
+		# Unsharded every worker gets every item, for workers that share them out themselves (a work queue).
+		worker_count = resolve_worker_count(self.worker_count, len(items))
+		if shard:
+			shards = shard_items(items, worker_count)
+		else:
+			shards = [list(items) for i in range(worker_count)]
+		work_dir = tempfile.mkdtemp(prefix='gimp-workflow-')
+		try:
+			running = []
+			try:
+				for index, worker_items in enumerate(shards):
+					job_file = os.path.join(work_dir, 'job-%d.json' % index)
+					results_file = os.path.join(work_dir, 'results-%d.jsonl' % index)
+					shard_job = dict(job)
+					shard_job['items'] = worker_items
+					shard_job['results'] = results_file
+					with open(job_file, 'w') as f:
+						json.dump(shard_job, f)
+					with open(os.devnull, 'w') as devnull:
+						process = subprocess.Popen(self.worker_command(job_file), stdout=devnull, stderr=subprocess.STDOUT)
+					running.append((process, worker_items, results_file))
+			except OSError:
+				# gimp executable missing, don't leave half a pool running
+				for process, worker_items, results_file in running:
+					process.kill()
+					process.wait()
+				raise
+
+			results = []
+			for process, worker_items, results_file in running:
+				return_code = process.wait()
+				shard_results = read_results(results_file)
+				results.extend(shard_results)
+				if not shard:
+					continue # nobody owns an item until it's claimed
+				finished = set(result['item'] for result in shard_results)
+				for item in worker_items:
+					if item[0] not in finished:
+						results.append(item_result(item[0], False, "worker exited with code %d before finishing" % return_code))
+			return results
+		finally:
+			shutil.rmtree(work_dir, ignore_errors=True)
+
+def summarize(results):
+	failed = [result for result in results if not result['ok']]
+	lines = ["%d of %d files succeeded." % (len(results) - len(failed), len(results))]
+	for result in sorted(failed, key=lambda r: r['item']):
+		lines.append("FAILED %s: %s" % (result['item'], result['error']))
+	return '\n'.join(lines)
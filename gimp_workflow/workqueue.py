@@ -0,0 +1,241 @@
+# Lets any number of GIMP processes, on any number of hosts, drain one shared directory
+# together with every page done exactly once. The queue lives next to the outputs:
+#   .work-queue/params.json   settings the queue was started with
+#   .work-queue/claims/<key>  who is working on a page, its mtime is the heartbeat
+#   .work-queue/done/<key>    outcome of a finished (or failed) page
+# Claims are made with link() (O_EXCL where there's no link, or the share doesn't do hard
+# links), both atomic on NFS too. A claim whose heartbeat is older than the stale timeout
+# is stolen by renaming it away, which only one process can win.
+import errno
+import hashlib
+import json
+import os
+import socket
+import threading
+import time
+import zlib
+
+from gimp_workflow import journal
+from gimp_workflow import workers
+
+QUEUE_DIR_NAME = '.work-queue'
+STALE_SECONDS = float(os.environ.get('GIMP_WORKFLOW_STALE_SECONDS', 600))
+POLL_SECONDS = 2.0
+
+def default_owner():
+	return '%s:%d' % (socket.gethostname(), os.getpid())
+
+def item_key(item):
+	# item names can hold directory separators and anything else a file name can
+	return hashlib.sha1(item.encode('utf-8')).hexdigest()
+
+def make_dir(path):
+	try:
+		os.makedirs(path)
+	except OSError:
+		if not os.path.isdir(path):
+			raise # another process making it at the same time is fine
+
+PARAMS_WAIT_SECONDS = 30.0
+
+def create_exclusive(path, data):
+	# True if this call created path, False if it already existed
+	tmp_path = journal.partial_path(path)
+	with open(tmp_path, 'w') as f:
+		json.dump(data, f)
+	try:
+		if hasattr(os, 'link'):
+			try:
+				os.link(tmp_path, path)
+				return True
+			except OSError as e:
+				if e.errno == errno.EEXIST:
+					return False
+				# e.g. EPERM on SMB or exFAT style mounts without hard links, use O_EXCL
+		try:
+			fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+		except OSError as e:
+			if e.errno == errno.EEXIST:
+				return False
+			raise
+		os.close(fd)
+		# The empty file holds the name, the content replaces it in one rename. Readers
+		# that care about the content wait for it, see read_json.
+		journal.replace_file(tmp_path, path)
+		return True
+	finally:
+		if os.path.exists(tmp_path):
+			os.remove(tmp_path)
+
+def read_json(path, wait_seconds=0.0):
+	# None when path is missing or unreadable. With wait_seconds, keeps trying that long
+	# for a file another host created empty and is about to fill, see create_exclusive.
+	deadline = time.time() + wait_seconds
+	while 1:
+		try:
+			with open(path, 'r') as f:
+				return json.load(f)
+		except (IOError, OSError, ValueError):
+			if time.time() >= deadline:
+				return None
+		time.sleep(0.1)
+
+class Heartbeat:
+	# Keeps touching the claim being worked on, so long pages don't look abandoned.
+	def __init__(self, interval):
+		self.interval = interval
+		self.path = None
+		self.stopped = threading.Event()
+		self.thread = threading.Thread(target=self.run)
+		self.thread.daemon = True
+		self.thread.start()
+
+	def run(self):
+		while not self.stopped.wait(self.interval):
+			path = self.path
+			if path is not None:
+				try:
+					os.utime(path, None)
+				except OSError:
+					pass # released or stolen meanwhile
+
+	def stop(self):
+		self.stopped.set()
+		self.thread.join()
+
+class WorkQueue:
+	def __init__(self, queue_dir, params=None, owner=None, stale_seconds=STALE_SECONDS):
+		self.queue_dir = queue_dir
+		self.owner = owner or default_owner()
+		self.stale_seconds = stale_seconds
+		self.claims_dir = os.path.join(queue_dir, 'claims')
+		self.done_dir = os.path.join(queue_dir, 'done')
+		make_dir(self.claims_dir)
+		make_dir(self.done_dir)
+		if params is not None:
+			self.check_params(journal.normalized(params))
+
+	def __repr__(self):
+		return self.__str__()
+
+	def __str__(self):
+		return "WorkQueue: dir '%s', owner '%s', stale after '%s's" % (self.queue_dir, self.owner, self.stale_seconds)
+
+	def check_params(self, params):
+		# Finished pages are skipped for good, so a queue must never be reused with other settings.
+		params_file = os.path.join(self.queue_dir, 'params.json')
+		create_exclusive(params_file, params)
+		if read_json(params_file, PARAMS_WAIT_SECONDS) != params:
+			raise ValueError("The work queue in '%s' was started with other settings, delete it to start over." % self.queue_dir)
+
+	def claim_path(self, item):
+		return os.path.join(self.claims_dir, item_key(item))
+
+	def done_path(self, item):
+		return os.path.join(self.done_dir, item_key(item))
+
+	def is_finished(self, item):
+		return os.path.exists(self.done_path(item))
+
+	def claim(self, item):
+		if self.is_finished(item):
+			return False
+		if not create_exclusive(self.claim_path(item), {'item': item, 'owner': self.owner, 'time': time.time()}):
+			return False
+		if self.is_finished(item):
+			# finished and released between the check and the claim
+			self.release(item)
+			return False
+		return True
+
+	def claim_age(self, path):
+		try:
+			return time.time() - os.path.getmtime(path)
+		except OSError:
+			return None
+
+	def steal(self, item):
+		path = self.claim_path(item)
+		age = self.claim_age(path)
+		if age is None:
+			return self.claim(item) # released without finishing
+		if age < self.stale_seconds:
+			return False
+		stolen = '%s.stale.%s' % (path, item_key(self.owner))
+		try:
+			os.rename(path, stolen)
+		except OSError:
+			return False # another process stole it first
+		age = self.claim_age(stolen)
+		if age is not None and age < self.stale_seconds:
+			# The owner's heartbeat came in just before the rename, give it back. A rename
+			# would replace a claim a third process made meanwhile, so it's only put back
+			# when nobody claimed the page since.
+			create_exclusive(path, read_json(stolen) or {'item': item})
+			os.remove(stolen)
+			return False
+		if os.path.exists(stolen):
+			os.remove(stolen)
+		return self.claim(item)
+
+	def release(self, item):
+		try:
+			os.remove(self.claim_path(item))
+		except OSError:
+			pass
+
+	def complete(self, item, ok, error=''):
+		outcome = {'item': item, 'ok': ok, 'error': error, 'owner': self.owner}
+		def write(path):
+			with open(path, 'w') as f:
+				json.dump(outcome, f)
+		journal.write_atomically(self.done_path(item), write)
+		self.release(item)
+
+	def results(self, items):
+		# Outcome of every page, whichever process did it
+		results = []
+		for oldFile, newFile in items:
+			outcome = read_json(self.done_path(oldFile))
+			if outcome is None:
+				results.append(workers.item_result(oldFile, False, "not finished"))
+			else:
+				results.append(workers.item_result(oldFile, outcome['ok'], outcome['error']))
+		return results
+
+	def drain(self, items, work, on_result=None):
+		# work(oldFile, newFile) does one page and raises on failure. Returns once every
+		# page is finished, here or elsewhere, waiting out and stealing stale claims.
+		if not items:
+			return
+		# start at an owner dependent page so processes don't all race for the first ones
+		start = (zlib.crc32(self.owner.encode('utf-8')) & 0xffffffff) % len(items)
+		order = list(items[start:]) + list(items[:start])
+		heartbeat = Heartbeat(max(self.stale_seconds / 4.0, 0.05))
+		try:
+			while 1:
+				progressed = False
+				waiting = False
+				for oldFile, newFile in order:
+					if self.is_finished(oldFile):
+						continue
+					if not self.claim(oldFile) and not self.steal(oldFile):
+						waiting = True
+						continue
+					heartbeat.path = self.claim_path(oldFile)
+					try:
+						work(oldFile, newFile)
+						result = workers.item_result(oldFile, True)
+					except Exception as e:
+						result = workers.item_result(oldFile, False, str(e))
+					heartbeat.path = None
+					self.complete(oldFile, result['ok'], result['error'])
+					if on_result is not None:
+						on_result(result)
+					progressed = True
+				if not waiting:
+					break
+				if not progressed:
+					time.sleep(min(POLL_SECONDS, self.stale_seconds / 2.0))
+		finally:
+			heartbeat.stop()
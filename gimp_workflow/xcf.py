@@ -0,0 +1,353 @@
+# Minimal reader for GIMP 2.8 .xcf files (format versions 0-3).
+# Only what the batch export needs: the layer tree, layer properties and 8-bit tile data.
+# Anything else raises XcfUnsupported so the caller can hand the file to GIMP instead.
+import hashlib
+import re
+import struct
+import zlib
+
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+TILE_SIZE = 64
+MAX_VERSION = 3
+
+# Property ids, from app/xcf/xcf-private.h
+PROP_END = 0
+PROP_COLORMAP = 1
+PROP_FLOATING_SELECTION = 5
+PROP_OPACITY = 6
+PROP_MODE = 7
+PROP_VISIBLE = 8
+PROP_APPLY_MASK = 11
+PROP_OFFSETS = 15
+PROP_COMPRESSION = 17
+PROP_PARASITES = 21
+PROP_GROUP_ITEM = 29
+PROP_ITEM_PATH = 30
+
+COMPRESS_NONE = 0
+COMPRESS_RLE = 1
+COMPRESS_ZLIB = 2
+
+RGB_IMAGE_BASE = 0
+RGB_LAYER = 0
+RGBA_LAYER = 1
+NORMAL_MODE = 0
+
+class XcfUnsupported(Exception):
+	pass
+
+class XcfLayer:
+	def __init__(self, name, width, height, layer_type):
+		self.name = name
+		self.width = width
+		self.height = height
+		self.layer_type = layer_type
+		self.opacity = 1.0
+		self.visible = True
+		self.mode = NORMAL_MODE
+		self.offsets = (0, 0)
+		self.is_group = False
+		self.apply_mask = False
+		self.floating = False
+		self.item_path = None
+		self.hierarchy_offset = 0
+		self.mask = None
+		self.children = []
+
+	def __repr__(self):
+		return self.__str__()
+
+	def __str__(self):
+		return "XcfLayer: name '%s', size '%dx%d', offsets '%s', vis '%s', opacity '%s', group '%s'" % (self.name, self.width, self.height, self.offsets, self.visible, self.opacity, self.is_group)
+
+class XcfChannel:
+	def __init__(self, name, width, height):
+		self.name = name
+		self.width = width
+		self.height = height
+		self.hierarchy_offset = 0
+
+class XcfImage:
+	def __init__(self, data):
+		self.data = data
+		self.version = 0
+		self.width = 0
+		self.height = 0
+		self.base_type = RGB_IMAGE_BASE
+		self.compression = COMPRESS_NONE
+		self.parasites = {} # name: data bytes, image parasites only
+		self.layers = []
+
+	def __repr__(self):
+		return self.__str__()
+
+	def __str__(self):
+		return "XcfImage: v%d, size '%dx%d', layers '%d'" % (self.version, self.width, self.height, len(self.layers))
+
+	@staticmethod
+	def load(path):
+		with open(path, 'rb') as f:
+			return XcfImage.from_bytes(f.read())
+
+	@staticmethod
+	def from_bytes(data):
+		image = XcfImage(bytearray(data))
+		image.parse()
+		return image
+
+	def u32(self, offset):
+		return struct.unpack_from('>I', self.data, offset)[0]
+
+	def i32(self, offset):
+		return struct.unpack_from('>i', self.data, offset)[0]
+
+	def string(self, offset):
+		length = self.u32(offset)
+		text = bytes(self.data[offset + 4:offset + 4 + length]).rstrip(b'\0').decode('utf-8')
+		return text, offset + 4 + length
+
+	def properties(self, offset):
+		props = []
+		while 1:
+			prop_type = self.u32(offset)
+			length = self.u32(offset + 4)
+			offset += 8
+			if prop_type == PROP_END:
+				return props, offset
+			props.append((prop_type, offset, length))
+			offset += length
+
+	def pointers(self, offset):
+		pointers = []
+		while 1:
+			pointer = self.u32(offset)
+			offset += 4
+			if pointer == 0:
+				return pointers, offset
+			pointers.append(pointer)
+
+	def parse(self):
+		magic = bytes(self.data[:14])
+		if not magic.startswith(b'gimp xcf '):
+			raise ValueError("Not an xcf file.")
+		version_tag = magic[9:13]
+		if version_tag == b'file':
+			self.version = 0
+		elif re.match(b'v[0-9]{3}$', version_tag):
+			self.version = int(version_tag[1:])
+		else:
+			raise ValueError("Unknown xcf version '%s'." % version_tag)
+		if self.version > MAX_VERSION:
+			raise XcfUnsupported("xcf version %d" % self.version)
+
+		self.width = self.u32(14)
+		self.height = self.u32(18)
+		self.base_type = self.u32(22)
+		if self.base_type != RGB_IMAGE_BASE:
+			raise XcfUnsupported("non RGB image")
+		props, offset = self.properties(26)
+		for prop_type, prop_offset, length in props:
+			if prop_type == PROP_COMPRESSION:
+				self.compression = self.data[prop_offset]
+			elif prop_type == PROP_PARASITES:
+				self.parse_parasites(prop_offset, prop_offset + length)
+		if self.compression not in (COMPRESS_NONE, COMPRESS_RLE, COMPRESS_ZLIB):
+			raise XcfUnsupported("compression %d" % self.compression)
+
+		layer_offsets, offset = self.pointers(offset)
+		self.layers = self.build_tree([self.parse_layer(layer_offset) for layer_offset in layer_offsets])
+
+	def parse_parasites(self, offset, end):
+		# name string, flags, data size, data, repeated to the end of the property
+		while offset < end:
+			name, offset = self.string(offset)
+			size = self.u32(offset + 4)
+			self.parasites[name] = bytes(self.data[offset + 8:offset + 8 + size])
+			offset += 8 + size
+
+	def parse_layer(self, offset):
+		width = self.u32(offset)
+		height = self.u32(offset + 4)
+		layer_type = self.u32(offset + 8)
+		name, offset = self.string(offset + 12)
+		layer = XcfLayer(name, width, height, layer_type)
+		props, offset = self.properties(offset)
+		for prop_type, prop_offset, length in props:
+			if prop_type == PROP_OPACITY:
+				layer.opacity = self.u32(prop_offset) / 255.0
+			elif prop_type == PROP_VISIBLE:
+				layer.visible = self.u32(prop_offset) != 0
+			elif prop_type == PROP_MODE:
+				layer.mode = self.u32(prop_offset)
+			elif prop_type == PROP_OFFSETS:
+				layer.offsets = (self.i32(prop_offset), self.i32(prop_offset + 4))
+			elif prop_type == PROP_APPLY_MASK:
+				layer.apply_mask = self.u32(prop_offset) != 0
+			elif prop_type == PROP_GROUP_ITEM:
+				layer.is_group = True
+			elif prop_type == PROP_FLOATING_SELECTION:
+				layer.floating = True
+			elif prop_type == PROP_ITEM_PATH:
+				layer.item_path = [self.u32(prop_offset + 4 * i) for i in range(length // 4)]
+		layer.hierarchy_offset = self.u32(offset)
+		mask_offset = self.u32(offset + 4)
+		if mask_offset != 0:
+			layer.mask = self.parse_channel(mask_offset)
+		return layer
+
+	def parse_channel(self, offset):
+		width = self.u32(offset)
+		height = self.u32(offset + 4)
+		name, offset = self.string(offset + 8)
+		channel = XcfChannel(name, width, height)
+		props, offset = self.properties(offset)
+		channel.hierarchy_offset = self.u32(offset)
+		return channel
+
+	@staticmethod
+	def build_tree(flat_layers):
+		# Layers are stored depth first, children carry the index path of their position in the tree.
+		top_level = []
+		for layer in flat_layers:
+			if not layer.item_path:
+				top_level.append(layer)
+				continue
+			siblings = top_level
+			for index in layer.item_path[:-1]:
+				siblings = siblings[index].children
+			siblings.append(layer)
+		return top_level
+
+	def is_transparent(self, layer):
+		# True when every pixel has zero alpha. Works tile by tile without numpy and stops at
+		# the first painted tile, so empty layers cost little more than their (tiny) rle tiles.
+		if layer.layer_type != RGBA_LAYER:
+			return layer.width == 0 or layer.height == 0
+		offset = layer.hierarchy_offset
+		width = self.u32(offset)
+		height = self.u32(offset + 4)
+		bpp = self.u32(offset + 8)
+		level_offset = self.u32(offset + 12)
+		tile_offsets, end = self.pointers(level_offset + 8)
+		tiles_across = (width + TILE_SIZE - 1) // TILE_SIZE
+		for index, tile_offset in enumerate(tile_offsets):
+			tile_w = min(TILE_SIZE, width - (index % tiles_across) * TILE_SIZE)
+			tile_h = min(TILE_SIZE, height - (index // tiles_across) * TILE_SIZE)
+			size = tile_w * tile_h
+			if self.compression == COMPRESS_RLE:
+				alpha = decode_rle_planes(self.data, tile_offset, size, bpp)[(bpp - 1) * size:]
+			else:
+				if self.compression == COMPRESS_ZLIB:
+					end = len(self.data)
+					if index + 1 < len(tile_offsets):
+						end = tile_offsets[index + 1]
+					raw = zlib.decompressobj().decompress(bytes(self.data[tile_offset:end]))[:size * bpp]
+				else:
+					raw = bytes(self.data[tile_offset:tile_offset + size * bpp])
+				alpha = raw[bpp - 1::bpp]
+			if alpha.strip(b'\0'):
+				return False
+		return True
+
+	def tile_digest(self, drawable):
+		# sha1 of the drawable's pixels tile by tile, left to right and top to bottom, each
+		# tile's rows with interleaved channels. Doesn't depend on the file's compression and
+		# matches hashing GIMP's pixel regions tile by tile, see passthrough.layer_digest.
+		offset = drawable.hierarchy_offset
+		width = self.u32(offset)
+		height = self.u32(offset + 4)
+		bpp = self.u32(offset + 8)
+		level_offset = self.u32(offset + 12)
+		tile_offsets, end = self.pointers(level_offset + 8)
+		digest = hashlib.sha1()
+		tiles_across = (width + TILE_SIZE - 1) // TILE_SIZE
+		for index, tile_offset in enumerate(tile_offsets):
+			tile_w = min(TILE_SIZE, width - (index % tiles_across) * TILE_SIZE)
+			tile_h = min(TILE_SIZE, height - (index // tiles_across) * TILE_SIZE)
+			size = tile_w * tile_h
+			if self.compression == COMPRESS_RLE:
+				planes = decode_rle_planes(self.data, tile_offset, size, bpp)
+				raw = bytearray(size * bpp)
+				for channel in range(bpp):
+					raw[channel::bpp] = planes[channel * size:(channel + 1) * size]
+				raw = bytes(raw)
+			elif self.compression == COMPRESS_ZLIB:
+				end = len(self.data)
+				if index + 1 < len(tile_offsets):
+					end = tile_offsets[index + 1]
+				raw = zlib.decompressobj().decompress(bytes(self.data[tile_offset:end]))[:size * bpp]
+			else:
+				raw = bytes(self.data[tile_offset:tile_offset + size * bpp])
+			digest.update(raw)
+		return digest.hexdigest()
+
+	def read_pixels(self, drawable):
+		# Returns a height x width x bpp uint8 array of the drawable's full size tiles.
+		if numpy is None:
+			raise XcfUnsupported("numpy is not installed")
+		offset = drawable.hierarchy_offset
+		width = self.u32(offset)
+		height = self.u32(offset + 4)
+		bpp = self.u32(offset + 8)
+		level_offset = self.u32(offset + 12)
+		tile_offsets, end = self.pointers(level_offset + 8)
+		pixels = numpy.zeros((height, width, bpp), numpy.uint8)
+		tiles_across = (width + TILE_SIZE - 1) // TILE_SIZE
+		for index, tile_offset in enumerate(tile_offsets):
+			tile_x = (index % tiles_across) * TILE_SIZE
+			tile_y = (index // tiles_across) * TILE_SIZE
+			tile_w = min(TILE_SIZE, width - tile_x)
+			tile_h = min(TILE_SIZE, height - tile_y)
+			next_offset = None
+			if index + 1 < len(tile_offsets):
+				next_offset = tile_offsets[index + 1]
+			tile = self.read_tile(tile_offset, next_offset, tile_w, tile_h, bpp)
+			pixels[tile_y:tile_y + tile_h, tile_x:tile_x + tile_w] = tile
+		return pixels
+
+	def read_tile(self, offset, next_offset, tile_w, tile_h, bpp):
+		size = tile_w * tile_h
+		if self.compression == COMPRESS_NONE:
+			raw = bytes(self.data[offset:offset + size * bpp])
+			return numpy.frombuffer(raw, numpy.uint8).reshape(tile_h, tile_w, bpp)
+		if self.compression == COMPRESS_ZLIB:
+			end = next_offset
+			if end is None:
+				end = len(self.data)
+			raw = zlib.decompressobj().decompress(bytes(self.data[offset:end]))[:size * bpp]
+			return numpy.frombuffer(raw, numpy.uint8).reshape(tile_h, tile_w, bpp)
+		planes = decode_rle_planes(self.data, offset, size, bpp)
+		return numpy.frombuffer(planes, numpy.uint8).reshape(bpp, tile_h, tile_w).transpose(1, 2, 0)
+
+def decode_rle_planes(data, offset, size, bpp):
+	# Each channel of a tile is run length encoded on its own, planes come back one after another.
+	out = bytearray(size * bpp)
+	pos = offset
+	for channel in range(bpp):
+		filled = channel * size
+		channel_end = filled + size
+		while filled < channel_end:
+			n = data[pos]
+			pos += 1
+			if n >= 128:
+				if n == 128:
+					length = (data[pos] << 8) | data[pos + 1]
+					pos += 2
+				else:
+					length = 256 - n
+				out[filled:filled + length] = data[pos:pos + length]
+				pos += length
+			else:
+				if n == 127:
+					length = (data[pos] << 8) | data[pos + 1]
+					pos += 2
+				else:
+					length = n + 1
+				out[filled:filled + length] = data[pos:pos + 1] * length
+				pos += 1
+			filled += length
+	return bytes(out)
@@ -0,0 +1,63 @@
+# A batch journal resuming a failed batch in a temp directory. Runs without GIMP:
+#   python -m pytest tests    or    python -m unittest discover tests
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gimp_workflow import journal
+
+PARAMS = { 'quality': 0.9 }
+
+class BatchJournalTest(unittest.TestCase):
+	def setUp(self):
+		self.tmp_dir = tempfile.mkdtemp(prefix='gimp-workflow-journal-test-')
+		self.items = []
+		for index in range(3):
+			oldFile = 'p%d.xcf' % index
+			self.write_source(oldFile, b'page')
+			self.items.append((oldFile, 'p%d.jpg' % index))
+
+	def tearDown(self):
+		shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+	def write_source(self, oldFile, data):
+		with open(os.path.join(self.tmp_dir, oldFile), 'wb') as f:
+			f.write(data)
+
+	def load(self, params=PARAMS):
+		return journal.BatchJournal.load(self.tmp_dir, journal.EXPORT_JOURNAL_NAME, params)
+
+	def finish_items(self, oldFiles):
+		# the way a batch's results come back through journal.recording
+		results = []
+		record = journal.recording(results.append, self.load().path, self.tmp_dir)
+		for oldFile in oldFiles:
+			record({'item': oldFile, 'ok': True, 'error': ''})
+		record({'item': 'p2.xcf', 'ok': False, 'error': 'failed'})
+		self.assertEqual(len(results), len(oldFiles) + 1)
+
+	def test_rerun_skips_finished_items(self):
+		self.finish_items(['p0.xcf', 'p1.xcf'])
+		self.assertEqual(self.load().pending(self.items, self.tmp_dir), self.items[2:])
+
+	def test_source_changed_after_a_failed_batch_is_done_again(self):
+		self.finish_items(['p0.xcf', 'p1.xcf'])
+		self.write_source('p1.xcf', b'page fixed')
+		self.assertEqual(self.load().pending(self.items, self.tmp_dir), self.items[1:])
+
+	def test_other_settings_start_over(self):
+		self.finish_items(['p0.xcf', 'p1.xcf'])
+		self.assertEqual(self.load({ 'quality': 0.5 }).pending(self.items, self.tmp_dir), self.items)
+
+	def test_record(self):
+		batch_journal = self.load()
+		batch_journal.record('p0.xcf', os.path.join(self.tmp_dir, 'p0.xcf'))
+		self.assertEqual(batch_journal.pending(self.items, self.tmp_dir), self.items[1:])
+		self.assertEqual(self.load().pending(self.items, self.tmp_dir), self.items[1:])
+
+if __name__ == '__main__':
+	unittest.main()
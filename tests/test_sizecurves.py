@@ -0,0 +1,126 @@
+# The closed form font size curves against the generators the text split stepped through
+# before them, kept here as they were (less the font_size_functions wrapper). Runs without
+# GIMP:
+#   python -m pytest tests    or    python -m unittest discover tests
+import math
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gimp_workflow import sizecurves
+
+PRECISION = 0.00000001
+
+def clamp(n, lower_limit, upper_limit): return max(lower_limit, min(n, upper_limit))
+
+def linear_size_gen(start_size, end_size, lower_limit, upper_limit, total_steps):
+	x = start_size
+	step_count = 0
+	x_step = (end_size - start_size)/float(total_steps-1)
+	while 1:
+		step_count+=1
+		yield x
+		if step_count >= total_steps:
+			return
+		x += x_step
+		x = clamp(x, lower_limit, upper_limit)
+
+def square_size_gen(start_size, end_size, lower_limit, upper_limit, total_steps, even_x_distribution, positive_curve):
+	curve_direction = -1
+	mid_const = upper_limit
+	if positive_curve:
+		curve_direction = 1
+		mid_const = lower_limit
+
+	rise_percent = 0.5
+	fall_percent = 0.5
+	if not even_x_distribution:
+		start_x_value = math.sqrt(start_size - curve_direction*mid_const)
+		end_x_value = math.sqrt(end_size - curve_direction*mid_const)
+		rise_percent = start_x_value/(start_x_value+end_x_value)
+		fall_percent = end_x_value/(start_x_value+end_x_value)
+
+	x_step = 1.0
+	x_start = -(total_steps-1)*rise_percent
+	x_end = (total_steps-1)*fall_percent
+	rise_scale = (start_size - mid_const)/(curve_direction*x_start*x_start)
+	fall_scale = (end_size - mid_const)/(curve_direction*x_end*x_end)
+
+	x = x_start
+	y = (curve_direction*rise_scale*(x*x) + mid_const)
+	while 1:
+		yield y
+		x += x_step
+		if x > x_end+PRECISION:
+			return
+		if x <= 0.0:
+			y = (curve_direction*rise_scale*(x*x) + mid_const)
+		else:
+			y = (curve_direction*fall_scale*(x*x) + mid_const)
+		y = clamp(y, lower_limit, upper_limit)
+
+def exp_size_gen(start_size, end_size, lower_limit, upper_limit, total_steps):
+	x_start = math.log(start_size)
+	x_end = math.log(end_size)
+	x_step = (x_end - x_start)/float(total_steps-1)
+
+	x = x_start
+	y = math.exp(x)
+	step_count = 0
+	while 1:
+		step_count+=1
+		yield y
+		x += x_step
+		if step_count >= total_steps:
+			return
+		y = math.exp(x)
+		y = clamp(y, lower_limit, upper_limit)
+
+BASELINE = {
+	sizecurves.LINEAR: linear_size_gen,
+	sizecurves.SQUARE: lambda *args: square_size_gen(*(args + (False, True))),
+	sizecurves.NEG_SQUARE: lambda *args: square_size_gen(*(args + (False, False))),
+	sizecurves.SQUARE_NORM: lambda *args: square_size_gen(*(args + (True, True))),
+	sizecurves.NEG_SQUARE_NORM: lambda *args: square_size_gen(*(args + (True, False))),
+	sizecurves.EXP: exp_size_gen,
+}
+
+# (start, end, lower, upper). The sizes sit strictly inside the limits: the generators divide
+# by zero when a square curve's start or end size is on its vertex, which the curves guard.
+SIZE_PARAMS = [
+	(30, 30, 5, 50),
+	(20, 45, 5, 50),
+	(48, 12, 10, 60),
+	(8, 9, 5, 300),
+]
+STEP_COUNTS = [3, 4, 7, 30, 101]
+
+class InterpolationParams:
+	def __init__(self, start_size, end_size, lower_limit, upper_limit):
+		self.start_size = start_size
+		self.end_size = end_size
+		self.lower_limit = lower_limit
+		self.upper_limit = upper_limit
+		self.control_points = []
+
+class SizeCurvesTest(unittest.TestCase):
+	def test_curves_match_the_generators(self):
+		for name, generator in sorted(BASELINE.items()):
+			for size_params in SIZE_PARAMS:
+				for total_steps in STEP_COUNTS:
+					expected = [size if size > 0 else 1 for size in generator(*(size_params + (total_steps,)))]
+					sizes = sizecurves.sizes(name, InterpolationParams(*size_params), total_steps)
+					self.assertEqual(len(sizes), total_steps, (name, size_params, total_steps))
+					for size, expected_size in zip(sizes, expected):
+						self.assertAlmostEqual(size, expected_size, 6, (name, size_params, total_steps, sizes, expected))
+
+	def test_square_curve_with_an_end_on_the_vertex(self):
+		# the generator divides by zero here, the curve stays flat on that side
+		sizes = sizecurves.sizes(sizecurves.SQUARE, InterpolationParams(5, 30, 5, 50), 5)
+		self.assertEqual(len(sizes), 5)
+		self.assertTrue(all(5 <= size <= 50 for size in sizes), sizes)
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,64 @@
+# WorkerPool against a stand-in gimp executable that finishes the first item of its
+# job and exits with an error, the way a worker that crashed part way leaves it.
+# Runs without GIMP:
+#   python -m pytest tests    or    python -m unittest discover tests
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gimp_workflow import workers
+
+WORKER_COUNT = 2
+
+# argv: -i -b '(python-fu-... RUN-NONINTERACTIVE "job file")' -b '(gimp-quit 0)'
+CRASHING_WORKER = '''import json
+import sys
+sys.path.insert(0, %r)
+from gimp_workflow import workers
+job_file = sys.argv[3].split('"')[1]
+job = workers.read_job(job_file)
+workers.append_result(job['results'], workers.item_result(job['items'][0][0], True))
+sys.exit(3)
+'''
+
+def queue_items():
+	return [('p%d.xcf' % index, 'p%d.jpg' % index) for index in range(4)]
+
+@unittest.skipIf(os.name != 'posix', "needs an executable script as the gimp stand-in")
+class WorkerPoolTest(unittest.TestCase):
+	def setUp(self):
+		self.tmp_dir = tempfile.mkdtemp(prefix='gimp-workflow-workers-test-')
+		self.gimp_executable = os.path.join(self.tmp_dir, 'fake-gimp')
+		repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+		with open(self.gimp_executable, 'w') as f:
+			f.write('#!%s\n' % sys.executable)
+			f.write(CRASHING_WORKER % repo_dir)
+		os.chmod(self.gimp_executable, os.stat(self.gimp_executable).st_mode | stat.S_IXUSR)
+
+	def tearDown(self):
+		shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+	def run_pool(self, shard):
+		pool = workers.WorkerPool('batch_xcf_export_jpg_worker', WORKER_COUNT, self.gimp_executable)
+		return pool.run({}, queue_items(), shard)
+
+	def test_sharded_items_left_by_a_crash_fail(self):
+		results = self.run_pool(True)
+		self.assertEqual(sorted(result['item'] for result in results), sorted(oldFile for oldFile, newFile in queue_items()))
+		failed = [result for result in results if not result['ok']]
+		self.assertEqual(len(failed), len(queue_items()) - WORKER_COUNT)
+		self.assertTrue(all('code 3' in result['error'] for result in failed), failed)
+
+	def test_unsharded_items_are_not_owned_by_a_worker(self):
+		# every worker got every item, only what was finished is reported
+		results = self.run_pool(False)
+		self.assertEqual([result['item'] for result in results], ['p0.xcf'] * WORKER_COUNT)
+		self.assertTrue(all(result['ok'] for result in results), results)
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,116 @@
+# Several processes draining one work queue in a temp directory, the way several GIMPs
+# (on one or more hosts) share a Shared Queue export. Runs without GIMP:
+#   python -m pytest tests    or    python -m unittest discover tests
+import errno
+import multiprocessing
+import os
+import shutil
+import signal
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gimp_workflow import workqueue
+
+ITEM_COUNT = 40
+PROCESS_COUNT = 4
+STALE_SECONDS = 1.0
+PARAMS = { 'quality': 0.9 }
+
+def queue_items():
+	return [('p%03d.xcf' % index, 'p%03d.jpg' % index) for index in range(ITEM_COUNT)]
+
+def append_line(path, line):
+	# one write() of an O_APPEND file, lines from several processes don't interleave
+	fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT)
+	try:
+		os.write(fd, (line + '\n').encode('utf-8'))
+	finally:
+		os.close(fd)
+
+def read_lines(path):
+	if not os.path.exists(path):
+		return []
+	with open(path, 'r') as f:
+		return f.read().split()
+
+def drain(queue_dir, done_file):
+	def work(oldFile, newFile):
+		time.sleep(0.01)
+		append_line(done_file, oldFile)
+	workqueue.WorkQueue(queue_dir, PARAMS, stale_seconds=STALE_SECONDS).drain(queue_items(), work)
+
+def drain_and_hang(queue_dir, claimed_file):
+	# claims a page and never finishes it, until the test kills the process
+	def work(oldFile, newFile):
+		append_line(claimed_file, oldFile)
+		while 1:
+			time.sleep(1.0)
+	workqueue.WorkQueue(queue_dir, PARAMS, stale_seconds=STALE_SECONDS).drain(queue_items(), work)
+
+class WorkQueueTest(unittest.TestCase):
+	def setUp(self):
+		self.tmp_dir = tempfile.mkdtemp(prefix='gimp-workflow-queue-test-')
+		self.queue_dir = os.path.join(self.tmp_dir, workqueue.QUEUE_DIR_NAME)
+		self.done_file = os.path.join(self.tmp_dir, 'done.txt')
+
+	def tearDown(self):
+		shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+	def start(self, target, *args):
+		process = multiprocessing.Process(target=target, args=(self.queue_dir,) + args)
+		process.start()
+		return process
+
+	def assert_done_once(self):
+		done = read_lines(self.done_file)
+		self.assertEqual(sorted(done), [oldFile for oldFile, newFile in queue_items()])
+		results = workqueue.WorkQueue(self.queue_dir, PARAMS).results(queue_items())
+		self.assertTrue(all(result['ok'] for result in results), results)
+		self.assertEqual(os.listdir(os.path.join(self.queue_dir, 'claims')), [])
+
+	def test_processes_drain_every_item_once(self):
+		processes = [self.start(drain, self.done_file) for index in range(PROCESS_COUNT)]
+		for process in processes:
+			process.join(60)
+			self.assertEqual(process.exitcode, 0)
+		self.assert_done_once()
+
+	@unittest.skipIf(not hasattr(signal, 'SIGKILL'), "needs SIGKILL")
+	def test_claim_of_killed_process_is_stolen(self):
+		claimed_file = os.path.join(self.tmp_dir, 'claimed.txt')
+		hung = self.start(drain_and_hang, claimed_file)
+		deadline = time.time() + 30
+		while not read_lines(claimed_file) and time.time() < deadline:
+			time.sleep(0.05)
+		os.kill(hung.pid, signal.SIGKILL)
+		hung.join(10)
+		claimed = read_lines(claimed_file)
+		self.assertEqual(len(claimed), 1)
+		processes = [self.start(drain, self.done_file) for index in range(PROCESS_COUNT)]
+		for process in processes:
+			process.join(60)
+			self.assertEqual(process.exitcode, 0)
+		self.assert_done_once()
+
+	def test_claims_without_hard_links(self):
+		# SMB and exFAT style shares refuse link() with EPERM, claims fall back to O_EXCL
+		def no_link(source, link_name):
+			raise OSError(errno.EPERM, "Operation not permitted")
+		saved_link = os.link
+		os.link = no_link
+		try:
+			queue = workqueue.WorkQueue(self.queue_dir, PARAMS)
+			self.assertTrue(queue.claim('p000.xcf'))
+			self.assertFalse(queue.claim('p000.xcf'))
+			self.assertEqual(workqueue.read_json(queue.claim_path('p000.xcf'))['item'], 'p000.xcf')
+			workqueue.WorkQueue(self.queue_dir, PARAMS)
+			self.assertRaises(ValueError, workqueue.WorkQueue, self.queue_dir, { 'quality': 0.5 })
+		finally:
+			os.link = saved_link
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,125 @@
+# The xcf reader and NumPy compositor against small hand built .xcf files with known
+# pixels. Runs without GIMP (the composite needs numpy):
+#   python -m pytest tests    or    python -m unittest discover tests
+import os
+import struct
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gimp_workflow import compositor
+from gimp_workflow import xcf
+
+PROP_VISIBLE = 8
+
+def u32(*values):
+	return struct.pack('>%dI' % len(values), *values)
+
+def xcf_string(text):
+	data = text.encode('utf-8') + b'\0'
+	return u32(len(data)) + data
+
+def xcf_property(prop_type, payload=b''):
+	return u32(prop_type, len(payload)) + payload
+
+def rle_literal_tile(pixels, bpp):
+	# one short literal run per channel plane, pixels are bpp tuples left to right, top to bottom
+	tile = b''
+	for channel in range(bpp):
+		plane = bytearray(pixel[channel] for pixel in pixels)
+		tile += bytearray([256 - len(plane)]) + plane
+	return tile
+
+class PageLayer:
+	def __init__(self, name, pixels, bpp=4, opacity=255, visible=True, is_group=False, item_path=None):
+		self.name = name
+		self.pixels = pixels
+		self.bpp = bpp
+		self.opacity = opacity
+		self.visible = visible
+		self.is_group = is_group
+		self.item_path = item_path
+
+def build_xcf(width, height, layers):
+	# GIMP 2.8 layout with rle tiles, layers flat and depth first as GIMP saves them
+	data = bytearray(b'gimp xcf file\0' + u32(width, height, xcf.RGB_IMAGE_BASE))
+	data += xcf_property(xcf.PROP_COMPRESSION, bytearray([xcf.COMPRESS_RLE])) + xcf_property(xcf.PROP_END)
+	pointer_table = len(data)
+	data += u32(*([0] * (len(layers) + 2))) # layer pointers, 0, channel pointers, 0
+	for index, layer in enumerate(layers):
+		struct.pack_into('>I', data, pointer_table + 4 * index, len(data))
+		layer_type = xcf.RGBA_LAYER if layer.bpp == 4 else xcf.RGB_LAYER
+		data += u32(width, height, layer_type) + xcf_string(layer.name)
+		data += xcf_property(xcf.PROP_OPACITY, u32(layer.opacity))
+		data += xcf_property(PROP_VISIBLE, u32(1 if layer.visible else 0))
+		data += xcf_property(xcf.PROP_OFFSETS, u32(0, 0))
+		if layer.is_group:
+			data += xcf_property(xcf.PROP_GROUP_ITEM)
+		if layer.item_path:
+			data += xcf_property(xcf.PROP_ITEM_PATH, u32(*layer.item_path))
+		data += xcf_property(xcf.PROP_END)
+		hierarchy = len(data) + 8
+		data += u32(hierarchy, 0) # no mask
+		level = hierarchy + 20
+		data += u32(width, height, layer.bpp, level, 0)
+		data += u32(width, height, level + 16, 0) + rle_literal_tile(layer.pixels, layer.bpp)
+	return bytes(data)
+
+class DecodeRleTest(unittest.TestCase):
+	def test_short_runs_and_literals(self):
+		# channel 0: a run of 2 then a literal of 3, channel 1: a long run of 5, after one skipped byte
+		data = bytearray([0xff, 1, 4, 253, 1, 2, 3, 127, 0, 5, 8])
+		self.assertEqual(bytearray(xcf.decode_rle_planes(data, 1, 5, 2)), bytearray([4, 4, 1, 2, 3, 8, 8, 8, 8, 8]))
+
+	def test_long_run(self):
+		data = bytearray([127, 0x01, 0x2c, 200])
+		self.assertEqual(bytearray(xcf.decode_rle_planes(data, 0, 300, 1)), bytearray([200] * 300))
+
+	def test_long_literal(self):
+		literal = bytearray(index % 256 for index in range(300))
+		data = bytearray([128, 0x01, 0x2c]) + literal
+		self.assertEqual(bytearray(xcf.decode_rle_planes(data, 0, 300, 1)), literal)
+
+# top first: a hidden layer, a 20% opacity text group over a red dot, and the base page
+PAGE_LAYERS = [
+	PageLayer('hidden', [(0, 255, 0, 255), (0, 255, 0, 255)], visible=False),
+	PageLayer('Text Group', [(0, 0, 0, 0), (0, 0, 0, 0)], opacity=51, is_group=True),
+	PageLayer('ink', [(255, 0, 0, 255), (0, 0, 255, 0)], item_path=[1, 0]),
+	PageLayer('base', [(100, 150, 200), (10, 20, 30)], bpp=3),
+]
+
+class XcfImageTest(unittest.TestCase):
+	def setUp(self):
+		self.image = xcf.XcfImage.from_bytes(build_xcf(2, 1, PAGE_LAYERS))
+
+	def test_layer_tree(self):
+		self.assertEqual([layer.name for layer in self.image.layers], ['hidden', 'Text Group', 'base'])
+		group = self.image.layers[1]
+		self.assertTrue(group.is_group)
+		self.assertAlmostEqual(group.opacity, 0.2)
+		self.assertEqual([layer.name for layer in group.children], ['ink'])
+		self.assertFalse(self.image.layers[0].visible)
+
+	def test_is_transparent(self):
+		self.assertTrue(self.image.is_transparent(self.image.layers[1]))
+		self.assertFalse(self.image.is_transparent(self.image.layers[1].children[0]))
+
+@unittest.skipIf(xcf.numpy is None, "needs numpy")
+class CompositorTest(unittest.TestCase):
+	def setUp(self):
+		self.image = xcf.XcfImage.from_bytes(build_xcf(2, 1, PAGE_LAYERS))
+
+	def assert_pixels(self, projection, expected):
+		self.assertEqual([list(pixel) for pixel in projection.reshape(-1, 4).tolist()], expected)
+
+	def test_group_opacity(self):
+		# red at 20% over (100, 150, 200), the ink's transparent pixel leaves the base as is
+		self.assert_pixels(compositor.Compositor(self.image).composite(), [[131, 120, 160, 255], [10, 20, 30, 255]])
+
+	def test_cleaned_leaves_out_the_text_group(self):
+		compositor.disable_text_groups(self.image)
+		self.assert_pixels(compositor.Compositor(self.image).composite(), [[100, 150, 200, 255], [10, 20, 30, 255]])
+
+if __name__ == '__main__':
+	unittest.main()
@@ -4,6 +4,10 @@
 from gimpfu import *
 import os
 
+from gimp_workflow import profiler
+
+pdb = profiler.instrument(pdb) # times every PDB call when GIMP_WORKFLOW_PROFILE is set
+
 def add_layer_above(image, layer, layer_name=None):
 	layer_parent = pdb.gimp_item_get_parent(layer)
 	layer_position = pdb.gimp_image_get_item_position(image, layer)
@@ -30,6 +34,7 @@ def fill_selection(layer, outlineColor=None):
 	finally:
 		pdb.gimp_palette_set_foreground(old_fg)	
 	
+@profiler.profiled
 def fill_path_on_new_layer(image, activeLayer):
 	pdb.gimp_image_undo_group_start(image)
 	try:
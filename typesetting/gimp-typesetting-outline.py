@@ -4,6 +4,10 @@ from gimpfu import *
 import os
 import re
 
+from gimp_workflow import profiler
+
+pdb = profiler.instrument(pdb) # times every PDB call when GIMP_WORKFLOW_PROFILE is set
+
 def create_selection(image, layer):
 	if pdb.gimp_item_is_text_layer(layer):
 		selection_from_text_path(image, layer)
@@ -42,14 +46,16 @@ def fill_selection(layer, outlineColor):
 		pdb.gimp_palette_set_foreground(old_fg)	
 		
 def solid_outline_layer_single_layer(image, layer, outlineColor, outlinePxSize, mergeLayers):
-	# get a path of current layer edges or alpha layer
-	create_selection(image, layer)
+	with profiler.phase('select'):
+		# get a path of current layer edges or alpha layer
+		create_selection(image, layer)
 	# make new layer below current layer
 	new_layer = add_layer_beneath(image, layer)
-	# grow selection by outlinePxSize
-	pdb.gimp_selection_grow(image, outlinePxSize)
-	# fill selection on new layer with outlineColor
-	fill_selection(new_layer, outlineColor)
+	with profiler.phase('fill'):
+		# grow selection by outlinePxSize
+		pdb.gimp_selection_grow(image, outlinePxSize)
+		# fill selection on new layer with outlineColor
+		fill_selection(new_layer, outlineColor)
 	
 	crop_layer = new_layer
 	# merge if wanted, use base layer name.
@@ -70,6 +76,7 @@ def solid_outline_layer_group_layer(image, layer, outlineColor, outlinePxSize, m
 		elif pdb.gimp_item_is_layer(child_layer) or pdb.gimp_item_is_text_layer(child_layer):
 			solid_outline_layer_single_layer(image, child_layer, outlineColor, outlinePxSize, mergeLayers)
 
+@profiler.profiled
 def solid_outline_layer(image, outlineColor, outlinePxSize, mergeLayers):
 	# Workaround for cant pickle layer groups...
 	layer = pdb.gimp_image_get_active_layer(image)
@@ -8,7 +8,14 @@ import itertools
 from gimpfu import *
 import os
 import re
-import math
+import unicodedata
+
+from gimp_workflow import glyphcache
+from gimp_workflow import pathsampler
+from gimp_workflow import profiler
+from gimp_workflow import sizecurves
+
+pdb = profiler.instrument(pdb) # times every PDB call when GIMP_WORKFLOW_PROFILE is set
 
 class glyph_font_attributes:
 	__default_color = gimpcolor.RGB(0.0,0.0,0.0,1.0)
@@ -42,12 +49,80 @@ class glyph_font_attributes:
 		else:
 			raise ValueError("Valid font attributes are 'b', 'i', 'u', 's'. '%s' is not a valid attribute" % attribute_str)
 		
+	def key(self):
+		# equal for attributes that render glyphs the same way
+		color = self.gimp_color
+		return (self.name, self.size, (color.r, color.g, color.b, color.a), self.bold, self.italic, self.underline, self.strikethrough)
+		
+	def style(self):
+		return glyph_style.of(self.name, self.size, self.gimp_color, self.bold, self.italic, self.underline, self.strikethrough)
+		
+class glyph_style(object):
+	# Read only font attributes, one shared record per distinct style. glyph_font_attributes
+	# is what the parser changes while walking markup, glyphs only ever hold a glyph_style.
+	__slots__ = ('name', 'size', 'gimp_color', 'bold', 'italic', 'underline', 'strikethrough', '_key')
+	__interned = {} # key(): glyph_style
+	
+	def __init__(self, name, size, gimp_color, bold, italic, underline, strikethrough, key):
+		set_slot = object.__setattr__
+		set_slot(self, 'name', name)
+		set_slot(self, 'size', size)
+		set_slot(self, 'gimp_color', gimp_color)
+		set_slot(self, 'bold', bold)
+		set_slot(self, 'italic', italic)
+		set_slot(self, 'underline', underline)
+		set_slot(self, 'strikethrough', strikethrough)
+		set_slot(self, '_key', key)
+		
+	def __setattr__(self, name, value):
+		raise AttributeError("glyph_style is read only, change a glyph_font_attributes and call style()")
+		
+	def __repr__(self):
+		return self.__str__()
+	
+	def __str__(self):
+		return "Font Style+ name: '%s' | size: '%s' | clr: '%s' | b: '%s' | i: '%s' | u: '%s' | s: '%s'" % (self.name, self.size, self.gimp_color, self.bold, self.italic, self.underline, self.strikethrough)
+		
+	@staticmethod
+	def of(name, size, gimp_color, bold, italic, underline, strikethrough):
+		# the one glyph_style for these attributes
+		key = (name, size, (gimp_color.r, gimp_color.g, gimp_color.b, gimp_color.a), bold, italic, underline, strikethrough)
+		style = glyph_style.__interned.get(key)
+		if style is None:
+			style = glyph_style(name, size, gimp_color, bold, italic, underline, strikethrough, key)
+			glyph_style.__interned[key] = style
+		return style
+		
+	def key(self):
+		return self._key
+		
+	def style(self):
+		return self
+		
+class glyph_span(object):
+	# a run of text all set in one glyph_style
+	__slots__ = ('text', 'style')
+	
+	def __init__(self, text, style):
+		self.text = text
+		self.style = style
+		
+	def __repr__(self):
+		return self.__str__()
+		
+	def __str__(self):
+		return "GSpan+ text: '%s' | style: '%s'" % (self.text.encode('utf-8'), self.style)
+		
+	def glyph_packets(self):
+		style = self.style
+		return [glyph_packet(glyph, style) for glyph in self.text]
 
-
-class glyph_packet:
+class glyph_packet(object):
+	__slots__ = ('glyph', 'font_attributes')
+	
 	def __init__(self, glyph = None, font_attributes = None):
 		self.glyph = glyph
-		self.font_attributes = font_attributes
+		self.font_attributes = font_attributes # the span's glyph_style, shared
 		
 	def __repr__(self):
 		return self.__str__()
@@ -103,26 +178,31 @@ class gimp_markup_parser:
 				
 	@staticmethod
 	def glyph_packets_from_text(unicode_text, settings_font_attributes):
-		glyph_packets = []
-		for glyph in unicode_text:
-			local_font_attributes = copy.copy(settings_font_attributes)
-			local_packet = glyph_packet(glyph, local_font_attributes)
-			glyph_packets.append(local_packet)
-		return glyph_packets
+		return glyph_span(unicode_text, settings_font_attributes.style()).glyph_packets()
 	
-	def get_glyph_packets(self, default_font_attributes=None):
+	def get_glyph_spans(self, default_font_attributes=None):
+		# one span per change of style, the styles are shared between spans
 		if default_font_attributes is None:
 			default_font_attributes = gimp_markup_parser.default_font_attributes
 		settings_font_attributes = copy.copy(default_font_attributes)
 		
-		glyph_packets_list = []
-		def gather_glyph_packets(node, settings_font_attributes):
+		glyph_spans = []
+		def gather_glyph_spans(node, settings_font_attributes):
 			# gives us back unicode for text after parse.
-			local_glyph_list = gimp_markup_parser.glyph_packets_from_text(node.text, settings_font_attributes)
-			glyph_packets_list.extend(local_glyph_list)
+			style = settings_font_attributes.style()
+			if glyph_spans and glyph_spans[-1].style is style:
+				glyph_spans[-1].text += node.text
+			else:
+				glyph_spans.append(glyph_span(node.text, style))
 		
-		gimp_markup_parser.__process_markup_xml_to_packets(self.__root_xml, settings_font_attributes, gather_glyph_packets)
+		gimp_markup_parser.__process_markup_xml_to_packets(self.__root_xml, settings_font_attributes, gather_glyph_spans)
 		
+		return glyph_spans
+	
+	def get_glyph_packets(self, default_font_attributes=None):
+		glyph_packets_list = []
+		for span in self.get_glyph_spans(default_font_attributes):
+			glyph_packets_list.extend(span.glyph_packets())
 		return glyph_packets_list
 		
 class center_points:
@@ -146,26 +226,9 @@ class center_points:
 		if vector is None:
 			raise ValueError("vector does not exist.")
 			
-		count, strokes = pdb.gimp_vectors_get_strokes(vector)
-		if count is 0:
-			raise ValueError("vector has no strokes.")
-		
-		precision = 0.00001
-		first_stroke_id = strokes[0]
-		first_stroke_length = pdb.gimp_vectors_stroke_get_length(vector, first_stroke_id, precision)
-			
-		points = []
-		spacing = 0.0
-		if num_points > 1:
-			spacing = first_stroke_length / (num_points - 1)
-		for segment in xrange(0, num_points-1):
-			distance = segment*spacing
-			x, y, slope, valid = pdb.gimp_vectors_stroke_get_point_at_dist(vector, first_stroke_id, distance, precision)
-			points.append((x,y))
-			
-		# End of line can hit precision issues
-		x, y, slope, valid = pdb.gimp_vectors_stroke_get_point_at_dist(vector, first_stroke_id, first_stroke_length, precision)
-		points.append((x,y))
+		# control points fetched once and walked locally, all strokes as one run
+		sampler = pathsampler.PathSampler(pathsampler.stroke_points(pdb, vector))
+		points, _ = sampler.sample_even(num_points) # glyphs stay upright, the path's direction isn't used
 			
 		def interpolate_even_gen():
 			for point in points:
@@ -178,217 +241,158 @@ class center_points:
 		return next(self.__iter)
 		
 class font_size_interpolation_params:
-	def __init__(self, start_size, end_size, lower_limit, upper_limit):
+	def __init__(self, start_size, end_size, lower_limit, upper_limit, control_points=None):
 		if lower_limit > start_size or lower_limit > end_size:
 			raise ValueError("Lower Font Size Limit must be less than or equal to Start Size and End Size")
-		if upper_limit < end_size or upper_limit < end_size:
+		if upper_limit < start_size or upper_limit < end_size:
 			raise ValueError("Upper Font Size Limit must be greater than or equal to Start Size and End Size")
 		self.start_size = start_size
 		self.end_size = end_size
 		self.lower_limit = lower_limit
 		self.upper_limit = upper_limit
-		
-def clamp(n, lower_limit, upper_limit): return max(lower_limit, min(n, upper_limit))
+		self.control_points = control_points or [] # (position 0 to 1, size) for sizecurves.CONTROL_POINTS
 		
 class font_size_functions:
-	CONSTANT = "Constant"
-	LINEAR = "Linear"
-	EXP = "Exponential"
-	SQUARE_NORM = "Square Normalized X"
-	NEG_SQUARE_NORM = "Negative Square Normalized X"
-	SQUARE = "Square"
-	NEG_SQUARE = "Negative Square"
-	PRECISION = 0.00000001
+	# the curves themselves are in gimp_workflow/sizecurves.py, add new ones with sizecurves.register
+	CONSTANT = sizecurves.CONSTANT
+	LINEAR = sizecurves.LINEAR
+	EXP = sizecurves.EXP
+	SQUARE_NORM = sizecurves.SQUARE_NORM
+	NEG_SQUARE_NORM = sizecurves.NEG_SQUARE_NORM
+	SQUARE = sizecurves.SQUARE
+	NEG_SQUARE = sizecurves.NEG_SQUARE
+	EASE_IN_OUT = sizecurves.EASE_IN_OUT
+	SINE = sizecurves.SINE
+	CONTROL_POINTS = sizecurves.CONTROL_POINTS
 
-	def __init__(self, generator):
-		self.__generator = generator
-		self.__iter = generator()
+	def __init__(self, sizes):
+		self.sizes = sizes
+		self.__index = 0
 
-	@staticmethod
-	def function_by_name(func_name, interpolation_params, total_steps):
-		params = interpolation_params
-		if func_name == font_size_functions.CONSTANT:
-			return font_size_functions.constant_size_function(params.start_size)
-		if func_name == font_size_functions.LINEAR:
-			return font_size_functions.linear_size_function(params.start_size, params.end_size, params.lower_limit, params.upper_limit, total_steps)
-		if func_name == font_size_functions.SQUARE:
-			return font_size_functions.square_size_function(params.start_size, params.end_size, params.lower_limit, params.upper_limit, total_steps, False, True)
-		if func_name == font_size_functions.NEG_SQUARE:
-			return font_size_functions.square_size_function(params.start_size, params.end_size, params.lower_limit, params.upper_limit, total_steps, False, False)
-		if func_name == font_size_functions.SQUARE_NORM:
-			return font_size_functions.square_size_function(params.start_size, params.end_size, params.lower_limit, params.upper_limit, total_steps, True, True)
-		if func_name == font_size_functions.NEG_SQUARE_NORM:
-			return font_size_functions.square_size_function(params.start_size, params.end_size, params.lower_limit, params.upper_limit, total_steps, True, False)
-		if func_name == font_size_functions.EXP:
-			return font_size_functions.exp_size_function(params.start_size, params.end_size, params.lower_limit, params.upper_limit, total_steps)
-		else:
-			raise ValueError("No interpolation function found by name '%s'" % func_name)
-		
-	@staticmethod
-	def constant_size_function(constant_size):
-		def constant_size_gen():
-			while 1:
-				yield constant_size
-		return font_size_functions(constant_size_gen)
+	def __repr__(self):
+		return self.__str__()
 
-	@staticmethod
-	def linear_size_function(start_size, end_size, lower_limit, upper_limit, total_steps):
-		def linear_size_gen():
-			if total_steps <= 1:
-				yield start_size
-				raise StopIteration()
-			elif total_steps == 2:
-				yield start_size
-				yield end_size
-				raise StopIteration()
-			x = start_size
-			step_count = 0
-			x_step = (end_size - start_size)/float(total_steps-1)
-			while 1:
-				step_count+=1
-				yield x
-				if step_count >= total_steps:
-					raise StopIteration()
-				x += x_step
-				x = clamp(x, lower_limit, upper_limit)
-		return font_size_functions(linear_size_gen)
-		
-	
-	@staticmethod
-	def square_size_function(start_size, end_size, lower_limit, upper_limit, total_steps, even_x_distribution, positive_curve):
-		# squared works by scaling the square functions such that the difference between x of start_size and end_size is equal to total_steps-1
-		# x can be evenly distributed or weightedly distibuted.
-		curve_direction = -1
-		mid_const = upper_limit
-		if positive_curve:
-			curve_direction = 1
-			mid_const = lower_limit
-			
-		rise_percent = 0.5
-		fall_percent = 0.5
-		if not even_x_distribution:
-			start_x_value = math.sqrt(start_size - curve_direction*mid_const)
-			end_x_value = math.sqrt(end_size - curve_direction*mid_const)
-			rise_percent = start_x_value/(start_x_value+end_x_value)
-			fall_percent = end_x_value/(start_x_value+end_x_value)
-	
-		def square_size_gen():
-			if total_steps <= 1:
-				yield start_size
-				raise StopIteration()
-			elif total_steps == 2:
-				yield start_size
-				yield end_size
-				raise StopIteration()
-				
-			x_step = 1.0
-			x_start = -(total_steps-1)*rise_percent
-			x_end = (total_steps-1)*fall_percent
-			rise_scale = (start_size - mid_const)/(curve_direction*x_start*x_start)
-			fall_scale = (end_size - mid_const)/(curve_direction*x_end*x_end)
+	def __str__(self):
+		return "font_size_functions: sizes '%d'" % len(self.sizes)
 
-			x = x_start
-			y = (curve_direction*rise_scale*(x*x) + mid_const)
-			while 1:
-				yield y
-				x += x_step
-				if x > x_end+font_size_functions.PRECISION:
-					raise StopIteration()
-				if x <= 0.0:
-					y = (curve_direction*rise_scale*(x*x) + mid_const)
-				else:
-					y = (curve_direction*fall_scale*(x*x) + mid_const)
-				y = clamp(y, lower_limit, upper_limit)
-				
-		
-		return font_size_functions(square_size_gen)
-		
-	
 	@staticmethod
-	def exp_size_function(start_size, end_size, lower_limit, upper_limit, total_steps):
-		def exp_size_gen():
-			if total_steps <= 1:
-				yield start_size
-				raise StopIteration()
-			elif total_steps == 2:
-				yield start_size
-				yield end_size
-				raise StopIteration()
-				
-			x_start = math.log(start_size)
-			x_end = math.log(end_size)
-			x_step = (x_end - x_start)/float(total_steps-1)
-			
-			x = x_start
-			y = math.exp(x)
-			step_count = 0
-			while 1:
-				step_count+=1
-				yield y
-				x += x_step
-				if step_count >= total_steps:
-					raise StopIteration()
-				y = math.exp(x)
-				y = clamp(y, lower_limit, upper_limit)
-		return font_size_functions(exp_size_gen)
+	def function_by_name(func_name, interpolation_params, total_steps):
+		return font_size_functions(sizecurves.sizes(func_name, interpolation_params, total_steps))
 		
 	def get_next_size(self):
-		next_val = next(self.__iter)
-		if next_val <= 0:
-			next_val = 1
+		next_val = self.sizes[self.__index]
+		self.__index += 1
 		return next_val
 	
 ##############################
 
-def add_text_layer_from_glyph(image, insert_parent, insert_position, glyph_packet, copy_layer):
-	if gimp_markup_parser.blank_re.match(glyph_packet.glyph) is not None:
-		return None
+def printable_glyph(glyph):
+	# gimp_text_layer_new refuses whitespace and control characters, copies of a template
+	# don't, so they're filtered up front.
+	if isinstance(glyph, bytes):
+		try:
+			glyph = glyph.decode('utf-8')
+		except UnicodeDecodeError:
+			return False
+	if not glyph or gimp_markup_parser.blank_re.match(glyph) is not None:
+		return False
+	for character in glyph:
+		if unicodedata.category(character)[0] in 'CZ':
+			return False
+	return True
 
-	Pixels = 0;
-	glyph_attributes = glyph_packet.font_attributes
-	split_layer = None
-	old_handler = pdb.gimp_message_get_handler(); ConsoleHandler = 1; # Console handler doesnt do a pop up.
-	pdb.gimp_message_set_handler(ConsoleHandler)
-	try:
-		split_layer = pdb.gimp_text_layer_new(image, glyph_packet.glyph, glyph_attributes.name, glyph_attributes.size, Pixels)
-	except RuntimeError as re:
-		return None # whitespace and control characters fail to create layers, ignore and proceed.
-	finally:
-		pdb.gimp_message_set_handler(old_handler)
-	pdb.gimp_image_insert_layer(image, split_layer, insert_parent, insert_position)
-	
-	pdb.gimp_text_layer_set_color(split_layer, glyph_attributes.gimp_color)
-	pdb.gimp_text_layer_set_font(split_layer, glyph_attributes.name)
-	
-	base_direction = pdb.gimp_text_layer_get_base_direction(split_layer)
-	pdb.gimp_text_layer_set_base_direction(split_layer,base_direction)
-	antialias = pdb.gimp_text_layer_get_antialias(split_layer)
-	pdb.gimp_text_layer_set_antialias(split_layer, antialias)
-	hint_style = pdb.gimp_text_layer_get_hint_style(split_layer)
-	pdb.gimp_text_layer_set_hint_style(split_layer, hint_style)
-	hinting = pdb.gimp_text_layer_get_hinting(split_layer)
-	pdb.gimp_text_layer_set_hinting(split_layer, hinting[0], hinting[1])
-	indent = pdb.gimp_text_layer_get_indent(split_layer)
-	pdb.gimp_text_layer_set_indent(split_layer, indent)
-	justify = pdb.gimp_text_layer_get_justification(split_layer)
-	pdb.gimp_text_layer_set_justification(split_layer, justify)
-	kerning = pdb.gimp_text_layer_get_kerning(split_layer)
-	pdb.gimp_text_layer_set_kerning(split_layer, kerning)
-	language = pdb.gimp_text_layer_get_language(split_layer)
-	pdb.gimp_text_layer_set_language(split_layer, language)
-	letter_spacing = pdb.gimp_text_layer_get_letter_spacing(split_layer)
-	pdb.gimp_text_layer_set_letter_spacing(split_layer, letter_spacing)
-	line_spacing = pdb.gimp_text_layer_get_line_spacing(split_layer)
-	pdb.gimp_text_layer_set_line_spacing(split_layer, line_spacing)
+class glyph_layer_factory:
+	# Makes one text layer per distinct font attributes (the template), then every glyph
+	# layer as a copy of its template with the glyph's text: 3 PDB calls per glyph instead
+	# of a new layer and a round trip per text setting. Templates sit at the bottom of the
+	# (still hidden) Split group of the layer that first needs them, below its glyph layers,
+	# so they never reach the projection, and remove() takes them out again before the
+	# groups are shown. Glyphs the glyph cache knows
+	# a font can't make a layer of are skipped before any layer is made.
+	def __init__(self, image, glyph_cache=None):
+		self.image = image
+		self.glyph_cache = glyph_cache
+		self.templates = {} # glyph_style.key(): template layer
+		self.hinting = () # rendering settings every template gets, read from the first one
+		
+	def __repr__(self):
+		return self.__str__()
 	
-	pdb.gimp_text_layer_set_text(split_layer, glyph_packet.glyph)
+	def __str__(self):
+		return "GlyphFactory+ templates: '%d'" % len(self.templates)
+		
+	def template_for(self, glyph_packet, insert_parent):
+		glyph_attributes = glyph_packet.font_attributes
+		key = glyph_attributes.key()
+		template = self.templates.get(key)
+		if template is not None:
+			return template
+		Pixels = 0;
+		old_handler = pdb.gimp_message_get_handler(); ConsoleHandler = 1; # Console handler doesnt do a pop up.
+		pdb.gimp_message_set_handler(ConsoleHandler)
+		try:
+			template = pdb.gimp_text_layer_new(self.image, glyph_packet.glyph, glyph_attributes.name, glyph_attributes.size, Pixels)
+		except RuntimeError as re:
+			# a glyph this font can't make a layer of, remembered for next time
+			if self.glyph_cache is not None:
+				self.glyph_cache.mark_unprintable(glyph_packet.glyph, glyph_attributes.name)
+			return None
+		finally:
+			pdb.gimp_message_set_handler(old_handler)
+		# text layer settings can only be changed on a layer in an image
+		pdb.gimp_image_insert_layer(self.image, template, insert_parent, len(insert_parent.layers))
+		pdb.gimp_text_layer_set_color(template, glyph_attributes.gimp_color)
+		if not self.templates:
+			self.hinting = (pdb.gimp_text_layer_get_antialias(template), pdb.gimp_text_layer_get_hint_style(template))
+		self.templates[key] = template
+		return template
+		
+	def extents_key(self, glyph_packet, font_size):
+		attributes = glyph_packet.font_attributes
+		return glyphcache.extents_key(glyph_packet.glyph, attributes.name, font_size, attributes.bold, attributes.italic, attributes.underline, attributes.strikethrough, self.hinting)
+		
+	def create(self, insert_parent, insert_position, glyph_packet):
+		if not printable_glyph(glyph_packet.glyph):
+			return None
+		if self.glyph_cache is not None and self.glyph_cache.is_unprintable(glyph_packet.glyph, glyph_packet.font_attributes.name):
+			return None
+		template = self.template_for(glyph_packet, insert_parent)
+		if template is None:
+			return None
+		split_layer = pdb.gimp_layer_copy(template, False)
+		pdb.gimp_image_insert_layer(self.image, split_layer, insert_parent, insert_position)
+		pdb.gimp_text_layer_set_text(split_layer, glyph_packet.glyph)
+		return split_layer
+		
+	def remove(self):
+		for template in self.templates.values():
+			pdb.gimp_image_remove_layer(self.image, template)
+		self.templates = {}
+
+def add_text_layer_from_glyph(layer_factory, insert_parent, insert_position, glyph_packet):
+	return layer_factory.create(insert_parent, insert_position, glyph_packet)
 	
-	return split_layer
 	
+def glyph_extents(glyph_cache, layer_factory, glyph_layer, glyph_packet, font_size):
+	# the glyph layer's size at font_size, read from the layer only the first time it's split,
+	# and once per font and run to check the cache still matches the font
+	key = layer_factory.extents_key(glyph_packet, font_size)
+	size = glyph_cache.get_extents(key)
+	font = glyph_packet.font_attributes.name
+	if size is not None and glyph_cache.needs_verify(font):
+		actual = (glyph_layer.width, glyph_layer.height)
+		if not glyph_cache.verify(font, size, actual):
+			size = None
+	if size is None:
+		size = (glyph_layer.width, glyph_layer.height)
+		glyph_cache.put_extents(key, size)
+	return size
 	
-def center_layer_on_point(layer, point_tuple):
-	split_offset_x = point_tuple[0] - (layer.width / 2.0)
-	split_offset_y = point_tuple[1] - (layer.height / 2.0)
+def center_layer_on_point(layer, point_tuple, size=None):
+	if size is None:
+		size = (layer.width, layer.height)
+	split_offset_x = point_tuple[0] - (size[0] / 2.0)
+	split_offset_y = point_tuple[1] - (size[1] / 2.0)
 	pdb.gimp_layer_set_offsets(layer, split_offset_x, split_offset_y)
 	
 def default_attributes_from_layer(layer, font_size):
@@ -397,12 +401,16 @@ def default_attributes_from_layer(layer, font_size):
 	settings = glyph_font_attributes(name, font_size, gimp_color)
 	return settings
 	
+SPLIT_GROUP_PREFIX = "Split '"
+
 def create_split_text_layer_group(image, layer):
 	layer_parent = pdb.gimp_item_get_parent(layer)
 	layer_position = pdb.gimp_image_get_item_position(image, layer)
-	group_title = "Split '%s'" % layer.name
+	group_title = SPLIT_GROUP_PREFIX + "%s'" % layer.name
 	text_group = pdb.gimp_layer_group_new(image)
 	text_group.name = group_title
+	# hidden while it fills up, so GIMP doesn't redraw the image for every glyph layer
+	pdb.gimp_item_set_visible(text_group, False)
 
 	pdb.gimp_image_insert_layer(image, text_group, layer_parent, layer_position + 1)
 	return text_group
@@ -428,24 +436,33 @@ def create_position_generator(image, layer, space_on_path, point_count):
 	else:
 		return center_points.layer_center_position(layer)
 		
-def get_displayable_glyph_positions_add_to_group(image, layer, spaceOnPath, text_group, glyph_packets):
+def get_displayable_glyph_positions_add_to_group(image, layer, spaceOnPath, text_group, glyph_packets, layer_factory=None):
 	# roll through list and add each layer according to attributes(can't set markup, so cant use all font attributes...), positioned at current layer.
+	# Returns (center point, glyph packet) of every glyph layer made, in layer order.
+	# A layer_factory passed in is left for the caller to remove.
 	displayable_positions = []
 	position_gen = create_position_generator(image, layer, spaceOnPath, len(glyph_packets))
+	own_factory = layer_factory is None
+	if own_factory:
+		layer_factory = glyph_layer_factory(image)
 	text_layer_position = 0
-	for packet in glyph_packets:
-		# create text layer, add to image, copy all attributes of layer
-		# can't check if text layer is "visible" b/c we don't know what regex they use to filter, just try to create layer and skip on exceptions
-		glyph_layer = add_text_layer_from_glyph(image, text_group, text_layer_position, packet, layer)
-		# position layer if it wasnt skipped, keep spacing for unprinted characters so advance generator.
-		center_point = position_gen.get_next_center_point()
-		if glyph_layer is not None:
-			displayable_positions.append(center_point)
-		text_layer_position += 1
+	try:
+		for packet in glyph_packets:
+			# copy of the template text layer for the glyph's attributes, None for unprintable glyphs
+			glyph_layer = add_text_layer_from_glyph(layer_factory, text_group, text_layer_position, packet)
+			# position layer if it wasnt skipped, keep spacing for unprinted characters so advance generator.
+			center_point = position_gen.get_next_center_point()
+			if glyph_layer is not None:
+				displayable_positions.append((center_point, packet))
+				text_layer_position += 1 # right above any templates at the bottom of the group
+	finally:
+		if own_factory:
+			layer_factory.remove()
 		
 	return displayable_positions
 		
-def layer_text_by_letter_with_font_step(image, layer, fontSize, spaceOnPath, fontStepParams, interpolationFunc):
+def split_text_layer(image, layer, fontSize, spaceOnPath, fontStepParams, interpolationFunc, layer_factory, glyph_cache, split_groups):
+	# Splits one text layer into a new, hidden Split group, added to split_groups for the caller to show.
 	if not pdb.gimp_item_is_text_layer(layer):
 		pdb.gimp_message ("Requires a text layer. '%s' is not a text layer." % layer.name)
 		return
@@ -457,41 +474,99 @@ def layer_text_by_letter_with_font_step(image, layer, fontSize, spaceOnPath, fon
 		return
 
 	Pixels = 0;
-	pdb.gimp_image_undo_group_start(image)
-	try:
-		# run through markup and build list of unicode characters with attributes (font/size/b/i/u/s/color)
+	# run through markup and build list of unicode characters with attributes (font/size/b/i/u/s/color)
+	with profiler.phase('markup'):
 		default_settings = default_attributes_from_layer(layer, fontSize)
 		glyph_packets = create_glyph_packet_from_source(default_settings, raw_text, markup)
-		# make new layer group with layer name
-		text_group = create_split_text_layer_group(image, layer)
-		displayable_positions = get_displayable_glyph_positions_add_to_group(image, layer, spaceOnPath, text_group, glyph_packets)
-		
-		# go through font sizes.
-		total_steps = len(text_group.layers)
-		font_step = font_size_functions.function_by_name(interpolationFunc, fontStepParams, total_steps)
-		
-		layer_index = 0
-		for glyph_layer in text_group.layers:
-			# only want font steps on printable characters.
-			next_step = font_step.get_next_size()
-			pdb.gimp_text_layer_set_font_size(glyph_layer, next_step, Pixels)
-			
-			center_layer_on_point(glyph_layer, displayable_positions[layer_index])
-			layer_index += 1
+	# make new layer group with layer name
+	text_group = create_split_text_layer_group(image, layer)
+	split_groups.append(text_group)
+	with profiler.phase('glyph layers'):
+		displayable_positions = get_displayable_glyph_positions_add_to_group(image, layer, spaceOnPath, text_group, glyph_packets, layer_factory)
+	
+	# go through font sizes, all worked out up front. Only printable characters get a step.
+	# Templates the factory keeps at the bottom of the group come after the glyph layers.
+	glyph_layers = text_group.layers[:len(displayable_positions)]
+	font_sizes = sizecurves.sizes(interpolationFunc, fontStepParams, len(glyph_layers))
+	
+	with profiler.phase('font steps'):
+		for glyph_layer, font_size, (center_point, packet) in zip(glyph_layers, font_sizes, displayable_positions):
+			# glyph layers are made at their markup size, which is often already the step's
+			if font_size != packet.font_attributes.size:
+				pdb.gimp_text_layer_set_font_size(glyph_layer, font_size, Pixels)
+			center_layer_on_point(glyph_layer, center_point, glyph_extents(glyph_cache, layer_factory, glyph_layer, packet, font_size))
+	
+def split_text_layers(image, layers, fontSize, spaceOnPath, fontStepParams, interpolationFunc):
+	# All layers in one undo group, sharing glyph templates. The Split groups are only shown
+	# once every layer is split, so the image is redrawn once rather than per glyph.
+	glyph_cache = glyphcache.GlyphCache.load()
+	split_groups = []
+	pdb.gimp_image_undo_group_start(image)
+	try:
+		layer_factory = glyph_layer_factory(image, glyph_cache)
+		try:
+			for layer in layers:
+				split_text_layer(image, layer, fontSize, spaceOnPath, fontStepParams, interpolationFunc, layer_factory, glyph_cache, split_groups)
+		finally:
+			layer_factory.remove()
+			for text_group in split_groups:
+				pdb.gimp_item_set_visible(text_group, True)
 		
 	finally:
 		pdb.gimp_image_undo_group_end(image)
+		try:
+			glyph_cache.save()
+		except (IOError, OSError):
+			pass # the cache only saves time, a split never fails over it
 		
 	return
 	
+def layer_text_by_letter_with_font_step(image, layer, fontSize, spaceOnPath, fontStepParams, interpolationFunc):
+	split_text_layers(image, [layer], fontSize, spaceOnPath, fontStepParams, interpolationFunc)
+	
+def text_layers_to_split(layers):
+	# every text layer in layers and their groups, leaving out the glyphs of earlier splits
+	text_layers = []
+	for child_layer in layers:
+		if pdb.gimp_item_is_group(child_layer):
+			if not child_layer.name.startswith(SPLIT_GROUP_PREFIX):
+				text_layers.extend(text_layers_to_split(child_layer.layers))
+		elif pdb.gimp_item_is_text_layer(child_layer):
+			text_layers.append(child_layer)
+	return text_layers
+	
+@profiler.profiled
 def layer_text_by_letter(image, layer, fontSize, spaceOnPath):
 	font_step_params = font_size_interpolation_params(fontSize, fontSize, fontSize, fontSize)
 	layer_text_by_letter_with_font_step(image, layer, fontSize, spaceOnPath, font_step_params, font_size_functions.CONSTANT)
 	
+@profiler.profiled
 def layer_text_by_letter_with_font_size_interpolation(image, layer, interpolationFunc, startSize, endSize, lowerSizeLimit, upperSizeLimit, spaceOnPath):
 	font_step_params = font_size_interpolation_params(startSize, endSize, lowerSizeLimit, upperSizeLimit)
 	layer_text_by_letter_with_font_step(image, layer, startSize, spaceOnPath, font_step_params, interpolationFunc)
 	
+@profiler.profiled
+def layer_text_by_letter_with_font_size_interpolation_advanced(image, layer, interpolationFunc, startSize, endSize, lowerSizeLimit, upperSizeLimit, spaceOnPath, sizeControlPoints):
+	font_step_params = font_size_interpolation_params(startSize, endSize, lowerSizeLimit, upperSizeLimit, sizecurves.parse_control_points(sizeControlPoints))
+	layer_text_by_letter_with_font_step(image, layer, startSize, spaceOnPath, font_step_params, interpolationFunc)
+	
+@profiler.profiled
+def layer_text_by_letter_in_group(image, fontSize, everyTextLayer):
+	# Workaround for cant pickle layer groups...
+	layer = pdb.gimp_image_get_active_layer(image)
+	if everyTextLayer:
+		text_layers = text_layers_to_split(image.layers)
+	elif layer is not None and pdb.gimp_item_is_group(layer):
+		text_layers = text_layers_to_split(layer.layers)
+	else:
+		pdb.gimp_message("Layer '%s' must be a layer group, or split every text layer in the image." % (layer.name if layer is not None else ''))
+		return
+	if not text_layers:
+		pdb.gimp_message("Found no text layers to split.")
+		return
+	font_step_params = font_size_interpolation_params(fontSize, fontSize, fontSize, fontSize)
+	split_text_layers(image, text_layers, fontSize, False, font_step_params, font_size_functions.CONSTANT)
+	
 
 register (
     "layer_text_by_letter",         # Name registered in Procedure Browser
@@ -526,14 +601,7 @@ register (
 	( PF_IMAGE, "Image", "Image", None ),
 	( PF_DRAWABLE, "Layer", "Layer", None ),
     ( PF_RADIO, "interpolationFunc", "Interpolation Function:", font_size_functions.LINEAR,
-            (
-                 (font_size_functions.LINEAR, font_size_functions.LINEAR),
-                 (font_size_functions.SQUARE, font_size_functions.SQUARE),
-                 (font_size_functions.NEG_SQUARE, font_size_functions.NEG_SQUARE),
-                 (font_size_functions.SQUARE_NORM, font_size_functions.SQUARE_NORM),
-                 (font_size_functions.NEG_SQUARE_NORM, font_size_functions.NEG_SQUARE_NORM),
-                 (font_size_functions.EXP, font_size_functions.EXP)
-            ) ),
+            tuple((name, name) for name in sizecurves.names() if name not in (font_size_functions.CONSTANT, font_size_functions.CONTROL_POINTS)) ),
     ( PF_SPINNER, "startSize", "Start Font Size:", 30, (1, 3000, 1)),
     ( PF_SPINNER, "endSize", "End Font Size:", 30, (1, 3000, 1) ),
     ( PF_SPINNER, "lowerSizeLimit", "Lower Font Size Limit:", 5, (1, 3000, 1)),
@@ -545,4 +613,49 @@ register (
     menu = "<Image>/Filters/Typesetting"  # Menu Location
     )   # End register
 
+register (
+    "layer_text_by_letter_with_font_size_interpolation_advanced",         # Name registered in Procedure Browser
+    N_("Splits a text layer into multiple layers with 1 letter each, changing font size according to the given function for each glyph."), # Widget title
+    "Splits a text layer into multiple layers with 1 letter each, changing font size according to the given function, or control points, for each glyph.", # 
+    "LearnCodeWithH",         # Author
+    "LearnCodeWithH",         # Copyright Holder
+    "Jan 2019",            # Date
+    N_("Layer Text by Letter, Interpolate Font Size (Advanced)"), # Menu Entry
+    "",     # Image Type - No image required
+    [
+	( PF_IMAGE, "Image", "Image", None ),
+	( PF_DRAWABLE, "Layer", "Layer", None ),
+    ( PF_RADIO, "interpolationFunc", "Interpolation Function:", font_size_functions.LINEAR,
+            tuple((name, name) for name in sizecurves.names() if name != font_size_functions.CONSTANT) ),
+    ( PF_SPINNER, "startSize", "Start Font Size:", 30, (1, 3000, 1)),
+    ( PF_SPINNER, "endSize", "End Font Size:", 30, (1, 3000, 1) ),
+    ( PF_SPINNER, "lowerSizeLimit", "Lower Font Size Limit:", 5, (1, 3000, 1)),
+    ( PF_SPINNER, "upperSizeLimit", "Upper Font Size Limit:", 50, (1, 3000, 1) ),
+    ( PF_BOOL, "spaceOnPath", "Space on Active Path?:", False ),
+    ( PF_STRING, "sizeControlPoints", "Control Points (position:size, ...):", "" )
+    ],
+    [],
+    layer_text_by_letter_with_font_size_interpolation_advanced,   # Matches to name of function being defined
+    menu = "<Image>/Filters/Typesetting"  # Menu Location
+    )   # End register
+
+register (
+    "layer_text_by_letter_in_group",         # Name registered in Procedure Browser
+    N_("Splits every text layer in the active layer group, or the image, into multiple layers with 1 letter each."), # Widget title
+    "Splits every text layer in the active layer group, or the whole image, into multiple layers with 1 letter each, in one undo step.", # 
+    "LearnCodeWithH",         # Author
+    "LearnCodeWithH",         # Copyright Holder
+    "Jan 2019",            # Date
+    N_("Layer Text by Letter, Every Text Layer in Group"), # Menu Entry
+    "",     # Image Type - No image required
+    [
+	( PF_IMAGE, "Image", "Image", None ),
+    ( PF_SPINNER, "fontSize", "Font Size:", 30, (1, 3000, 1)),
+    ( PF_BOOL, "everyTextLayer", "Every Text Layer in Image?:", False )
+    ],
+    [],
+    layer_text_by_letter_in_group,   # Matches to name of function being defined
+    menu = "<Image>/Filters/Typesetting"  # Menu Location
+    )   # End register
+	
 main()
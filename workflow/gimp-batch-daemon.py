@@ -0,0 +1,35 @@
+#!/usr/bin/env python
+
+from gimpfu import *
+
+from gimp_workflow import daemon
+from gimp_workflow import profiler
+
+pdb = profiler.instrument(pdb) # times every PDB call when GIMP_WORKFLOW_PROFILE is set
+
+def run_worker_procedure(procedure, jobFile):
+	# the worker procedures are registered by the prep and export plug-ins
+	getattr(pdb, 'python_fu_' + procedure)(jobFile)
+
+@profiler.profiled
+def batch_daemon(socketPath, RecycleAfter):
+	daemon.BatchDaemon(run_worker_procedure, socketPath, RecycleAfter).serve()
+
+register (
+    "batch_daemon",         # Name registered in Procedure Browser
+    "Serves prep and export jobs over a local unix socket until recycled.", # Widget title
+    "Runs prep_images_to_xcf_worker and batch_xcf_export_jpg_worker jobs sent over a unix socket, streaming a result line per file, and returns after RecycleAfter images so the supervisor can start a fresh GIMP.", #
+    "LearnCodeWithH",         # Author
+    "LearnCodeWithH",         # Copyright Holder
+    "Jan 2019",            # Date
+    "", # Menu Entry - none, started headless by python -m gimp_workflow.daemon serve
+    "",     # Image Type - No image required
+    [
+    ( PF_STRING, "socketPath", "Socket Path (empty for the default):", "" ),
+    ( PF_INT, "RecycleAfter", "Images before returning (0 = never):", daemon.RECYCLE_AFTER )
+    ],
+    [],
+    batch_daemon   # Matches to name of function being defined
+    )   # End register
+
+main()
@@ -4,8 +4,28 @@ from gimpfu import *
 import os
 import re
 
+from gimp_workflow import archive
+from gimp_workflow import workers
+from gimp_workflow import workqueue
+from gimp_workflow import compositor
+from gimp_workflow import journal
+from gimp_workflow import passthrough
+from gimp_workflow import pipeline
+from gimp_workflow import profiler
+from gimp_workflow import profiles
+from gimp_workflow import quality
+from gimp_workflow import scanner
+from gimp_workflow.manifest import ExportManifest
+from gimp_workflow.scanner import ScanFilter
+from gimp_workflow.xcf import XcfUnsupported
+
+pdb = profiler.instrument(pdb) # times every PDB call when GIMP_WORKFLOW_PROFILE is set
+
+BACKEND_GIMP = 0
+BACKEND_COMPOSITOR = 1
+
 class JpegExportOptions:
-	def __init__(self, quality=0.95, smoothing=0.0, optimize=1, progressive=1,comment='',subsampling=2, baseline=0, restart_markers=0, dct_method=0):
+	def __init__(self, quality=0.95, smoothing=0.0, optimize=1, progressive=1,comment='',subsampling=2, baseline=0, restart_markers=0, dct_method=0, target_size_kb=0, min_similarity=0.0):
 		self.quality               = quality
 		self.smoothing          = smoothing
 		self.optimize             = optimize
@@ -15,6 +35,9 @@ class JpegExportOptions:
 		self.baseline             = baseline
 		self.restart_markers  = restart_markers
 		self.dct_method        = dct_method
+		# either one set makes quality the upper bound of a per page search
+		self.target_size_kb = target_size_kb
+		self.min_similarity = min_similarity
 		
 	def __repr__(self):
 		return self.__str__()
@@ -22,6 +45,23 @@ class JpegExportOptions:
 	def __str__(self):
 		return "JpegExpOpt: mode '%s', qual '%s', smooth '%s', optim '%s', prog '%s', comm '%s', subsmpl '%s', baseline '%s', restartmark '%s', dctmeth '%s" % (self.export_mode, self.quality, self.smoothing, self.optimize, self.progressive, self.comment, self.subsampling, self.baseline, self.restart_markers, self.dct_method)
 
+class BatchExportOptions:
+	def __init__(self, worker_count=1, incremental=False, backend=BACKEND_GIMP, pipeline_depth=0, memory_cap_mb=1024, passthrough=False, shared_queue=False, archive_name=''):
+		self.worker_count = worker_count
+		self.incremental = incremental
+		self.backend = backend
+		self.pipeline_depth = pipeline_depth
+		self.memory_cap_mb = memory_cap_mb
+		self.passthrough = passthrough
+		self.shared_queue = shared_queue
+		self.archive_name = archive_name # e.g. chapter.cbz inside the destination, empty for .jpg files
+
+	def __repr__(self):
+		return self.__str__()
+
+	def __str__(self):
+		return "BatchExpOpt: workers '%s', incremental '%s', backend '%s', pipeline '%s', memcap '%sMB', passthrough '%s', shared queue '%s', archive '%s'" % (self.worker_count, self.incremental, self.backend, self.pipeline_depth, self.memory_cap_mb, self.passthrough, self.shared_queue, self.archive_name)
+
 def disable_text_groups(image):
 	txt_group = re.compile('Text Group', re.IGNORECASE)
 	for layer in image.layers:
@@ -38,55 +78,582 @@ def disable_non_text_groups(image):
 			
 	return image
 
+# Output variants, each written to its own sub directory of the destination.
+EXPORT_VARIANTS = [
+	('full', None),
+	('cleaned', disable_text_groups),
+	('text', disable_non_text_groups),
+]
+
+def visibility_snapshot(image):
+	snapshot = []
+	def snapshot_layers(layers):
+		for layer in layers:
+			snapshot.append((layer, pdb.gimp_item_get_visible(layer)))
+			if pdb.gimp_item_is_group(layer):
+				snapshot_layers(layer.layers)
+	snapshot_layers(image.layers)
+	return snapshot
+
+def restore_visibility(snapshot):
+	for layer, visible in snapshot:
+		if pdb.gimp_item_get_visible(layer) != visible:
+			pdb.gimp_item_set_visible(layer, visible)
+
 def generate_new_filename_map(fileList):
-	oldFileList = []
-	newFileList = []
-	xform = re.compile('\.(xcf)', re.IGNORECASE)
-	# Find all of the xcf files in the list & make jpg file names
+	# Dictionary - old & new file names of the xcf files in the list
+	fileDict = {}
 	for fname in fileList:
-		fnameLow = fname.lower()
-		if fnameLow.endswith('.xcf'):
-			oldFileList.append(fname)
-			newFileList.append(xform.sub('.jpg',fname))
-	# Dictionary - old & new file names
-	fileDict = dict(zip(oldFileList, newFileList))
+		if os.path.splitext(fname)[1].lower() == '.xcf':
+			fileDict[fname] = scanner.replace_extension(fname, '.jpg')
 	return fileDict
+
+def scan_new_filename_map(srcPath, scan_filter=None):
+	# Names are relative to srcPath, so sub directories come out mirrored under dstPath
+	fileList = [os.path.join(rel_dir, fname) for rel_dir, fname, names in scanner.scan_files(srcPath, ('.xcf',), scan_filter)]
+	return generate_new_filename_map(fileList)
 	
+def delete_batch_images(image_ids):
+	# Closes whatever a failed page left open, image_ids were open before the batch.
+	for image in gimp.image_list():
+		if image.ID not in image_ids:
+			try:
+				pdb.gimp_image_delete(image)
+			except RuntimeError:
+				pass # opened with a display meanwhile, that's the user's
+
+def visible_drawable(image):
+	# A single plain full canvas layer is already what the projection shows, save it as is.
+	visible_layers = [layer for layer in image.layers if layer.visible]
+	if len(visible_layers) == 1:
+		layer = visible_layers[0]
+		if not pdb.gimp_item_is_group(layer) and layer.mask is None and layer.opacity == 100.0 \
+			and layer.mode == NORMAL_MODE and layer.offsets == (0, 0) \
+			and layer.width == image.width and layer.height == image.height:
+			return layer, False
+	# Otherwise copy the projection GIMP already keeps instead of merging the layer tree.
+	projection = pdb.gimp_layer_new_from_visible(image, image, "Export Projection")
+	pdb.gimp_image_insert_layer(image, projection, None, 0)
+	return projection, True
+
+def visible_pixels(image):
+	# Returns (pixel bytes, PIL mode, (width, height)) of what save_to_jpeg would have written.
+	theDrawable, temporary = visible_drawable(image)
+	try:
+		width = theDrawable.width
+		height = theDrawable.height
+		region = theDrawable.get_pixel_rgn(0, 0, width, height, False, False)
+		pixels = region[0:width, 0:height]
+		mode = { 1: 'L', 2: 'LA', 3: 'RGB', 4: 'RGBA' }[theDrawable.bpp]
+	finally:
+		if temporary:
+			pdb.gimp_image_remove_layer(image, theDrawable)
+	return pixels, mode, (width, height)
+
+def save_searched_jpeg(image_to_save, fullNewFile, export_opts):
+	# GIMP's exporter only writes files, the quality search encodes candidates in memory with PIL.
+	if not pipeline.available():
+		raise ValueError("Target size and minimum similarity need PIL (Pillow) installed for GIMP's python.")
+	pixels, mode, size = visible_pixels(image_to_save)
+	quality.save_searched_jpeg(pipeline.page_image(pixels, mode, size), fullNewFile, compositor.pil_save_options(export_opts), export_opts)
+
 def save_to_jpeg(image_to_save, fullNewFile, export_opts):
-	CLIP_TO_IMAGE = 1
-	theDrawable = pdb.gimp_image_merge_visible_layers(image_to_save, CLIP_TO_IMAGE)
-	pdb.file_jpeg_save(image_to_save, theDrawable, fullNewFile, fullNewFile, export_opts.quality, export_opts.smoothing, export_opts.optimize, export_opts.progressive, export_opts.comment, export_opts.subsampling, export_opts.baseline, export_opts.restart_markers, export_opts.dct_method)
+	# Leaves image_to_save as loaded, so it can be reused for other outputs.
+	if quality.search_enabled(export_opts):
+		save_searched_jpeg(image_to_save, fullNewFile, export_opts)
+		return
+	theDrawable, temporary = visible_drawable(image_to_save)
+	try:
+		def write(path):
+			pdb.file_jpeg_save(image_to_save, theDrawable, path, path, export_opts.quality, export_opts.smoothing, export_opts.optimize, export_opts.progressive, export_opts.comment, export_opts.subsampling, export_opts.baseline, export_opts.restart_markers, export_opts.dct_method)
+		journal.write_atomically(fullNewFile, write)
+	finally:
+		if temporary:
+			pdb.gimp_image_remove_layer(image_to_save, theDrawable)
 	
 	
-def export_xcf_in_directory_to_jpg(srcPath, dstPath, exportCleaned, exportText, export_opts):
-    open_images, image_ids = pdb.gimp_image_list()
-    if open_images > 0:
-        pdb.gimp_message ("Close open Images & Rerun")
-    else:
+def export_variant_name(exportCleaned, exportText):
+	if exportText:
+		return 'text'
+	if exportCleaned:
+		return 'cleaned'
+	return 'full'
+
+def export_xcf_file(fullOldFile, fullNewFile, exportCleaned, exportText, export_opts, batch_opts=None):
+	if batch_opts is None:
+		batch_opts = BatchExportOptions()
+	if batch_opts.passthrough:
+		source = passthrough.passthrough_source(fullOldFile, export_variant_name(exportCleaned, exportText))
+		if source is not None:
+			with profiler.phase('passthrough'):
+				passthrough.copy_source(source, fullNewFile)
+			return
+	if batch_opts.backend == BACKEND_COMPOSITOR:
+		try:
+			with profiler.phase('composite'):
+				compositor.export_xcf_file(fullOldFile, fullNewFile, exportCleaned, exportText, export_opts)
+			return
+		except XcfUnsupported:
+			pass # something the compositor can't reproduce, let GIMP do this page
+	with profiler.phase('load'):
+		theImage = pdb.gimp_xcf_load(0, fullOldFile, fullOldFile)
+	try:
+		image_to_save = theImage
+		if exportCleaned:
+			image_to_save = disable_text_groups(theImage)
+		if exportText:
+			image_to_save = disable_non_text_groups(theImage)
+
+		with profiler.phase('save'):
+			save_to_jpeg(image_to_save, fullNewFile, export_opts)
+	finally:
+		if theImage is not None:
+			pdb.gimp_image_delete(theImage)
+
+def export_xcf_file_variants(fullOldFile, outputs, export_opts, batch_opts=None):
+	# outputs is a list of (variant name, jpg path), all made from a single load.
+	if batch_opts is None:
+		batch_opts = BatchExportOptions()
+	if batch_opts.passthrough:
+		remaining = []
+		for variant, fullNewFile in outputs:
+			source = passthrough.passthrough_source(fullOldFile, variant)
+			if source is not None:
+				passthrough.copy_source(source, fullNewFile)
+			else:
+				remaining.append((variant, fullNewFile))
+		outputs = remaining
+		if not outputs:
+			return
+	if batch_opts.backend == BACKEND_COMPOSITOR:
+		try:
+			compositor.export_xcf_file_variants(fullOldFile, outputs, export_opts)
+			return
+		except XcfUnsupported:
+			pass # something the compositor can't reproduce, let GIMP do this page
+	visibility_by_name = dict(EXPORT_VARIANTS)
+	with profiler.phase('load'):
+		theImage = pdb.gimp_xcf_load(0, fullOldFile, fullOldFile)
+	try:
+		snapshot = visibility_snapshot(theImage)
+		for variant, fullNewFile in outputs:
+			restore_visibility(snapshot)
+			set_visibility = visibility_by_name[variant]
+			if set_visibility is not None:
+				set_visibility(theImage)
+			with profiler.phase('save'):
+				save_to_jpeg(theImage, fullNewFile, export_opts)
+	finally:
+		if theImage is not None:
+			pdb.gimp_image_delete(theImage)
+
+def flatten_xcf_file(fullOldFile, data, exportCleaned, exportText, backend=BACKEND_GIMP):
+	# Returns (pixel bytes, PIL mode, (width, height)) of what save_to_jpeg would have written.
+	if backend == BACKEND_COMPOSITOR:
+		try:
+			with profiler.phase('composite'):
+				projection = compositor.composite_xcf(fullOldFile, exportCleaned, exportText, data)
+			return projection.tobytes(), 'RGBA', (projection.shape[1], projection.shape[0])
+		except XcfUnsupported:
+			pass # something the compositor can't reproduce, let GIMP do this page
+	with profiler.phase('load'):
+		theImage = pdb.gimp_xcf_load(0, fullOldFile, fullOldFile)
+	try:
+		if exportCleaned:
+			disable_text_groups(theImage)
+		if exportText:
+			disable_non_text_groups(theImage)
+		with profiler.phase('flatten'):
+			return visible_pixels(theImage)
+	finally:
+		pdb.gimp_image_delete(theImage)
+
+def profile_outputs(dstPath, newFile, output_profiles):
+	# dstPath/<profile name>/<page>.<profile extension>
+	base = os.path.splitext(newFile)[0]
+	return dict((profile.name, os.path.join(dstPath, profile.name, base + profile.extension)) for profile in output_profiles)
+
+def export_xcf_file_profiles(fullOldFile, outputs, exportCleaned, exportText, output_profiles, batch_opts=None):
+	# One load and flatten per page, however many files the profiles make of it.
+	if batch_opts is None:
+		batch_opts = BatchExportOptions()
+	pixels, mode, size = flatten_xcf_file(fullOldFile, None, exportCleaned, exportText, batch_opts.backend)
+	with profiler.phase('render profiles'):
+		profiles.render_profiles(pipeline.page_image(pixels, mode, size), output_profiles, outputs)
+
+def export_file_items_pipelined(srcPath, dstPath, items, exportCleaned, exportText, batch_opts, save_options, on_result, page_archive=None):
+	# Reads ahead on one thread and encodes on others, GIMP only ever loads and flattens.
+	# With page_archive, pages go into it under their .jpg names and dstPath is unused.
+	budget = pipeline.MemoryBudget(batch_opts.memory_cap_mb * 1024 * 1024)
+	encoder = pipeline.EncodePool(workers.default_worker_count(), batch_opts.pipeline_depth, budget, save_options, page_archive)
+	def encoded(oldFile, ok, error=''):
+		on_result(workers.item_result(oldFile, ok, error))
+	try:
+		# GIMP loads the .xcf from disk itself, holding the bytes would only sit outside the budget
+		keep_data = batch_opts.backend == BACKEND_COMPOSITOR
+		prefetch = pipeline.Prefetcher([os.path.join(srcPath, oldFile) for oldFile, newFile in items], batch_opts.pipeline_depth, keep_data)
+		for index, (fullOldFile, data, error) in enumerate(prefetch):
+			oldFile, newFile = items[index]
+			if error is not None:
+				encoder.report(encoded, oldFile, False, str(error))
+				continue
+			if batch_opts.passthrough:
+				source = passthrough.passthrough_source(fullOldFile, export_variant_name(exportCleaned, exportText), data)
+				if source is not None:
+					try:
+						if page_archive is not None:
+							page_archive.add_file(newFile, source)
+						else:
+							passthrough.copy_source(source, os.path.join(dstPath, newFile))
+						encoder.report(encoded, oldFile, True)
+					except (IOError, OSError) as e:
+						encoder.report(encoded, oldFile, False, str(e))
+					continue
+			try:
+				pixels, mode, size = flatten_xcf_file(fullOldFile, data, exportCleaned, exportText, batch_opts.backend)
+			except Exception as e:
+				encoder.report(encoded, oldFile, False, str(e))
+				continue
+			data = None # let the file bytes go before the next page arrives
+			if page_archive is not None:
+				encoder.submit(oldFile, pixels, mode, size, newFile, encoded)
+			else:
+				encoder.submit(oldFile, pixels, mode, size, os.path.join(dstPath, newFile), encoded)
+	finally:
+		encoder.close()
+
+def pipeline_save_options(export_opts, batch_opts):
+	# The pipeline encodes with PIL, so only settings PIL writes the same way can use it.
+	# Quality search runs its own encode threads per page, so it skips the pipeline.
+	if batch_opts.pipeline_depth <= 0 or not pipeline.available() or quality.search_enabled(export_opts):
+		return None
+	try:
+		return compositor.pil_save_options(export_opts)
+	except XcfUnsupported:
+		return None
+
+def encode_page(pixels, mode, size, save_options, export_opts):
+	if quality.search_enabled(export_opts):
+		return quality.searched_jpeg(pipeline.page_image(pixels, mode, size), save_options, export_opts)
+	return pipeline.jpeg_bytes(pixels, mode, size, save_options)
+
+def export_archive_items(srcPath, items, exportCleaned, exportText, export_opts, batch_opts, page_archive, on_result):
+	# Pages are encoded in memory and go straight into page_archive under their .jpg names.
+	newFiles = dict(items)
+	def archive_result(result):
+		if not result['ok']:
+			page_archive.skip(newFiles[result['item']])
+		on_result(result)
+	save_options = pipeline_save_options(export_opts, batch_opts)
+	if save_options is not None:
+		export_file_items_pipelined(srcPath, None, items, exportCleaned, exportText, batch_opts, save_options, archive_result, page_archive)
+		return
+	save_options = compositor.pil_save_options(export_opts)
+	for oldFile, newFile in items:
+		fullOldFile = os.path.join(srcPath, oldFile)
+		try:
+			source = None
+			if batch_opts.passthrough:
+				source = passthrough.passthrough_source(fullOldFile, export_variant_name(exportCleaned, exportText))
+			if source is not None:
+				page_archive.add_file(newFile, source)
+			else:
+				pixels, mode, size = flatten_xcf_file(fullOldFile, None, exportCleaned, exportText, batch_opts.backend)
+				with profiler.phase('encode'):
+					data = encode_page(pixels, mode, size, save_options, export_opts)
+				page_archive.add(newFile, data)
+			archive_result(workers.item_result(oldFile, True))
+		except Exception as e:
+			archive_result(workers.item_result(oldFile, False, str(e)))
+
+def export_archive(srcPath, dstPath, items, exportCleaned, exportText, export_opts, batch_opts, on_result):
+	# One process writes the whole archive, a zip can't take pages from several at once.
+	# Pages are exported in archive order, so hardly any wait in memory for the one before.
+	items = sorted(items, key=lambda item: archive.natural_key(item[1]))
+	page_archive = archive.PageArchive(os.path.join(dstPath, batch_opts.archive_name), [newFile for oldFile, newFile in items])
+	failed = []
+	def archive_result(result):
+		if not result['ok']:
+			failed.append(result['item'])
+		on_result(result)
+	try:
+		export_archive_items(srcPath, items, exportCleaned, exportText, export_opts, batch_opts, page_archive, archive_result)
+	except:
+		page_archive.abort()
+		raise
+	if failed:
+		# a chapter with pages missing must not appear under the archive's name
+		page_archive.abort()
+		return
+	page_archive.close()
+
+def variant_outputs(dstPath, newFile, variants):
+	return [(variant, os.path.join(dstPath, variant, newFile)) for variant in variants]
+
+def export_file_items(srcPath, dstPath, items, exportCleaned, exportText, export_opts, batch_opts, on_result, variants=None, output_profiles=None):
+	if batch_opts.archive_name:
+		export_archive(srcPath, dstPath, items, exportCleaned, exportText, export_opts, batch_opts, on_result)
+		return
+	save_options = pipeline_save_options(export_opts, batch_opts)
+	if save_options is not None and not variants and not output_profiles:
+		export_file_items_pipelined(srcPath, dstPath, items, exportCleaned, exportText, batch_opts, save_options, on_result)
+		return
+	# Keep going past a bad file so the summary covers the whole batch.
+	for oldFile, newFile in items:
+		# os.path.join inserts the right kind of file separator
+		fullNewFile = os.path.join(dstPath, newFile)
+		fullOldFile = os.path.join(srcPath, oldFile)
+		try:
+			if variants:
+				export_xcf_file_variants(fullOldFile, variant_outputs(dstPath, newFile, variants), export_opts, batch_opts)
+			elif output_profiles:
+				export_xcf_file_profiles(fullOldFile, profile_outputs(dstPath, newFile, output_profiles), exportCleaned, exportText, output_profiles, batch_opts)
+			else:
+				export_xcf_file(fullOldFile, fullNewFile, exportCleaned, exportText, export_opts, batch_opts)
+			on_result(workers.item_result(oldFile, True))
+		except Exception as e:
+			on_result(workers.item_result(oldFile, False, str(e)))
+
+def export_xcf_in_parallel(srcPath, dstPath, fileDict, exportCleaned, exportText, export_opts, batch_opts, variants=None, journalFile=None, profileFile=None):
+	job = {
+		'srcPath': srcPath,
+		'dstPath': dstPath,
+		'exportCleaned': exportCleaned,
+		'exportText': exportText,
+		'export_opts': vars(export_opts),
+		'batch_opts': vars(batch_opts),
+		'variants': variants,
+		'journal': journalFile,
+		'profileFile': profileFile, # workers load the profiles themselves, None when not exporting profiles
+	}
+	items = sorted(fileDict.items())
+	pool = workers.WorkerPool('batch_xcf_export_jpg_worker', batch_opts.worker_count)
+	try:
+		results = pool.run(job, items)
+	except OSError as e:
+		pdb.gimp_message("Could not start '%s' (%s), exporting in this process." % (pool.gimp_executable, e))
+		results = []
+		output_profiles = None
+		if profileFile is not None:
+			output_profiles = profiles.load_profiles(profileFile)
+		export_file_items(srcPath, dstPath, items, exportCleaned, exportText, export_opts, batch_opts, journal.recording(results.append, journalFile, srcPath), variants, output_profiles)
+	pdb.gimp_message(workers.summarize(results))
+	return results
+
+def queue_file_items(srcPath, dstPath, items, exportCleaned, exportText, export_opts, batch_opts, queueDir, on_result=None):
+	def export_item(oldFile, newFile):
+		export_xcf_file(os.path.join(srcPath, oldFile), os.path.join(dstPath, newFile), exportCleaned, exportText, export_opts, batch_opts)
+	workqueue.WorkQueue(queueDir).drain(items, export_item, on_result)
+
+def export_xcf_in_shared_queue(srcPath, dstPath, fileDict, exportCleaned, exportText, export_opts, batch_opts, params):
+	# Other GIMPs, here or on other hosts, may be draining the same directory, each page is claimed once.
+	queueDir = os.path.join(dstPath, workqueue.QUEUE_DIR_NAME)
+	queue = workqueue.WorkQueue(queueDir, params)
+	items = sorted(fileDict.items())
+	if batch_opts.worker_count != 1 and len(items) > 1:
+		job = {
+			'srcPath': srcPath,
+			'dstPath': dstPath,
+			'exportCleaned': exportCleaned,
+			'exportText': exportText,
+			'export_opts': vars(export_opts),
+			'batch_opts': vars(batch_opts),
+			'queue': queueDir,
+		}
+		pool = workers.WorkerPool('batch_xcf_export_jpg_worker', batch_opts.worker_count)
+		try:
+			pool.run(job, items, shard=False)
+		except OSError as e:
+			pdb.gimp_message("Could not start '%s' (%s), exporting in this process." % (pool.gimp_executable, e))
+			queue_file_items(srcPath, dstPath, items, exportCleaned, exportText, export_opts, batch_opts, queueDir)
+	else:
+		queue_file_items(srcPath, dstPath, items, exportCleaned, exportText, export_opts, batch_opts, queueDir)
+	results = queue.results(items)
+	pdb.gimp_message(workers.summarize(results))
+	return results
+
+def export_options_signature(exportCleaned, exportText, export_opts):
+	signature = dict(vars(export_opts))
+	signature['exportCleaned'] = bool(exportCleaned)
+	signature['exportText'] = bool(exportText)
+	return signature
+
+def stale_file_map(srcPath, dstPath, fileDict, manifest):
+	staleDict = {}
+	for oldFile, newFile in fileDict.items():
+		if not manifest.is_up_to_date(oldFile, os.path.join(srcPath, oldFile), os.path.join(dstPath, newFile)):
+			staleDict[oldFile] = newFile
+	return staleDict
+
+def export_xcf_in_directory_to_archive(srcPath, dstPath, fileDict, exportCleaned, exportText, export_opts, batch_opts):
+	if not pipeline.available():
+		pdb.gimp_message ("Archive export needs PIL (Pillow) installed for GIMP's python.")
+		return
+	if batch_opts.incremental or batch_opts.shared_queue:
+		pdb.gimp_message ("An archive is always written whole, turn off Incremental and Shared Queue.")
+		return
+	try:
+		compositor.pil_save_options(export_opts)
+	except XcfUnsupported as e:
+		pdb.gimp_message ("Archive pages are encoded with PIL: %s" % e)
+		return
+	if not os.path.isdir(dstPath):
+		os.makedirs(dstPath)
+	# Runs in this GIMP whatever the worker count, see export_archive
+	results = []
+	export_file_items(srcPath, dstPath, fileDict.items(), exportCleaned, exportText, export_opts, batch_opts, results.append)
+	failed = sorted(result['item'] for result in results if not result['ok'])
+	if failed:
+		pdb.gimp_message("%s\n%s wasn't written, fix these pages and rerun: %s" % (workers.summarize(results), batch_opts.archive_name, ', '.join(failed)))
+		return
+	pdb.gimp_message(workers.summarize(results))
+
+def check_quality_search(export_opts):
+	# The search encodes every page with PIL, so say once what's missing instead of failing every page.
+	if not quality.search_enabled(export_opts):
+		return True
+	if not pipeline.available():
+		pdb.gimp_message ("Target size and minimum similarity need PIL (Pillow) installed for GIMP's python.")
+		return False
+	if export_opts.min_similarity > 0.0 and not quality.similarity_available():
+		pdb.gimp_message ("A minimum similarity needs numpy installed for GIMP's python, use a target size instead.")
+		return False
+	try:
+		compositor.pil_save_options(export_opts)
+	except XcfUnsupported as e:
+		pdb.gimp_message ("Quality search pages are encoded with PIL: %s" % e)
+		return False
+	return True
+
+def export_xcf_in_directory_to_jpg(srcPath, dstPath, exportCleaned, exportText, export_opts, batch_opts=None, scan_filter=None):
+	if batch_opts is None:
+		batch_opts = BatchExportOptions()
+	if scan_filter is None:
+		scan_filter = ScanFilter()
+	if not check_quality_search(export_opts):
+		return
+	# Images already open are left alone, only ones the batch itself opened get closed
+	open_images, image_ids = pdb.gimp_image_list()
+	try:
 		# Ensure 2.7 byte strings are unicode
 		srcPath = unicode(srcPath, "utf-8")
-		# list all of the files in source & target directories
-		allFileList = os.listdir(srcPath)
-		fileDict = generate_new_filename_map(allFileList)
-		# Loop on jpegs, open each, prep & save as xcf
-		for oldFile in fileDict.keys():
-			# os.path.join inserts the right kind of file separator
-			
-			fullNewFile = os.path.join(dstPath, fileDict[oldFile])
+		fileDict = scan_new_filename_map(srcPath, scan_filter)
+		if batch_opts.archive_name:
+			export_xcf_in_directory_to_archive(srcPath, dstPath, fileDict, exportCleaned, exportText, export_opts, batch_opts)
+			return
+		scanner.make_output_dirs(dstPath, fileDict.values())
+		manifest = None
+		if batch_opts.incremental:
+			manifest = ExportManifest.load(dstPath, export_options_signature(exportCleaned, exportText, export_opts))
+			fileDict = stale_file_map(srcPath, dstPath, fileDict, manifest)
+		params = export_options_signature(exportCleaned, exportText, export_opts)
+		params.update({ 'backend': batch_opts.backend, 'passthrough': batch_opts.passthrough, 'scan': vars(scan_filter) })
+		results = []
+		def record_result(result):
+			results.append(result)
+			if manifest is not None and result['ok']:
+				manifest.record(result['item'], os.path.join(srcPath, result['item']), fileDict[result['item']])
+		def finish(results, batch_journal):
+			# Only a batch that got through every page forgets its journal
+			if all(result['ok'] for result in results):
+				batch_journal.finish()
+		try:
+			if batch_opts.shared_queue:
+				# the queue's done markers already make the run resumable
+				for result in export_xcf_in_shared_queue(srcPath, dstPath, fileDict, exportCleaned, exportText, export_opts, batch_opts, params):
+					record_result(result)
+				return
+			# Picks up after a crashed or killed run with the same settings
+			params['srcPath'] = srcPath
+			batch_journal = journal.BatchJournal.load(dstPath, journal.EXPORT_JOURNAL_NAME, params)
+			fileDict = dict(batch_journal.pending(fileDict.items(), srcPath))
+			if batch_opts.worker_count != 1 and len(fileDict) > 1:
+				for result in export_xcf_in_parallel(srcPath, dstPath, fileDict, exportCleaned, exportText, export_opts, batch_opts, None, batch_journal.path):
+					record_result(result)
+			else:
+				# pipelined when the settings allow it, else one page at a time, past any bad page
+				export_file_items(srcPath, dstPath, sorted(fileDict.items()), exportCleaned, exportText, export_opts, batch_opts, journal.recording(record_result, batch_journal.path, srcPath))
+				pdb.gimp_message(workers.summarize(results))
+			finish(results, batch_journal)
+		finally:
+			# Save whatever finished, an interrupted run still skips those pages next time.
+			if manifest is not None:
+				manifest.save()
+	finally:
+		delete_batch_images(image_ids)
+
+def export_xcf_in_directory_to_jpg_variants(srcPath, dstPath, variants, export_opts, batch_opts=None, scan_filter=None):
+	if batch_opts is None:
+		batch_opts = BatchExportOptions()
+	if not variants:
+		pdb.gimp_message ("Choose at least one variant to export.")
+		return
+	if not check_quality_search(export_opts):
+		return
+	# Images already open are left alone, only ones the batch itself opened get closed
+	open_images, image_ids = pdb.gimp_image_list()
+	try:
+		# Ensure 2.7 byte strings are unicode
+		srcPath = unicode(srcPath, "utf-8")
+		fileDict = scan_new_filename_map(srcPath, scan_filter)
+		for variant in variants:
+			scanner.make_output_dirs(os.path.join(dstPath, variant), [''] + list(fileDict.values()))
+		if batch_opts.worker_count != 1 and len(fileDict) > 1:
+			export_xcf_in_parallel(srcPath, dstPath, fileDict, False, False, export_opts, batch_opts, variants)
+			return
+		for oldFile in sorted(fileDict.keys()):
 			fullOldFile = os.path.join(srcPath, oldFile)
-			theImage = pdb.gimp_xcf_load(0, fullOldFile, fullOldFile)
-			try:
-				image_to_save = theImage
-				if exportCleaned:
-					image_to_save = disable_text_groups(theImage)
-				if exportText:
-					image_to_save = disable_non_text_groups(theImage)
-					
-				save_to_jpeg(image_to_save, fullNewFile, export_opts)
-			finally:
-				if theImage is not None:
-					pdb.gimp_image_delete(theImage)
-						
+			export_xcf_file_variants(fullOldFile, variant_outputs(dstPath, fileDict[oldFile], variants), export_opts, batch_opts)
+	finally:
+		delete_batch_images(image_ids)
+
+def export_xcf_in_directory_to_profiles(srcPath, dstPath, exportCleaned, exportText, profileFile, batch_opts=None, scan_filter=None):
+	if batch_opts is None:
+		batch_opts = BatchExportOptions()
+	if not profiles.available():
+		pdb.gimp_message ("Output profiles need PIL (Pillow) installed for GIMP's python.")
+		return
+	# read once, and fail before touching any file on a bad profile
+	output_profiles = profiles.load_profiles(profileFile)
+	export_opts = JpegExportOptions() # unused, each profile has its own encoder options
+	# Images already open are left alone, only ones the batch itself opened get closed
+	open_images, image_ids = pdb.gimp_image_list()
+	try:
+		# Ensure 2.7 byte strings are unicode
+		srcPath = unicode(srcPath, "utf-8")
+		fileDict = scan_new_filename_map(srcPath, scan_filter)
+		for profile in output_profiles:
+			scanner.make_output_dirs(os.path.join(dstPath, profile.name), [''] + list(fileDict.values()))
+		if batch_opts.worker_count != 1 and len(fileDict) > 1:
+			export_xcf_in_parallel(srcPath, dstPath, fileDict, exportCleaned, exportText, export_opts, batch_opts, None, None, profileFile)
+			return
+		results = []
+		export_file_items(srcPath, dstPath, sorted(fileDict.items()), exportCleaned, exportText, export_opts, batch_opts, results.append, None, output_profiles)
+		pdb.gimp_message(workers.summarize(results))
+	finally:
+		delete_batch_images(image_ids)
+
+@profiler.profiled
+def batch_xcf_export_jpg_worker(jobFile):
+	job = workers.read_job(jobFile)
+	export_opts = JpegExportOptions(**job['export_opts'])
+	batch_opts = BatchExportOptions(**job['batch_opts'])
+	def record_result(result):
+		workers.append_result(job['results'], result)
+	# the batch daemon reuses one GIMP for many jobs, don't let failed pages pile up in it
+	open_images, image_ids = pdb.gimp_image_list()
+	try:
+		if job.get('queue'):
+			queue_file_items(job['srcPath'], job['dstPath'], job['items'], job['exportCleaned'], job['exportText'], export_opts, batch_opts, job['queue'], record_result)
+		else:
+			output_profiles = None
+			if job.get('profileFile') is not None:
+				output_profiles = profiles.load_profiles(job['profileFile'])
+			export_file_items(job['srcPath'], job['dstPath'], job['items'], job['exportCleaned'], job['exportText'], export_opts, batch_opts, journal.recording(record_result, job.get('journal'), job['srcPath']), job.get('variants'), output_profiles)
+	finally:
+		delete_batch_images(image_ids)
+
+@profiler.profiled
 def batch_xcf_export_jpg(srcPath, dstPath, exportCleaned, exportText, Quality, Smoothing, Optimize, Progressive, Comment, Subsampling, DctMethod):
 	export_opts = JpegExportOptions( \
 	quality = Quality / 100.0, \
@@ -99,6 +666,40 @@ def batch_xcf_export_jpg(srcPath, dstPath, exportCleaned, exportText, Quality, S
 	)
 	export_xcf_in_directory_to_jpg(srcPath, dstPath, exportCleaned, exportText, export_opts)
 
+@profiler.profiled
+def batch_xcf_export_jpg_advanced(srcPath, dstPath, exportCleaned, exportText, Quality, Smoothing, Optimize, Progressive, Comment, Subsampling, DctMethod, Workers, Incremental, Backend, PipelineDepth, MemoryCapMb, Passthrough, Recursive, Include, Exclude, SharedQueue, TargetSizeKb, MinSimilarity, ArchiveName):
+	export_opts = JpegExportOptions( \
+	quality = Quality / 100.0, \
+	smoothing = Smoothing / 100.0, \
+	optimize = Optimize, \
+	 progressive = Progressive, \
+	comment = Comment, \
+	subsampling = Subsampling, \
+	dct_method = DctMethod, \
+	target_size_kb = TargetSizeKb, \
+	min_similarity = MinSimilarity \
+	)
+	batch_opts = BatchExportOptions(worker_count = Workers, incremental = Incremental, backend = Backend, pipeline_depth = PipelineDepth, memory_cap_mb = MemoryCapMb, passthrough = Passthrough, shared_queue = SharedQueue, archive_name = ArchiveName)
+	export_xcf_in_directory_to_jpg(srcPath, dstPath, exportCleaned, exportText, export_opts, batch_opts, ScanFilter(Recursive, Include, Exclude))
+
+@profiler.profiled
+def batch_xcf_export_jpg_variants(srcPath, dstPath, exportFull, exportCleaned, exportText, Quality, Smoothing, Optimize, Progressive, Comment, Subsampling, DctMethod, Workers, Backend, Passthrough, Recursive, Include, Exclude, TargetSizeKb, MinSimilarity):
+	export_opts = JpegExportOptions( \
+	quality = Quality / 100.0, \
+	smoothing = Smoothing / 100.0, \
+	optimize = Optimize, \
+	 progressive = Progressive, \
+	comment = Comment, \
+	subsampling = Subsampling, \
+	dct_method = DctMethod, \
+	target_size_kb = TargetSizeKb, \
+	min_similarity = MinSimilarity \
+	)
+	batch_opts = BatchExportOptions(worker_count = Workers, backend = Backend, passthrough = Passthrough)
+	chosen = { 'full': exportFull, 'cleaned': exportCleaned, 'text': exportText }
+	variants = [name for name, set_visibility in EXPORT_VARIANTS if chosen[name]]
+	export_xcf_in_directory_to_jpg_variants(srcPath, dstPath, variants, export_opts, batch_opts, ScanFilter(Recursive, Include, Exclude))
+
 register (
     "batch_xcf_export_jpg",         # Name registered in Procedure Browser
     N_("Export all xcf in a source directory to jpg into a destination dir."), # Widget title
@@ -126,5 +727,131 @@ register (
     batch_xcf_export_jpg,   # Matches to name of function being defined
     menu = "<Image>/Image/Batch Image Prep"  # Menu Location
     )   # End register
+
+register (
+    "batch_xcf_export_jpg_advanced",         # Name registered in Procedure Browser
+    N_("Export all xcf in a source directory to jpg into a destination dir."), # Widget title
+    "Export all xcf in a source directory to jpg into a destination dir, with workers, incremental, backend, pipeline, passthrough, scan filter, shared queue, quality search and archive options.", #
+    "LearnCodeWithH",         # Author
+    "LearnCodeWithH",         # Copyright Holder
+    "Jan 2019",            # Date
+    N_("Export all .xcf to .jpg (Advanced)"), # Menu Entry
+    "",     # Image Type - No image required
+    [
+    ( PF_DIRNAME, "srcPath", "Source .xcf Directory:", "/" ),
+    ( PF_DIRNAME, "dstPath", "Destination .jpg Directory:", "/" ),
+    ( PF_BOOL, "exportCleaned", "Export Cleaned? (Disabling any layer groups with 'Text Group' in them before export):", False ),
+    ( PF_BOOL, "exportText", "Export Text Only? (Disabling any layers without 'Text Group' in them before export):", False ),
+	
+	( PF_SLIDER, "Quality", "Quality:", 95, (0, 100, 1) ),
+	( PF_SLIDER, "Smoothing", "Smoothing:", 0, (0, 100, 1) ),
+	( PF_TOGGLE, "Optimize", "Optimize?:", 1 ),
+	( PF_TOGGLE, "Progressive", "Progressive?:", 1 ),
+	( PF_TEXT, "Comment", "Comment:", "Created with GIMP." ),
+	( PF_OPTION, "Subsampling", "Subsampling:", 2, ("4:2:0 (chroma quartered)", "4:2:2 Horizontal (chroma halved)", "4:4:4 (best quality)", "4:2:2 Vertical (chroma halved)") ),
+	( PF_OPTION, "DctMethod", "Dct Method:", 0, ("Integer", "Fixed", "Float") ),
+	( PF_SPINNER, "Workers", "Worker Processes (0 = one per CPU, 1 = this GIMP only):", 0, (0, 64, 1) ),
+	( PF_BOOL, "Incremental", "Incremental? (Skip .xcf files whose .jpg is up to date with these settings):", False ),
+	( PF_OPTION, "Backend", "Backend:", 0, ("GIMP", "NumPy compositor (GIMP for pages it can't composite)") ),
+	( PF_SPINNER, "PipelineDepth", "Pipeline Depth (pages read and encoded ahead of GIMP, 0 = off):", 0, (0, 16, 1) ),
+	( PF_SPINNER, "MemoryCapMb", "Pipeline Memory Cap (MB of flattened pages waiting to encode):", 1024, (64, 65536, 64) ),
+	( PF_BOOL, "Passthrough", "Copy Untouched Pages? (Copies the source .jpg when every layer added by prep is still empty):", False ),
+	( PF_BOOL, "Recursive", "Recursive? (Include sub directories, mirrored under the destination):", False ),
+	( PF_STRING, "Include", "Include (file name or relative path globs, ; separated, empty for all):", "" ),
+	( PF_STRING, "Exclude", "Exclude (file or directory globs, ; separated):", "" ),
+	( PF_BOOL, "SharedQueue", "Shared Queue? (Split the pages with other GIMPs, on any host, exporting the same directory):", False ),
+	( PF_SPINNER, "TargetSizeKb", "Target Size (KB per page, searches quality up to the slider above, 0 = off):", 0, (0, 100000, 10) ),
+	( PF_FLOAT, "MinSimilarity", "Minimum Similarity (SSIM to the lossless page, e.g. 0.98, searches the lowest quality that keeps it, 0 = off):", 0.0 ),
+	( PF_STRING, "ArchiveName", "Archive (e.g. chapter.cbz, written into the destination instead of .jpg files, empty for .jpg files):", "" ),
+    ],
+    [],
+    batch_xcf_export_jpg_advanced,   # Matches to name of function being defined
+    menu = "<Image>/Image/Batch Image Prep"  # Menu Location
+    )   # End register
+
+register (
+    "batch_xcf_export_jpg_variants",         # Name registered in Procedure Browser
+    N_("Export all xcf in a source directory to full, cleaned and text only jpgs, loading each xcf once."), # Widget title
+    "Export all xcf in a source directory to jpg, writing each chosen variant into its own sub directory (full, cleaned, text) of the destination dir.", # 
+    "LearnCodeWithH",         # Author
+    "LearnCodeWithH",         # Copyright Holder
+    "Jan 2019",            # Date
+    N_("Export all .xcf to .jpg Variants"), # Menu Entry
+    "",     # Image Type - No image required
+    [
+    ( PF_DIRNAME, "srcPath", "Source .xcf Directory:", "/" ),
+    ( PF_DIRNAME, "dstPath", "Destination Directory (gets full/cleaned/text sub directories):", "/" ),
+    ( PF_BOOL, "exportFull", "Export Full? (All layers as saved):", True ),
+    ( PF_BOOL, "exportCleaned", "Export Cleaned? (Disabling any layer groups with 'Text Group' in them before export):", True ),
+    ( PF_BOOL, "exportText", "Export Text Only? (Disabling any layers without 'Text Group' in them before export):", True ),
 	
+	( PF_SLIDER, "Quality", "Quality:", 95, (0, 100, 1) ),
+	( PF_SLIDER, "Smoothing", "Smoothing:", 0, (0, 100, 1) ),
+	( PF_TOGGLE, "Optimize", "Optimize?:", 1 ),
+	( PF_TOGGLE, "Progressive", "Progressive?:", 1 ),
+	( PF_TEXT, "Comment", "Comment:", "Created with GIMP." ),
+	( PF_OPTION, "Subsampling", "Subsampling:", 2, ("4:2:0 (chroma quartered)", "4:2:2 Horizontal (chroma halved)", "4:4:4 (best quality)", "4:2:2 Vertical (chroma halved)") ),
+	( PF_OPTION, "DctMethod", "Dct Method:", 0, ("Integer", "Fixed", "Float") ),
+	( PF_SPINNER, "Workers", "Worker Processes (0 = one per CPU, 1 = this GIMP only):", 0, (0, 64, 1) ),
+	( PF_OPTION, "Backend", "Backend:", 0, ("GIMP", "NumPy compositor (GIMP for pages it can't composite)") ),
+	( PF_BOOL, "Passthrough", "Copy Untouched Pages? (Copies the source .jpg when every layer added by prep is still empty):", False ),
+	( PF_BOOL, "Recursive", "Recursive? (Include sub directories, mirrored under the destination):", False ),
+	( PF_STRING, "Include", "Include (file name or relative path globs, ; separated, empty for all):", "" ),
+	( PF_STRING, "Exclude", "Exclude (file or directory globs, ; separated):", "" ),
+	( PF_SPINNER, "TargetSizeKb", "Target Size (KB per page, searches quality up to the slider above, 0 = off):", 0, (0, 100000, 10) ),
+	( PF_FLOAT, "MinSimilarity", "Minimum Similarity (SSIM to the lossless page, e.g. 0.98, searches the lowest quality that keeps it, 0 = off):", 0.0 ),
+    ],
+    [],
+    batch_xcf_export_jpg_variants,   # Matches to name of function being defined
+    menu = "<Image>/Image/Batch Image Prep"  # Menu Location
+    )   # End register
+
+@profiler.profiled
+def batch_xcf_export_profiles(srcPath, dstPath, exportCleaned, exportText, profileFile, Workers, Backend, Recursive, Include, Exclude):
+	batch_opts = BatchExportOptions(worker_count = Workers, backend = Backend)
+	export_xcf_in_directory_to_profiles(srcPath, dstPath, exportCleaned, exportText, profileFile, batch_opts, ScanFilter(Recursive, Include, Exclude))
+
+register (
+    "batch_xcf_export_profiles",         # Name registered in Procedure Browser
+    N_("Export all xcf in a source directory through output profiles (formats and sizes), flattening each xcf once."), # Widget title
+    "Export all xcf in a source directory once per output profile (e.g. png master, webp preview, jpg thumbnail), each profile into its own sub directory of the destination dir.", # 
+    "LearnCodeWithH",         # Author
+    "LearnCodeWithH",         # Copyright Holder
+    "Jan 2019",            # Date
+    N_("Export all .xcf with Output Profiles"), # Menu Entry
+    "",     # Image Type - No image required
+    [
+    ( PF_DIRNAME, "srcPath", "Source .xcf Directory:", "/" ),
+    ( PF_DIRNAME, "dstPath", "Destination Directory (gets a sub directory per profile):", "/" ),
+    ( PF_BOOL, "exportCleaned", "Export Cleaned? (Disabling any layer groups with 'Text Group' in them before export):", False ),
+    ( PF_BOOL, "exportText", "Export Text Only? (Disabling any layers without 'Text Group' in them before export):", False ),
+    ( PF_FILE, "profileFile", "Output Profiles (.json or .yaml, empty for png master, 1200px webp and 400px jpg):", "" ),
+	
+	( PF_SPINNER, "Workers", "Worker Processes (0 = one per CPU, 1 = this GIMP only):", 0, (0, 64, 1) ),
+	( PF_OPTION, "Backend", "Backend:", 0, ("GIMP", "NumPy compositor (GIMP for pages it can't composite)") ),
+	( PF_BOOL, "Recursive", "Recursive? (Include sub directories, mirrored under the destination):", False ),
+	( PF_STRING, "Include", "Include (file name or relative path globs, ; separated, empty for all):", "" ),
+	( PF_STRING, "Exclude", "Exclude (file or directory globs, ; separated):", "" ),
+    ],
+    [],
+    batch_xcf_export_profiles,   # Matches to name of function being defined
+    menu = "<Image>/Image/Batch Image Prep"  # Menu Location
+    )   # End register
+
+register (
+    "batch_xcf_export_jpg_worker",         # Name registered in Procedure Browser
+    "Exports one shard of a parallel batch_xcf_export_jpg_advanced run.", # Widget title
+    "Exports the .xcf files listed in a job file written by batch_xcf_export_jpg_advanced, appending a result line per file.", #
+    "LearnCodeWithH",         # Author
+    "LearnCodeWithH",         # Copyright Holder
+    "Jan 2019",            # Date
+    "", # Menu Entry - none, started headless by batch_xcf_export_jpg_advanced
+    "",     # Image Type - No image required
+    [
+    ( PF_STRING, "jobFile", "Job File:", "" ),
+    ],
+    [],
+    batch_xcf_export_jpg_worker   # Matches to name of function being defined
+    )   # End register
+
 main()
@@ -2,103 +2,272 @@
 
 from gimpfu import *
 import os
-import re
+import shutil
+import tempfile
+import time
 
-def prep(image, base_layer_pos):
-	add_layer(image, 'Clean Layer', None, base_layer_pos - 1)
-	
-	corrections_group = add_layer_group(image, 'Corrections', base_layer_pos - 2)
-	add_layer(image, 'Clean Corrections', corrections_group, 0)
-	add_layer(image, 'Line Corrections', corrections_group, -1)
-	add_layer_group(image, 'SFX Text Group', base_layer_pos - 3)
-	add_layer_group(image, 'Text Group', base_layer_pos - 4)
+from gimp_workflow import journal
+from gimp_workflow import passthrough
+from gimp_workflow import profiler
+from gimp_workflow import scanner
+from gimp_workflow import workers
+from gimp_workflow.scanner import ScanFilter
+from gimp_workflow.templates import LayerTemplate
+
+pdb = profiler.instrument(pdb) # times every PDB call when GIMP_WORKFLOW_PROFILE is set
+
+SOURCE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+DEFAULT_TEMPLATE = LayerTemplate.load(None)
+
+def prep(image, template, compact=False):
+	# Specs come parents first and siblings bottom up, so inserting each at the top of its
+	# parent builds the stack with one create and one insert per layer.
+	created = []
+	for spec in template.specs:
+		parent = None
+		if spec.parent is not None:
+			parent = created[spec.parent]
+		if spec.is_group:
+			item = add_layer_group(image, spec.name, 0, parent)
+			if spec.opacity != 100.0:
+				item.opacity = spec.opacity
+			if spec.mode != NORMAL_MODE:
+				item.mode = spec.mode
+		else:
+			item = add_layer(image, spec.name, parent, 0, compact, spec.opacity, spec.mode)
+		if not spec.visible:
+			item.visible = False
+		created.append(item)
 	
-def add_layer_group(image, title, position):
+def add_layer_group(image, title, position, parent=None):
 	group = pdb.gimp_layer_group_new(image)
 	group.name = title
 
-	pdb.gimp_image_insert_layer(image, group, None, position)
+	pdb.gimp_image_insert_layer(image, group, parent, position)
 	return group
 	
-def add_layer(image, title, parent, position):
+def add_layer(image, title, parent, position, compact=False, opacity=100, mode=NORMAL_MODE):
+	width = image.width
+	height = image.height
+	if compact:
+		# 1x1 placeholder, grown to canvas size by expand_prep_layers before painting.
+		width = 1
+		height = 1
 	layer = gimp.Layer(image, title,
-							image.width, image.height,
-							RGBA_IMAGE, 100, NORMAL_MODE)
+							width, height,
+							RGBA_IMAGE, opacity, mode)
 
 	pdb.gimp_image_insert_layer(image, layer, parent, position)
 	return layer
 
-def prep_image(image):
-	base_layer_pos = 0
+def prep_image(image, compact=False, template=None):
+	if template is None:
+		template = DEFAULT_TEMPLATE
 	
-	prep(image, base_layer_pos)
+	prep(image, template, compact)
 	
 	return image
 
 def generate_new_filename_map(fileList):
-	oldFileList = []
-	newFileList = []
-	xform = re.compile('\.(jpg|jpeg|png)', re.IGNORECASE)
-	# Find all of the jpg/jpeg/png files in the list & make xcf file names
+	# Dictionary - old & new file names of the jpg/jpeg/png files in the list
+	fileDict = {}
 	for fname in fileList:
-		fnameLow = fname.lower()
-		if fnameLow.endswith('.jpg') or fnameLow.endswith('.jpeg') or fnameLow.endswith('.png'):
-			oldFileList.append(fname)
-			newFileList.append(xform.sub('.xcf',fname))
-	# Dictionary - old & new file names
-	fileDict = dict(zip(oldFileList, newFileList))
+		if os.path.splitext(fname)[1].lower() in SOURCE_EXTENSIONS:
+			fileDict[fname] = scanner.replace_extension(fname, '.xcf')
 	return fileDict
+
+def scan_prep_items(imgPath, scan_filter=None):
+	# (old, new) names relative to imgPath, the xcf is saved next to its source
+	items = []
+	queued = set()
+	for rel_dir, fname, names in scanner.scan_files(imgPath, SOURCE_EXTENSIONS, scan_filter):
+		newName = scanner.replace_extension(fname, '.xcf')
+		newFile = os.path.join(rel_dir, newName)
+		# Don't overwrite existing, might be work in Progress
+		if newName in names or newFile in queued:
+			continue
+		queued.add(newFile)
+		items.append((os.path.join(rel_dir, fname), newFile))
+	return items
 	
-def prep_images_to_xcf(imgPath):
-    open_images, image_ids = pdb.gimp_image_list()
-    if open_images > 0:
-        pdb.gimp_message ("Close open Images & Rerun")
-    else:
+def delete_batch_images(image_ids):
+	# Closes whatever a failed page left open, image_ids were open before the batch.
+	for image in gimp.image_list():
+		if image.ID not in image_ids:
+			try:
+				pdb.gimp_image_delete(image)
+			except RuntimeError:
+				pass # opened with a display meanwhile, that's the user's
+
+def load_source_image(fullOldFile):
+	theImage = None
+	oldFileLower = fullOldFile.lower()
+	if oldFileLower.endswith('.jpg') or oldFileLower.endswith('.jpeg'):
+		theImage = pdb.file_jpeg_load(fullOldFile, fullOldFile)
+	elif oldFileLower.endswith('.png'):
+		theImage = pdb.file_png_load(fullOldFile, fullOldFile)
+	return theImage
+
+def prep_image_file(fullOldFile, fullNewFile, compact=False, template=None):
+	with profiler.phase('load'):
+		theImage = load_source_image(fullOldFile)
+	if theImage is None:
+		raise ValueError("Unsupported format: %s" % fullOldFile)
+		
+	image_type = pdb.gimp_image_base_type(theImage)
+	if image_type is not 0: #RGB
+		pdb.gimp_image_convert_rgb(theImage)
+	preppedImage = None
+	try:
+		if os.path.splitext(fullOldFile)[1].lower() in passthrough.SOURCE_EXTENSIONS:
+			with profiler.phase('fingerprint'):
+				# lets export copy the source jpg while it and the base layer are unchanged
+				fingerprint = passthrough.prep_fingerprint(fullOldFile, theImage.layers[0])
+				theImage.attach_new_parasite(passthrough.PARASITE_NAME, passthrough.PARASITE_PERSISTENT, fingerprint)
+		with profiler.phase('prep'):
+			preppedImage = prep_image(theImage, compact, template)
+		theDrawable = preppedImage.active_drawable
+		with profiler.phase('save'):
+			# a crash mid save must not leave a .xcf behind, the next run would skip it as work in progress
+			journal.write_atomically(fullNewFile, lambda path: pdb.gimp_xcf_save(0, preppedImage, theDrawable, path, path))
+	finally:
+		if preppedImage is not None:
+			pdb.gimp_image_delete(preppedImage)
+
+def prep_file_items(imgPath, items, on_result, compact=False, template=None):
+	# Keep going past a bad file so the summary covers the whole batch.
+	for oldFile, newFile in items:
+		fullNewFile = os.path.join(imgPath, newFile)
+		fullOldFile = os.path.join(imgPath, oldFile)
+		try:
+			prep_image_file(fullOldFile, fullNewFile, compact, template)
+			on_result(workers.item_result(oldFile, True))
+		except Exception as e:
+			on_result(workers.item_result(oldFile, False, str(e)))
+
+def prep_images_in_parallel(imgPath, items, workerCount, compact=False, templateFile='', journalFile=None):
+	job = { 'imgPath': imgPath, 'compact': compact, 'templateFile': templateFile, 'journal': journalFile }
+	pool = workers.WorkerPool('prep_images_to_xcf_worker', workerCount)
+	try:
+		results = pool.run(job, items)
+	except OSError as e:
+		pdb.gimp_message("Could not start '%s' (%s), prepping in this process." % (pool.gimp_executable, e))
+		results = []
+		prep_file_items(imgPath, items, journal.recording(results.append, journalFile, imgPath), compact, LayerTemplate.load(templateFile))
+	pdb.gimp_message(workers.summarize(results))
+	return results
+	
+def prep_images_in_directory(imgPath, Workers=1, Compact=False, templateFile='', Recursive=False, Include='', Exclude=''):
+	# Images already open are left alone, only ones the batch itself opened get closed
+	open_images, image_ids = pdb.gimp_image_list()
+	try:
 		# Ensure 2.7 byte strings are unicode
 		imgPath = unicode(imgPath, "utf-8")
-		# list all of the files in source & target directories
-		allFileList = os.listdir(imgPath)
-		fileDict = generate_new_filename_map(allFileList)
-		# Loop on jpegs, open each, prep & save as xcf
-		for oldFile in fileDict.keys():
-			# Don't overwrite existing, might be work in Progress
-			if fileDict[oldFile] not in allFileList:
-				# os.path.join inserts the right kind of file separator
-				
-				fullNewFile = os.path.join(imgPath, fileDict[oldFile])
-				fullOldFile = os.path.join(imgPath, oldFile)
-				
-				theImage = None
-				oldFileLower = oldFile.lower()
-				if oldFileLower.endswith('.jpg') or oldFileLower.endswith('.jpeg'):
-					theImage = pdb.file_jpeg_load(fullOldFile, fullOldFile)
-				elif oldFileLower.endswith('.png'):
-					theImage = pdb.file_png_load(fullOldFile, fullOldFile)
-				
-				if theImage is None:
-					pdb.gimp_message ("Skipping unsupported format: %s" % oldFile)
-					continue;
-					
-				image_type = pdb.gimp_image_base_type(theImage)
-				if image_type is not 0: #RGB
-					pdb.gimp_image_convert_rgb(theImage)
-				preppedImage = None
-				try:
-					preppedImage = prep_image(theImage)
-					theDrawable = preppedImage.active_drawable
-					pdb.gimp_xcf_save(0, preppedImage, theDrawable, fullNewFile, fullNewFile)
-				finally:
-					if preppedImage is not None:
-						pdb.gimp_image_delete(preppedImage)
+		# compile once for the whole batch, and fail before touching any file on a bad template
+		template = LayerTemplate.load(templateFile)
+		scan_filter = ScanFilter(Recursive, Include, Exclude)
+		# Picks up after a crashed or killed run with the same settings
+		params = { 'imgPath': imgPath, 'compact': Compact, 'templateFile': templateFile, 'scan': vars(scan_filter) }
+		batch_journal = journal.BatchJournal.load(imgPath, journal.PREP_JOURNAL_NAME, params)
+		items = batch_journal.pending(scan_prep_items(imgPath, scan_filter), imgPath)
+		if Workers != 1 and len(items) > 1:
+			results = prep_images_in_parallel(imgPath, items, Workers, Compact, templateFile, batch_journal.path)
+			if all(result['ok'] for result in results):
+				batch_journal.finish()
+			return
+		# Loop on jpegs, open each, prep & save as xcf, past any bad page
+		results = []
+		prep_file_items(imgPath, items, journal.recording(results.append, batch_journal.path, imgPath), Compact, template)
+		pdb.gimp_message(workers.summarize(results))
+		if all(result['ok'] for result in results):
+			batch_journal.finish()
+	finally:
+		delete_batch_images(image_ids)
 
-def prep_xcf_layers(Image):
+@profiler.profiled
+def prep_images_to_xcf(imgPath):
+	prep_images_in_directory(imgPath)
+
+@profiler.profiled
+def prep_images_to_xcf_advanced(imgPath, Workers, Compact, templateFile, Recursive, Include, Exclude):
+	prep_images_in_directory(imgPath, Workers, Compact, templateFile, Recursive, Include, Exclude)
+
+@profiler.profiled
+def prep_images_to_xcf_worker(jobFile):
+	job = workers.read_job(jobFile)
+	def record_result(result):
+		workers.append_result(job['results'], result)
+	template = LayerTemplate.load(job.get('templateFile'))
+	# the batch daemon reuses one GIMP for many jobs, don't let failed pages pile up in it
+	open_images, image_ids = pdb.gimp_image_list()
+	try:
+		prep_file_items(job['imgPath'], job['items'], journal.recording(record_result, job.get('journal'), job['imgPath']), job.get('compact', False), template)
+	finally:
+		delete_batch_images(image_ids)
+
+@profiler.profiled
+def measure_prep_xcf(imgPath, SampleCount):
+	# Images already open are left alone, only ones the measurement itself opened get closed
+	open_images, image_ids = pdb.gimp_image_list()
+	# Ensure 2.7 byte strings are unicode
+	imgPath = unicode(imgPath, "utf-8")
+	samples = sorted(generate_new_filename_map(os.listdir(imgPath)).items())
+	if SampleCount > 0:
+		samples = samples[:SampleCount]
+	tmpPath = tempfile.mkdtemp(prefix='gimp-prep-measure-')
+	try:
+		report = []
+		for compact in [False, True]:
+			total_bytes = 0
+			total_load = 0.0
+			for oldFile, newFile in samples:
+				fullNewFile = os.path.join(tmpPath, newFile)
+				prep_image_file(os.path.join(imgPath, oldFile), fullNewFile, compact)
+				total_bytes += os.path.getsize(fullNewFile)
+				start = time.time()
+				theImage = pdb.gimp_xcf_load(0, fullNewFile, fullNewFile)
+				total_load += time.time() - start
+				pdb.gimp_image_delete(theImage)
+				os.remove(fullNewFile)
+			label = "Compact" if compact else "Full size"
+			report.append("%s layers: %.1f MB of .xcf, %.2f s to load %d files." % (label, total_bytes / 1048576.0, total_load, len(samples)))
+		pdb.gimp_message('\n'.join(report))
+	finally:
+		delete_batch_images(image_ids)
+		shutil.rmtree(tmpPath, ignore_errors=True)
+
+def prep_open_image(Image, templateFile=''):
 	pdb.gimp_image_undo_group_start(Image)
 	try:
 		image_type = pdb.gimp_image_base_type(Image)
 		if image_type is not 0: #RGB
 			pdb.gimp_image_convert_rgb(Image)
 			pdb.gimp_message("Converted Image Mode to RGB to allow layer groups.")
-		preppedImage = prep_image(Image)
+		preppedImage = prep_image(Image, False, LayerTemplate.load(templateFile))
+	finally:
+		pdb.gimp_image_undo_group_end(Image)
+
+@profiler.profiled
+def prep_xcf_layers(Image):
+	prep_open_image(Image)
+
+@profiler.profiled
+def prep_xcf_layers_from_template(Image, templateFile):
+	prep_open_image(Image, templateFile)
+
+def expand_layers_to_image_size(image, layers):
+	for layer in layers:
+		if pdb.gimp_item_is_group(layer):
+			expand_layers_to_image_size(image, layer.layers)
+		elif layer.width == 1 and layer.height == 1 and not pdb.gimp_item_is_text_layer(layer):
+			pdb.gimp_layer_resize_to_image_size(layer)
+
+@profiler.profiled
+def expand_prep_layers(Image):
+	pdb.gimp_image_undo_group_start(Image)
+	try:
+		expand_layers_to_image_size(Image, Image.layers)
 	finally:
 		pdb.gimp_image_undo_group_end(Image)
 
@@ -118,6 +287,45 @@ register (
     prep_images_to_xcf,   # Matches to name of function being defined
     menu = "<Image>/Image/Batch Image Prep"  # Menu Location
     )   # End register
+
+register (
+    "prep_images_to_xcf_advanced",         # Name registered in Procedure Browser
+    N_("Insert Layers into Jpg/Jpeg/Png Images and Saves to .xcf"), # Widget title
+    "Adds a Cleaning Layer, a Text Layer Group, then saves to .xcf for every jpg/jpeg/png image in a directory, with workers, compact layers, a layer template and scan filter options.", # 
+    "LearnCodeWithH",         # Author
+    "LearnCodeWithH",         # Copyright Holder
+    "Jan 2019",            # Date
+    N_("Insert Layers and Save to Xcf (Advanced)"), # Menu Entry
+    "",     # Image Type - No image required
+    [
+    ( PF_DIRNAME, "imgPath", "Image Directory:", "/" ),
+    ( PF_SPINNER, "Workers", "Worker Processes (0 = one per CPU, 1 = this GIMP only):", 0, (0, 64, 1) ),
+    ( PF_BOOL, "Compact", "Compact? (1x1 placeholder layers, use Expand Prep Layers before painting):", False ),
+    ( PF_FILE, "templateFile", "Layer Template (.json, .yaml or reference .xcf, empty for the default layers):", "" ),
+    ( PF_BOOL, "Recursive", "Recursive? (Include sub directories, each .xcf is saved next to its image):", False ),
+    ( PF_STRING, "Include", "Include (file name or relative path globs, ; separated, empty for all):", "" ),
+    ( PF_STRING, "Exclude", "Exclude (file or directory globs, ; separated):", "" )
+    ],
+    [],
+    prep_images_to_xcf_advanced,   # Matches to name of function being defined
+    menu = "<Image>/Image/Batch Image Prep"  # Menu Location
+    )   # End register
+
+register (
+    "prep_images_to_xcf_worker",         # Name registered in Procedure Browser
+    "Preps one shard of a parallel prep_images_to_xcf_advanced run.", # Widget title
+    "Preps and saves the images listed in a job file written by prep_images_to_xcf_advanced, appending a result line per file.", # 
+    "LearnCodeWithH",         # Author
+    "LearnCodeWithH",         # Copyright Holder
+    "Jan 2019",            # Date
+    "", # Menu Entry - none, started headless by prep_images_to_xcf_advanced
+    "",     # Image Type - No image required
+    [
+    ( PF_STRING, "jobFile", "Job File:", "" )
+    ],
+    [],
+    prep_images_to_xcf_worker   # Matches to name of function being defined
+    )   # End register
 	
 	
 register (
@@ -136,5 +344,58 @@ register (
     prep_xcf_layers,   # Matches to name of function being defined
     menu = "<Image>/Image/Layer Prep This .xcf"  # Menu Location
     )   # End register
+
+register (
+    "prep_xcf_layers_from_template",         # Name registered in Procedure Browser
+    N_("Adds the layers of a layer template to this .xcf"), # Widget title
+    "Adds the layers of a layer template to this .xcf, or the default Cleaning Layer and Text Layer Group with no template.", # 
+    "LearnCodeWithH",         # Author
+    "LearnCodeWithH",         # Copyright Holder
+    "Jan 2019",            # Date
+    N_("Insert Layers to this .xcf from Template"), # Menu Entry
+    "",     # Image Type - No image required
+    [
+    ( PF_IMAGE, "Image", "Image", None ),
+    ( PF_FILE, "templateFile", "Layer Template (.json, .yaml or reference .xcf, empty for the default layers):", "" )
+    ],
+    [],
+    prep_xcf_layers_from_template,   # Matches to name of function being defined
+    menu = "<Image>/Image/Layer Prep This .xcf"  # Menu Location
+    )   # End register
+
+register (
+    "expand_prep_layers",         # Name registered in Procedure Browser
+    N_("Grows the compact prep placeholder layers of this .xcf to the image size"), # Widget title
+    "Resizes the 1x1 placeholder layers left by Compact prep to the image size.", # 
+    "LearnCodeWithH",         # Author
+    "LearnCodeWithH",         # Copyright Holder
+    "Jan 2019",            # Date
+    N_("Expand Prep Layers to Image Size"), # Menu Entry
+    "",     # Image Type - No image required
+    [
+    ( PF_IMAGE, "Image", "Image", None )
+    ],
+    [],
+    expand_prep_layers,   # Matches to name of function being defined
+    menu = "<Image>/Image/Layer Prep This .xcf"  # Menu Location
+    )   # End register
+
+register (
+    "measure_prep_xcf",         # Name registered in Procedure Browser
+    N_("Compares .xcf size and load time of full size and compact prep layers"), # Widget title
+    "Preps sample images from a directory both ways into a temporary directory and reports total .xcf bytes and load time of each.", # 
+    "LearnCodeWithH",         # Author
+    "LearnCodeWithH",         # Copyright Holder
+    "Jan 2019",            # Date
+    N_("Measure Compact Prep"), # Menu Entry
+    "",     # Image Type - No image required
+    [
+    ( PF_DIRNAME, "imgPath", "Image Directory:", "/" ),
+    ( PF_SPINNER, "SampleCount", "Sample Images (0 = all):", 10, (0, 10000, 1) )
+    ],
+    [],
+    measure_prep_xcf,   # Matches to name of function being defined
+    menu = "<Image>/Image/Batch Image Prep"  # Menu Location
+    )   # End register
 	
 main()